@@ -1,13 +1,40 @@
 import streamlit as st
 import pandas as pd
-import base64
-import time
+import numpy as np
 import json
+import os
+import time
+import gzip
+import tempfile
+import hashlib
+import struct
+import random
+import cProfile
+import marshal
+import copy
+import threading
+import socket
+import zlib
 import re  # 用於精準提取 JSON 和文字清洗
+import bisect
+import heapq
+import unicodedata
+import logging
 from io import BytesIO
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from gtts import gTTS
 import google.generativeai as genai
 from streamlit_gsheets import GSheetsConnection
+from streamlit_gsheets.gsheets_connection import GSheetsPublicSpreadsheetClient, GSheetsServiceAccountClient
+from gspread.exceptions import WorksheetNotFound
+from etymon_core import (
+    COL_NAMES, compact_value, compact_db, english_only,
+    DECODE_MODEL_FULL, DECODE_MODEL_LITE, DECODE_SYSTEM_INSTRUCTION, build_decode_model, build_decode_prompt,
+    parse_decode_result,
+)
 
 # ==========================================
 # 1. 核心配置與視覺美化 (CSS)
@@ -78,7 +105,9 @@ def fix_content(text):
     2. 先處理換行，再處理 LaTeX 轉義，避免衝突。
     3. 針對 Markdown 換行需求優化。
     """
-    if text is None or str(text).strip() in ["無", "nan", ""]:
+    if text is None or (not isinstance(text, str) and pd.isna(text)):
+        return ""
+    if str(text).strip() in ["無", "nan", ""]:
         return ""
     
     # 確保是字串類型
@@ -99,180 +128,1961 @@ def fix_content(text):
     
     return text
 
-def speak(text, key_suffix=""):
-    if not text: return
-    
-    # 1. 英語濾網
-    english_only = re.sub(r"[^a-zA-Z0-9\s\-\']", " ", str(text))
-    english_only = " ".join(english_only.split()).strip()
-    if not english_only: return
+AUDIO_TTL = 30 * 24 * 3600
+TTS_WORKERS = 4        # 同時合成的上限
+TTS_TIMEOUT = 8        # 單次 gTTS 請求的秒數上限
+TTS_WAIT = 1.5         # 按下發音後最多等幾秒 (逾時改顯示重試按鈕，合成在背景繼續)
+TTS_KEEP = 256         # 保留的合成結果 (future) 數量
+
+@st.cache_data(show_spinner=False, max_entries=2000)
+def synth_audio(text):
+    """用 Google 轉出 MP3 bytes；同一段文字只合成一次 (先查 L2，其他副本合成過就直接用)"""
+    key = cache_key("audio", "en", text)
+    cached = l2_get(key)
+    if cached:
+        return cached
+
+    tts = gTTS(text=text, lang='en', timeout=TTS_TIMEOUT)
+    fp = BytesIO()
+    tts.write_to_fp(fp)
+    audio = fp.getvalue()
+    l2_set(key, audio, ttl=AUDIO_TTL)
+    return audio
+
+class AudioPrefetcher:
+    """
+    多張卡片的發音平行合成：所有 session 共用一個有上限的執行緒池，
+    同一段文字只送出一次，失敗的結果留著讓畫面顯示重試按鈕。
+    """
+    def __init__(self, workers=TTS_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+        self.futures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, text, retry=False):
+        with self._lock:
+            future = self.futures.get(text)
+            if future is None or (retry and future.done() and future.exception() is not None):
+                future = self.pool.submit(synth_audio, text)
+                self.futures[text] = future
+                self._trim()
+            self.futures.move_to_end(text)
+            return future
+
+    def failed(self, text):
+        future = self.futures.get(text)
+        return future is not None and future.done() and future.exception() is not None
+
+    def running(self, text):
+        future = self.futures.get(text)
+        return future is not None and not future.done()
+
+    def _trim(self):
+        for key in list(self.futures):
+            if len(self.futures) <= TTS_KEEP:
+                break
+            if self.futures[key].done():
+                del self.futures[key]
+
+@st.cache_resource
+def get_audio_prefetcher():
+    return AudioPrefetcher()
+
+def prefetch_audio(words):
+    """頁面渲染前先把可見卡片的發音全部丟進執行緒池，不等結果"""
+    prefetcher = get_audio_prefetcher()
+    for word in words:
+        spoken = english_only(word)
+        if spoken:
+            prefetcher.submit(spoken)
+
+def _play_audio(spoken, retry=False):
+    slow = st.session_state.setdefault('tts_slow', set())
+    try:
+        audio = get_audio_prefetcher().submit(spoken, retry=retry).result(timeout=TTS_WAIT)
+    except FuturesTimeout:
+        # 不卡住整頁：合成留在背景繼續跑，重跑後在原位置改顯示重試按鈕
+        slow.add(spoken)
+        st.rerun()
+    except Exception as e:
+        slow.discard(spoken)
+        st.error(f"語音生成失敗: {e}")
+        return
+    slow.discard(spoken)
+    st.audio(audio, format="audio/mp3", autoplay=True)
+
+def speak(text, key_suffix=""):
+    """
+    發音按鈕：
+    - 渲染時只放一顆按鈕，頁面不再夾帶任何音訊資料。
+    - 按下後取用 AudioPrefetcher 的結果 (已預先合成就立即播放)，最多等 TTS_WAIT 秒。
+    - 先前合成失敗、或上次等太久還沒合成完的文字改顯示重試按鈕，不會卡住整頁。
+    """
+    if not text: return
+    spoken = english_only(text)
+    if not spoken: return
+
+    key = f"speak_{key_suffix}_{spoken}"
+    prefetcher = get_audio_prefetcher()
+    still_slow = spoken in st.session_state.get('tts_slow', ()) and prefetcher.running(spoken)
+    if prefetcher.failed(spoken) or still_slow:
+        if still_slow:
+            st.caption("⏳ 發音合成較慢，已在背景繼續，稍後再按重試即可播放。")
+        if st.button("🔁 重試發音", key=f"retry_{key}", use_container_width=True):
+            _play_audio(spoken, retry=True)
+    elif st.button("🔊 聽發音", key=key, use_container_width=True):
+        _play_audio(spoken)
+
+def get_spreadsheet_url():
+    """安全地獲取試算表網址，相容兩種 secrets 格式"""
+    try:
+        return st.secrets["connections"]["gsheets"]["spreadsheet"]
+    except:
+        try:
+            return st.secrets["gsheets"]["spreadsheet"]
+        except:
+            st.error("找不到 spreadsheet 設定，請檢查 secrets.toml")
+            return ""
+def track_intent(label):
+    """紀錄用戶意願 (點擊次數) 到 Google Sheets 的 metrics 分頁"""
+    try:
+        conn = st.connection("gsheets", type=GSheetsConnection)
+        url = get_spreadsheet_url()
+        # metrics 分頁欄位為 feature_name, count；先寫入本地日誌，背景再累加回雲端
+        journal_write('metric', {'label': label, 'key': 'feature_name'}, conn, url)
+    except Exception as e:
+        # 靜默處理，不干擾用戶
+        pass
+# ==========================================
+# 2-1. 跨副本共用快取 (L2)
+# ==========================================
+# 每個 Streamlit 副本各自有 st.cache_data (L1)；L2 放在共用磁碟或 Redis，
+# 讓資料庫快照、發音與 AI 解碼結果在副本之間共用。
+# 設定方式 (secrets.toml)：
+#   [cache]
+#   backend = "file"            # "file" / "redis" / "none"
+#   path = "/mnt/shared/etymon" # backend = "file" 時的共用目錄
+#   url = "redis://host:6379/0" # backend = "redis" 時的連線字串
+CACHE_NAMESPACE = "etymon"
+DEFAULT_CACHE_DIR = ".etymon_cache"
+FILE_CACHE_SWEEP_SECONDS = 600   # 每個副本最多每 10 分鐘在背景清一次過期檔案
+
+log = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 flock，只靠 os.replace 的原子性
+    fcntl = None
+
+class FileCache:
+    """
+    共用磁碟版 L2 (也是 Redis 的本地替身)：
+    每個 key 一個檔案，內容為「8 bytes 到期時間 + 資料」，
+    寫入先寫暫存檔再 os.replace；計數器用 flock 鎖住讀改寫。
+    過期的檔案讀取時當作未命中，另由 set 觸發的背景清理刪除，目錄不會無限長大。
+    """
+    def __init__(self, root=DEFAULT_CACHE_DIR, fallback_reason=None):
+        self.root = root
+        self.fallback_reason = fallback_reason   # 設定為 Redis 卻退回本地檔案時的原因
+        self._last_sweep = time.time()
+        self._sweep_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+        except FileNotFoundError:
+            return None
+        expires_at = struct.unpack(">d", blob[:8])[0]
+        if expires_at and expires_at < time.time():
+            return None
+        return blob[8:]
+
+    def set(self, key, value, ttl=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        expires_at = time.time() + ttl if ttl else 0.0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(struct.pack(">d", expires_at) + value)
+        os.replace(tmp_path, path)
+        self._maybe_sweep()
+
+    def _maybe_sweep(self):
+        """距離上次清理超過 FILE_CACHE_SWEEP_SECONDS 就開一條背景執行緒清理 (同時只有一條)"""
+        if time.time() - self._last_sweep < FILE_CACHE_SWEEP_SECONDS:
+            return
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        self._last_sweep = time.time()
+
+        def run():
+            try:
+                self.sweep()
+            except Exception as e:
+                log.warning("L2 檔案快取清理失敗：%s", e)
+            finally:
+                self._sweep_lock.release()
+
+        threading.Thread(target=run, name="l2-sweep", daemon=True).start()
+
+    def sweep(self, now=None):
+        """刪除已過期的項目 (只讀每個檔案開頭 8 bytes)，回傳刪除的檔案數；沒有 TTL 的項目 (計數器) 不動"""
+        now = now or time.time()
+        removed = 0
+        for sub in os.listdir(self.root):
+            sub_dir = os.path.join(self.root, sub)
+            if len(sub) != 2 or not os.path.isdir(sub_dir):
+                continue     # snapshots / jobs 等其他用途的目錄
+            for name in os.listdir(sub_dir):
+                if len(name) != 40:
+                    continue     # .lock 與寫到一半的暫存檔
+                path = os.path.join(sub_dir, name)
+                try:
+                    with open(path, "rb") as f:
+                        expires_at = struct.unpack(">d", f.read(8))[0]
+                    if expires_at and expires_at < now:
+                        os.remove(path)
+                        removed += 1
+                except (OSError, struct.error):
+                    continue     # 其他副本剛好刪掉或正在改寫
+        return removed
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def incr(self, key):
+        lock_path = self._path(key) + ".lock"
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                value = int(self.get(key) or 0) + 1
+                self.set(key, str(value).encode())
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        return value
+
+class RedisCache:
+    """Redis 協定的 L2 (redis / KeyDB / Valkey 皆可)"""
+    def __init__(self, url):
+        import redis
+        self._r = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self._r.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._r.set(key, value, ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self._r.delete(key)
+
+    def incr(self, key):
+        return int(self._r.incr(key))
+
+def make_l2_cache(cfg):
+    """
+    依 [cache] 設定建立 L2；Redis 套件缺少或連線失敗時退回本地檔案快取，
+    並記錄警告 (fallback_reason 會顯示在管理員側欄，避免多副本默默各用各的快取)。
+    """
+    backend = cfg.get("backend", "file")
+    if backend == "none":
+        return None
+    fallback_reason = None
+    if backend == "redis":
+        try:
+            cache = RedisCache(cfg["url"])
+            cache.get(f"{CACHE_NAMESPACE}:ping")
+            return cache
+        except Exception as e:
+            fallback_reason = f"Redis 無法使用 ({type(e).__name__}: {e})，已改用本地檔案快取"
+            log.warning("L2 快取：%s", fallback_reason)
+    return FileCache(cfg.get("path", DEFAULT_CACHE_DIR), fallback_reason=fallback_reason)
+
+@st.cache_resource
+def get_l2_cache():
+    """依 secrets 建立 L2 (每個副本一份；Redis 退回檔案快取後要重新啟動才會再連)"""
+    try:
+        cfg = dict(st.secrets.get("cache", {}))
+    except Exception:
+        cfg = {}
+    return make_l2_cache(cfg)
+
+def l2_get(key):
+    """L2 讀取：任何錯誤都當作未命中，快取層不能讓 App 掛掉"""
+    cache = get_l2_cache()
+    if cache is None:
+        return None
+    try:
+        return cache.get(key)
+    except Exception:
+        return None
+
+def l2_set(key, value, ttl=None):
+    cache = get_l2_cache()
+    if cache is None:
+        return
+    try:
+        cache.set(key, value, ttl)
+    except Exception:
+        pass
+
+@st.cache_data(ttl=5, show_spinner=False)
+def current_generation():
+    """全域快取世代：每個副本每 5 秒最多讀一次，管理員同步後各副本會換到新的鍵空間"""
+    raw = l2_get(f"{CACHE_NAMESPACE}:generation")
+    return int(raw) if raw else 0
+
+def bump_generation():
+    """讓所有副本的版本化快取 (資料庫快照等) 一起失效"""
+    cache = get_l2_cache()
+    current_generation.clear()
+    if cache is None:
+        return 0
+    try:
+        return cache.incr(f"{CACHE_NAMESPACE}:generation")
+    except Exception:
+        return 0
+
+# --- 變更紀錄 (change feed)：單筆寫入只通知有變動的條目，不必整份快照失效 ---
+FEED_TTL = 24 * 3600
+FEED_HEAD_KEY = f"{CACHE_NAMESPACE}:feed:head"
+
+def read_feed_head():
+    raw = l2_get(FEED_HEAD_KEY)
+    return int(raw) if raw else 0
+
+@st.cache_data(ttl=5, show_spinner=False)
+def feed_head():
+    """最新的變更序號：和世代一樣每個副本每 5 秒最多讀一次"""
+    return read_feed_head()
+
+def publish_change(row):
+    """
+    把一筆整列 upsert 寫進變更紀錄，回傳序號 (沒有 L2 時回傳 None，只有本副本會套用)。
+    其他副本在下一次 feed_head 更新時讀到並就地修補快照。
+    """
+    cache = get_l2_cache()
+    if cache is None:
+        return None
+    try:
+        seq = cache.incr(FEED_HEAD_KEY)
+        cache.set(f"{CACHE_NAMESPACE}:feed:{seq}",
+                  json.dumps(row, ensure_ascii=False, default=str).encode("utf-8"), FEED_TTL)
+    except Exception:
+        return None
+    feed_head.clear()
+    return seq
+
+def read_changes(since, head):
+    """讀取序號 (since, head] 的變更；有任何一筆讀不到 (過期或尚未寫完) 就回傳 None"""
+    changes = []
+    for seq in range(since + 1, head + 1):
+        raw = l2_get(f"{CACHE_NAMESPACE}:feed:{seq}")
+        if raw is None:
+            return None
+        changes.append(json.loads(raw))
+    return changes
+
+def cache_key(kind, *parts, generation=None):
+    """
+    L2 鍵空間：etymon:<kind>:<digest> 為不隨世代變動的資料 (發音、AI 結果)；
+    etymon:g<世代>:<kind>:<digest> 為會被「強制同步」淘汰的資料 (資料庫快照)。
+    """
+    digest = hashlib.sha1("\x1f".join(map(str, parts)).encode("utf-8")).hexdigest()
+    if generation is None:
+        return f"{CACHE_NAMESPACE}:{kind}:{digest}"
+    return f"{CACHE_NAMESPACE}:g{generation}:{kind}:{digest}"
+
+def df_to_bytes(df):
+    buf = BytesIO()
+    df.to_parquet(buf, index=False)
+    return buf.getvalue()
+
+def df_from_bytes(blob):
+    return pd.read_parquet(BytesIO(blob))
+
+def to_sheet_layout(df):
+    """compact_db 的反向：還原成試算表慣用的「全文字 + 無」格式 (匯出 / 回寫用)"""
+    out = df.astype(object)
+    out = out.where(out.notna(), "無")
+    if 'term' in out.columns:
+        out['term'] = df['term'].astype(object).where(df['term'].notna(), 0)
+    return out
+
+def memory_report(df, n_rows=100_000):
+    """
+    將目前資料重抽樣放大到 n_rows 列，比較舊佈局 (object + 「無」) 與 compact_db 的記憶體。
+    回傳每欄位的 bytes 對照表 (最後一列為總計)。
+    """
+    if df.empty:
+        return pd.DataFrame(columns=['legacy_bytes', 'compact_bytes', 'ratio'])
+    big = df.sample(n_rows, replace=True, random_state=0).reset_index(drop=True)
+    legacy = to_sheet_layout(big).astype(object)
+    compact = compact_db(legacy)
+
+    report = pd.DataFrame({
+        'legacy_bytes': legacy.memory_usage(deep=True, index=False),
+        'compact_bytes': compact.memory_usage(deep=True, index=False),
+    })
+    report.loc['總計'] = report.sum()
+    report['ratio'] = (report['compact_bytes'] / report['legacy_bytes']).round(3)
+    return report
+
+# ==========================================
+# Google Sheets 呼叫保護：指數退避 + 斷路器
+# ==========================================
+class SheetsUnavailable(Exception):
+    """斷路器開啟中，暫時不呼叫 Google Sheets"""
+
+class CircuitBreaker:
+    """
+    連續失敗 failure_threshold 次就斷路 cooldown 秒，期間直接拒絕呼叫；
+    冷卻結束後只放行一次試探 (half-open)，試探有結果之前其他呼叫照樣拒絕；成功才恢復。
+    """
+    def __init__(self, failure_threshold=3, cooldown=60):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None and (self.probing or time.time() - self.opened_at < self.cooldown)
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self.probing and time.time() - self.opened_at >= self.cooldown:
+                # half-open：只讓這一次通過，等 record_success / record_failure 決定
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                # 試探失敗立刻重新斷路
+                self.opened_at = time.time()
+            self.probing = False
+
+@st.cache_resource
+def get_sheets_breaker():
+    """整個副本共用一個斷路器：配額用完時所有 session 一起退讓"""
+    return CircuitBreaker()
+
+def call_sheets(fn, *args, retries=3, base_delay=1.0, passthrough=(), **kwargs):
+    """
+    以指數退避 (含隨機抖動) 重試 Google Sheets 呼叫，並經過斷路器。
+    重試用完仍失敗才算一次斷路器失敗；斷路中直接拋出 SheetsUnavailable。
+    passthrough 裡的例外 (例如找不到工作表) 是服務正常的回應：直接拋出、不重試，斷路器視為成功。
+    """
+    breaker = get_sheets_breaker()
+    if not breaker.allow():
+        raise SheetsUnavailable("Google Sheets 暫時無法使用 (斷路中)，請稍後再試")
+    for attempt in range(retries):
+        try:
+            result = fn(*args, **kwargs)
+        except passthrough:
+            breaker.record_success()
+            raise
+        except Exception:
+            if attempt == retries - 1:
+                breaker.record_failure()
+                raise
+            time.sleep(base_delay * (2 ** attempt) + random.uniform(0, base_delay))
+        else:
+            breaker.record_success()
+            return result
+
+# ==========================================
+# Google Sheets 寫入日誌 (write-ahead journal)
+# ==========================================
+# 所有對外寫入 (回報、點擊計數、解碼實驗室存檔) 先追加到本地 JSONL 再立即返回，
+# 由背景重放器批次寫回試算表；試算表掛掉時條目留在日誌裡，恢復後再補寫。
+FEEDBACK_URL = "https://docs.google.com/spreadsheets/d/1NNfKPadacJ6SDDLw9c23fmjq-26wGEeinTbWcg7-gFg/edit?gid=0#gid=0"
+JOURNAL_PATH = os.path.join(DEFAULT_CACHE_DIR, "sheets_journal.jsonl")
+JOURNAL_RETRY_SECONDS = 30   # 重放失敗後，至少隔這麼久才再試
+
+@contextmanager
+def _flocked(path, blocking=True):
+    """跨行程的檔案鎖 (沒有 fcntl 的平台只靠行程內的鎖)；非阻塞且被占用時產生 False"""
+    with open(path, "a") as lock:
+        if not fcntl:
+            yield True
+            return
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _json_default(v):
+    return v.item() if hasattr(v, "item") else str(v)
+
+class SheetsJournal:
+    """
+    只追加的寫入日誌：每行一筆 {"id", "op", "payload", "ts"}，套用成功後追加 {"ack": id}。
+    - append 會 fsync，行程當掉也不會遺失已返回的寫入。
+    - 重放依 op 分組，每組只做一次「讀整表 → 合併 → 整表寫回」；寫回前先記 {"applying": [id...]}，成功才 ack。
+    - entry 以 word 為鍵 upsert，重放幾次結果都一樣；report 照原本的語意附加在回饋表單最後，
+      帶有 applying 記號的條目 (上次寫到一半中斷) 會先比對表尾，已經寫進去的就不再附加；
+      metric 是累加，只有在「寫回成功但 ack 尚未落地」時中斷才可能多算一次。
+    - 全部 ack 後把日誌壓縮成只剩未完成的條目 (applying 記號保留在條目的 _applying 欄)。
+    """
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self.flushing = False
+        self.last_failure = 0.0
+        self.last_error = None
+        self.pending = len(self._read_pending())
+
+    def _read_pending(self):
+        entries, acked, applying = [], set(), set()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue   # 寫到一半的最後一行
+                    if 'ack' in rec:
+                        acked.add(rec['ack'])
+                    elif 'applying' in rec:
+                        applying.update(rec['applying'])
+                    else:
+                        entries.append(rec)
+        except FileNotFoundError:
+            pass
+        pending = [e for e in entries if e['id'] not in acked]
+        for e in pending:
+            e['_applying'] = bool(e.get('_applying')) or e['id'] in applying
+        return pending
+
+    def pending_payloads(self, op):
+        """尚未寫回試算表的某種條目 (讀快照時疊加用)"""
+        with self._lock, _flocked(f"{self.path}.lock"):
+            return [e['payload'] for e in self._read_pending() if e['op'] == op]
+
+    def _write_lines(self, records):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for rec in records:
+                f.write(json.dumps(rec, ensure_ascii=False, default=_json_default) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, op, payload):
+        entry = {'id': f"{time.time_ns():x}-{random.getrandbits(32):08x}", 'op': op,
+                 'payload': payload, 'ts': time.time()}
+        with self._lock, _flocked(f"{self.path}.lock"):
+            self._write_lines([entry])
+            self.pending += 1
+        return entry['id']
+
+    def kick(self, conn, url, force=False):
+        """有未完成條目就啟動背景重放 (同時只有一個)；上次失敗不到 JOURNAL_RETRY_SECONDS 秒先不試"""
+        with self._lock:
+            if self.flushing or not self.pending:
+                return False
+            if not force and time.time() - self.last_failure < JOURNAL_RETRY_SECONDS:
+                return False
+            self.flushing = True
+        threading.Thread(target=self._flush, args=(conn, url), name="sheets-journal", daemon=True).start()
+        return True
+
+    def _flush(self, conn, url):
+        try:
+            self.replay(conn, url)
+        finally:
+            with self._lock:
+                self.flushing = False
+
+    def replay(self, conn, url):
+        """把未 ack 的條目寫回試算表；回傳成功套用的筆數"""
+        applied = 0
+        # 重放鎖只擋其他重放者 (其他副本)；append 用另一把鎖，網路呼叫期間寫入不受影響
+        with _flocked(f"{self.path}.replay.lock", blocking=False) as owned:
+            if not owned:
+                return 0
+            with _flocked(f"{self.path}.lock"):
+                pending = self._read_pending()
+            groups = {}
+            for entry in pending:
+                groups.setdefault(entry['op'], []).append(entry)
+            errors = []
+            # 每組各自成敗：某一組一直失敗 (例如計數欄有非整數) 不能擋住其他組 (例如解碼存檔)
+            for op, entries in groups.items():
+                try:
+                    with _flocked(f"{self.path}.lock"):
+                        self._write_lines([{'applying': [e['id'] for e in entries], 'ts': time.time()}])
+                    JOURNAL_APPLIERS[op](conn, url, entries)
+                    with _flocked(f"{self.path}.lock"):
+                        self._write_lines([{'ack': e['id'], 'ts': time.time()} for e in entries])
+                    applied += len(entries)
+                except Exception as e:
+                    errors.append(f"{op}: {e}")
+            if errors:
+                self.last_failure = time.time()
+            self.last_error = "；".join(errors) or None
+            with self._lock, _flocked(f"{self.path}.lock"):
+                self._compact()
+        return applied
+
+    def _compact(self):
+        """只留下未 ack 的條目 (先寫暫存檔再 os.replace)"""
+        remaining = self._read_pending()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for rec in remaining:
+                f.write(json.dumps(rec, ensure_ascii=False, default=_json_default) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.pending = len(remaining)
+
+def _upsert_by_word(existing, rows):
+    new = pd.DataFrame(rows)
+    keys = new['word'].astype(str).str.lower()
+    new = new[(keys.str.len() > 0) & ~keys.duplicated(keep='last')]
+    if existing.empty or 'word' not in existing.columns:
+        return new.reset_index(drop=True)
+    keep = existing[~existing['word'].astype(str).str.lower().isin(set(keys))]
+    return pd.concat([keep, new], ignore_index=True)
+
+def _cell_text(v):
+    """比對表尾用：缺值 → 空字串，1.0 → "1"，其餘轉字串"""
+    if v is None or (not isinstance(v, str) and pd.isna(v)):
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return str(v)
+
+def _tail_matches(existing, rows):
+    """表尾最後 len(rows) 列是否就是這批資料 (上次寫回成功、但 ack 沒寫進日誌就中斷)"""
+    if len(existing) < len(rows):
+        return False
+    tail = existing.tail(len(rows)).to_dict("records")
+    return all(all(_cell_text(old.get(k)) == _cell_text(v) for k, v in new.items())
+               for old, new in zip(tail, rows))
+
+def _apply_reports(conn, url, entries):
+    """回報照舊附加在回饋表單最後 (同一個字可以被回報多次)"""
+    existing = call_sheets(conn.read, spreadsheet=FEEDBACK_URL, ttl=0)
+    retried = [e['payload'] for e in entries if e['_applying']]
+    if retried and _tail_matches(existing, retried):
+        entries = [e for e in entries if not e['_applying']]
+    if not entries:
+        return
+    updated = pd.concat([existing, pd.DataFrame([e['payload'] for e in entries])], ignore_index=True)
+    call_sheets(conn.update, spreadsheet=FEEDBACK_URL, data=updated)
+
+def _apply_entries(conn, url, entries):
+    """
+    解碼存檔：以 word 為鍵 upsert 回主表，寫回成功後才發布到變更紀錄。
+    (發布時間若早於寫回，其他副本在這之間重新讀表會拿到沒有這一筆、序號卻已跳過它的快照)
+    """
+    rows = [e['payload'] for e in entries]
+    existing = call_sheets(conn.read, spreadsheet=url, ttl=0)
+    call_sheets(conn.update, spreadsheet=url, data=_upsert_by_word(existing, rows))
+    for row in rows:
+        commit_entry(row)
+
+def _apply_metrics(conn, url, entries):
+    """payload：{'label', 'key'}；key 是 metrics 分頁的標籤欄名 (label / feature_name)"""
+    payloads = [e['payload'] for e in entries]
+    try:
+        m_df = call_sheets(conn.read, spreadsheet=url, worksheet="metrics", ttl=0, passthrough=(WorksheetNotFound,))
+    except WorksheetNotFound:
+        # 只有確定沒有 metrics 工作表才從空表開始；其他讀取錯誤 (例如 429) 往外拋，
+        # 條目留在日誌裡，不能拿待寫的計數蓋掉整張表
+        m_df = pd.DataFrame(columns=[payloads[0]['key'], 'count'])
+    for p in payloads:
+        key, label = p['key'], p['label']
+        if key not in m_df.columns:
+            m_df[key] = None
+        if label in m_df[key].values:
+            m_df.loc[m_df[key] == label, 'count'] = m_df.loc[m_df[key] == label, 'count'].astype(int) + 1
+        else:
+            m_df = pd.concat([m_df, pd.DataFrame([{key: label, 'count': 1}])], ignore_index=True)
+    call_sheets(conn.update, spreadsheet=url, worksheet="metrics", data=m_df)
+
+JOURNAL_APPLIERS = {'report': _apply_reports, 'entry': _apply_entries, 'metric': _apply_metrics}
+
+@st.cache_resource
+def get_sheets_journal():
+    return SheetsJournal()
+
+def journal_write(op, payload, conn, url):
+    """對外寫入的唯一入口：先落地到日誌，再在背景寫回試算表"""
+    journal = get_sheets_journal()
+    journal.append(op, payload)
+    journal.kick(conn, url, force=True)
+
+def replay_journal():
+    """每次重跑順手檢查：有未寫回的條目就在背景重放 (失敗後至少隔 JOURNAL_RETRY_SECONDS 秒)"""
+    journal = get_sheets_journal()
+    if journal.pending:
+        journal.kick(st.connection("gsheets", type=GSheetsConnection), get_spreadsheet_url())
+    return journal
+
+# ==========================================
+# 欄位投影：核心欄位常駐記憶體，長文欄位按需讀取
+# ==========================================
+CORE_COLS = ['word', 'category', 'definition', 'roots', 'meaning']
+HEAVY_COLS = [c for c in COL_NAMES if c not in CORE_COLS]
+SNAPSHOT_DIR = os.path.join(DEFAULT_CACHE_DIR, "snapshots")
+SNAPSHOT_ROW_GROUP = 1024   # 固定 row group 大小：列位置 → (row group, 偏移) 直接換算
+SNAPSHOT_KEEP = 3           # 每個行程、每個來源保留的快照檔數 (舊 session 可能還拿著上一份)
+
+def write_local_snapshot(df, source_type):
+    """
+    把完整快照寫成本地 Parquet (先寫暫存檔再 os.replace)，回傳檔案路徑。
+    檔名帶主機名稱與 PID：共用快取目錄的其他副本各自清理自己的檔案，不會刪到別人正在用的快照。
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    source = hashlib.sha1(source_type.encode("utf-8")).hexdigest()[:8]
+    prefix = f"{source}-{socket.gethostname()}-{os.getpid()}-"
+    path = os.path.join(SNAPSHOT_DIR, f"{prefix}{time.time_ns()}.parquet")
+    df.to_parquet(f"{path}.tmp", index=False, row_group_size=SNAPSHOT_ROW_GROUP)
+    os.replace(f"{path}.tmp", path)
+
+    old = sorted((f for f in os.listdir(SNAPSHOT_DIR) if f.startswith(prefix) and f.endswith(".parquet")),
+                 reverse=True)[SNAPSHOT_KEEP:]
+    for name in old:
+        try:
+            os.remove(os.path.join(SNAPSHOT_DIR, name))
+        except OSError:
+            pass
+    return path
+
+def project_core(df, source_type):
+    """
+    只保留 CORE_COLS 在記憶體，完整資料落地成本地快照，路徑記在 df.attrs['snapshot_path']。
+    寫檔失敗 (例如唯讀磁碟) 時退回全欄位，行為與投影前相同。
+    """
+    if df.empty:
+        return df
+    try:
+        path = write_local_snapshot(df, source_type)
+    except Exception:
+        return df
+    core = df[CORE_COLS].copy()
+    core.attrs['snapshot_path'] = path
+    return core
+
+@st.cache_resource(max_entries=SNAPSHOT_KEEP * 2)
+def open_snapshot(path):
+    """快照檔的 ParquetFile 控制代碼 (同一份檔案所有 session 共用，讀取時加鎖)"""
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(path), threading.Lock()
+
+@st.cache_data(show_spinner=False, max_entries=2048)
+def load_entry_details(path, pos):
+    """讀單一列的長文欄位：只解碼該列所在的 row group 與 HEAVY_COLS"""
+    pf, lock = open_snapshot(path)
+    group, offset = divmod(int(pos), SNAPSHOT_ROW_GROUP)
+    with lock:
+        table = pf.read_row_group(group, columns=HEAVY_COLS)
+    return table.slice(offset, 1).to_pylist()[0]
+
+def entry_dict(df, pos):
+    """
+    核心欄位 + 列位置 (_pos) + 所屬快照檔 (_snapshot)，之後才能回頭補長文欄位。
+    列位置只在同一份快照檔內有效 (套用變更紀錄只會附加列，不會改動位置)。
+    """
+    return dict(df.loc[pos].to_dict(), _pos=int(pos), _snapshot=df.attrs.get('snapshot_path'))
+
+def _word_position(df, word):
+    """在快照裡以 word (不分大小寫) 找列位置；找不到回傳 None"""
+    if word is None:
+        return None
+    hits = np.flatnonzero(df['word'].astype("string").str.lower().to_numpy(na_value="") == str(word).lower())
+    return int(df.index[hits[0]]) if len(hits) else None
+
+def hydrate_row(row, df):
+    """
+    補齊卡片需要的長文欄位；已經是完整資料 (例如解碼實驗室的結果) 就原樣回傳。
+    session_state 裡的列可能來自背景刷新前的舊快照：快照檔不同時以 word 重新定位，不沿用舊的列位置。
+    """
+    row = dict(row)
+    path = df.attrs.get('snapshot_path') if df is not None else None
+    if path is None or row.get('_pos') is None or all(c in row for c in HEAVY_COLS):
+        return row
+    pos = row['_pos']
+    if row.get('_snapshot') != path:
+        pos = _word_position(df, row.get('word'))
+        if pos is None:
+            return row   # 新快照裡已經沒有這個字：只顯示核心欄位
+    overlay = df.attrs.get('overlay') or {}
+    if pos in overlay:
+        row.update(overlay[pos])
+        return row
+    try:
+        row.update(load_entry_details(path, pos))
+    except Exception:
+        pass  # 快照檔被清掉時至少還有核心欄位可顯示
+    return row
+
+def with_columns(df, cols):
+    """取得含指定欄位的表 (缺的欄位整欄從快照檔讀回；沒有快照時 df 本身就是全欄位)"""
+    missing = [c for c in cols if c not in df.columns]
+    path = df.attrs.get('snapshot_path')
+    if not missing or path is None:
+        return df
+    extra = pd.read_parquet(path, columns=missing)
+    overlay = df.attrs.get('overlay')
+    if overlay:
+        # 快照檔之後才寫入 / 改過的列，以 overlay 為準
+        patch = pd.DataFrame.from_dict(overlay, orient='index').reindex(columns=missing)
+        extra = pd.concat([extra.drop(index=[p for p in patch.index if p < len(extra)]), patch]).sort_index()
+    # 核心表的 index 就是快照內的列位置，子集合 (例如一個近似重複群) 也能直接對齊
+    extra = extra.reindex(np.asarray(df.index))
+    extra.index = df.index
+    return pd.concat([df, extra], axis=1)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _snapshot_matches(path, search):
+    """在快照檔的長文欄位裡找子字串 (不分大小寫)，回傳命中的列位置"""
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    table = pq.read_table(path, columns=HEAVY_COLS)
+    mask = None
+    for col in table.columns:
+        hit = pc.match_substring(pc.cast(col, "string"), search, ignore_case=True).fill_null(False)
+        mask = hit if mask is None else pc.or_(mask, hit)
+    return np.flatnonzero(mask.to_numpy(zero_copy_only=False))
+
+def search_rows(df, search):
+    """
+    列表搜尋：比對全部欄位 (與投影前相同)，回傳命中列的 index。
+    常駐欄位直接在記憶體比對；長文欄位在快照檔上用 pyarrow 比對，overlay 的列另外比。
+    """
+    mask = df.apply(
+        lambda x: x.astype("string").str.contains(search, case=False, regex=False, na=False)
+    ).any(axis=1)
+    matched = df.index[mask]
+    path = df.attrs.get('snapshot_path')
+    if path is None:
+        return matched
+    overlay = df.attrs.get('overlay') or {}
+    try:
+        hits = [int(p) for p in _snapshot_matches(path, search) if p not in overlay]
+    except Exception:
+        hits = []   # 快照檔被清掉時退回只比對常駐欄位
+    needle = search.lower()
+    hits += [pos for pos, extra in overlay.items()
+             if any(needle in str(v).lower() for v in extra.values() if v is not None)]
+    return matched.union(df.index.intersection(hits))
+
+def full_db(df):
+    """還原成完整 COL_NAMES 表 (匯出、記憶體報告等管理功能用)"""
+    return with_columns(df, COL_NAMES)[COL_NAMES]
+
+def _term_value(v):
+    v = pd.to_numeric(v, errors='coerce')
+    return 0 if pd.isna(v) else int(v)
+
+def apply_changes(df, changes):
+    """
+    把變更紀錄 (整列 upsert，word 不分大小寫比對) 套到快照上，回傳新的 DataFrame：
+    舊物件不動 (其他 session 可能正在用)，只有變動的列會被改寫或附加在最後。
+    常駐欄位直接寫入；投影以外的長文欄位放進 attrs['overlay']。
+    attrs['patch'] 記錄上一版的 token 與變動列，衍生索引據此增量更新。
+    """
+    if not changes:
+        return df
+    word_pos = {}
+    for i, w in enumerate(df['word'].astype("string").fillna("").str.lower()):
+        word_pos.setdefault(w, i)
+
+    changed = {}
+    for row in changes:
+        word = compact_value(row.get('word'))
+        if word is None:
+            continue
+        pos = word_pos.setdefault(word.lower(), len(df) + len([p for p in changed if p >= len(df)]))
+        changed[pos] = row
+    total = len(df) + sum(1 for p in changed if p >= len(df))
+
+    out = {}
+    for col in df.columns:
+        if col == 'term':
+            term = np.zeros(total, dtype='int8')
+            term[:len(df)] = df['term'].to_numpy()
+            for pos, row in changed.items():
+                term[pos] = _term_value(row.get('term'))
+            out[col] = pd.Series(term)
+            continue
+        values = {pos: compact_value(row.get(col)) for pos, row in changed.items()}
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            new_cats = sorted({v for v in values.values() if v is not None} - set(series.cat.categories))
+            if new_cats:
+                series = series.cat.add_categories(new_cats)
+        series = series.reindex(range(total))
+        series.iloc[list(values)] = list(values.values())
+        out[col] = series
+
+    patched = pd.DataFrame(out)
+    patched.attrs = dict(df.attrs)
+    if 'snapshot_path' in df.attrs:
+        overlay = dict(df.attrs.get('overlay') or {})
+        for pos, row in changed.items():
+            overlay[pos] = {c: _term_value(row.get(c)) if c == 'term' else compact_value(row.get(c))
+                            for c in COL_NAMES if c not in df.columns}
+        patched.attrs['overlay'] = overlay
+    patched.attrs['token'] = random.getrandbits(63)
+    patched.attrs['patch'] = {'parent': df.attrs.get('token'), 'rows': sorted(changed)}
+    return patched
+
+# ==========================================
+# 大型試算表：A1 範圍分塊平行讀取
+# ==========================================
+SHEET_CHUNK_ROWS = 2000
+SHEET_READ_WORKERS = 6
+SHEET_MAX_COL = "AZ"       # 第一塊先讀到 AZ 欄，再依表頭決定實際寬度
+
+def sheets_read_config():
+    """secrets 的 [sheets] 區塊：ranged_read (預設開啟) / chunk_rows / workers"""
+    try:
+        cfg = dict(st.secrets.get("sheets", {}))
+    except Exception:
+        cfg = {}
+    return {
+        'ranged': bool(cfg.get("ranged_read", True)),
+        'chunk_rows': int(cfg.get("chunk_rows", SHEET_CHUNK_ROWS)),
+        'workers': int(cfg.get("workers", SHEET_READ_WORKERS)),
+    }
+
+def _col_letter(n):
+    """1 → A、27 → AA"""
+    letters = ""
+    while n > 0:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def _export_csv_rows(url):
+    """公開試算表的 CSV 匯出端點；範圍超出資料時 Google 回傳空內容"""
+    try:
+        return pd.read_csv(url, header=None, dtype=str, keep_default_na=False).values.tolist()
+    except pd.errors.EmptyDataError:
+        return []
+
+def _range_reader(conn, url):
+    """
+    依連線種類回傳 (fetch(a1) -> list[list[str]], 總列數或 None)：
+    - 服務帳戶：gspread 的 worksheet.get(範圍)，總列數取自工作表格線大小。
+    - 公開連結：/export?format=csv&range=，總列數未知。
+    """
+    client = conn.client
+    if isinstance(client, GSheetsServiceAccountClient):
+        ws = client._select_worksheet(spreadsheet=url)
+        return (lambda a1: [list(r) for r in ws.get(a1)]), ws.row_count
+    if isinstance(client, GSheetsPublicSpreadsheetClient):
+        key = re.search(r"/d/([\w-]+)", url)
+        if not key:
+            return None, None
+        gid = re.search(r"gid=(\d+)", url)
+        base = f"https://docs.google.com/spreadsheets/d/{key.group(1)}/export?format=csv&gid={gid.group(1) if gid else 0}"
+        return (lambda a1: _export_csv_rows(f"{base}&range={a1}")), None
+    return None, None
+
+def read_sheet_ranged(conn, url, chunk_rows=SHEET_CHUNK_ROWS, workers=SHEET_READ_WORKERS):
+    """
+    把工作表切成每塊 chunk_rows 列的 A1 範圍，用執行緒池同時讀取再依序組回 DataFrame，
+    冷啟動時間取決於最慢的一塊而不是整張表。
+    第一塊 (含表頭) 就讀完時只需要一次請求；分塊讀取失敗時退回一次讀整張表。
+    """
+    try:
+        fetch, total_rows = _range_reader(conn, url)
+    except Exception:
+        fetch = None
+    if fetch is None:
+        return conn.read(spreadsheet=url, ttl=0)
+
+    try:
+        first = fetch(f"A1:{SHEET_MAX_COL}{chunk_rows + 1}")
+        if not first:
+            return pd.DataFrame(columns=COL_NAMES)
+        header = [str(h).strip() for h in first[0]]
+        while header and not header[-1]:
+            header.pop()
+        width = len(header)
+        last_col = _col_letter(width)
+
+        def read_chunk(i):
+            start = 2 + i * chunk_rows
+            return fetch(f"A{start}:{last_col}{start + chunk_rows - 1}")
+
+        chunks = [first[1:]]
+        if len(chunks[0]) >= chunk_rows:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sheet-range") as pool:
+                if total_rows is not None:
+                    # 已知總列數：全部範圍一次送出
+                    n_chunks = -(-(total_rows - 1) // chunk_rows)
+                    chunks.extend(pool.map(read_chunk, range(1, n_chunks)))
+                else:
+                    # 不知道總列數：一次送出 workers 塊，讀到不滿一塊就停
+                    i = 1
+                    while len(chunks[-1]) >= chunk_rows:
+                        for rows in pool.map(read_chunk, range(i, i + workers)):
+                            chunks.append(rows)
+                            if len(rows) < chunk_rows:
+                                break
+                        i += workers
+    except Exception:
+        return conn.read(spreadsheet=url, ttl=0)
+
+    # API 會省略每列結尾的空白格，補齊到表頭寬度；空字串視為缺值 (與 conn.read 一致)
+    rows = [(r + [""] * width)[:width] for part in chunks for r in part]
+    df = pd.DataFrame(rows, columns=header, dtype=object)
+    return df.where(df != "", None)
+
+# ==========================================
+# 資料庫快照：stale-while-revalidate
+# ==========================================
+DB_TTL = 360
+DB_RETRY_SECONDS = 30      # 背景更新失敗後的退避起點 (連續失敗就加倍，最多 DB_TTL)
+
+def sheets_source(source_type):
+    """在腳本執行緒取得連線與網址 (背景執行緒沒有 ScriptRunContext，st.connection / st.error 不可靠)"""
+    if source_type != "Google Sheets":
+        return None, None
+    return st.connection("gsheets", type=GSheetsConnection), get_spreadsheet_url()
+
+class SnapshotStore:
+    """
+    每個資料來源保留「最後一份成功的快照」：
+    過期時照樣回傳舊資料，同時只開一條背景執行緒去更新；失敗後依次數退避再試。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.entries = {}      # source_type -> {'df', 'fetched_at', 'generation', 'feed_seq'}
+        self.refreshing = set()
+        self.last_error = {}
+        self.failures = {}     # source_type -> (連續失敗次數, 上次失敗時間)
+
+    def get(self, source_type):
+        with self._lock:
+            return self.entries.get(source_type)
+
+    def put(self, source_type, df, generation):
+        """存入快照 (只保留核心欄位投影)，回傳實際存入的 DataFrame"""
+        feed_seq = df.attrs.get('feed_seq', 0)
+        df = project_core(df, source_type)
+        df.attrs['token'] = random.getrandbits(63)
+        with self._lock:
+            self.entries[source_type] = {'df': df, 'fetched_at': time.time(), 'generation': generation,
+                                         'feed_seq': feed_seq}
+            self.last_error.pop(source_type, None)
+            self.failures.pop(source_type, None)
+        return df
+
+    def apply(self, source_type, changes, feed_seq=None):
+        """就地換成套用變更後的新快照 (不重新讀取資料來源)，回傳新的 entry"""
+        with self._lock:
+            entry = self.entries.get(source_type)
+            if entry is None:
+                return None
+            if feed_seq is not None and entry['feed_seq'] >= feed_seq:
+                return entry
+            entry = dict(entry, df=apply_changes(entry['df'], changes),
+                         feed_seq=max(entry['feed_seq'], feed_seq or 0))
+            self.entries[source_type] = entry
+            return entry
+
+    def catch_up(self, source_type, head):
+        """從變更紀錄補上 (entry 的序號, head] 之間的寫入；紀錄不完整就改成整份背景更新"""
+        entry = self.get(source_type)
+        if entry is None or entry['feed_seq'] >= head:
+            return entry
+        changes = read_changes(entry['feed_seq'], head)
+        if changes is None:
+            self.refresh_async(source_type, entry['generation'])
+            return entry
+        return self.apply(source_type, changes, head)
+
+    def _record_failure(self, source_type, error):
+        with self._lock:
+            self.last_error[source_type] = str(error)
+            count = self.failures.get(source_type, (0, 0.0))[0]
+            self.failures[source_type] = (count + 1, time.time())
+
+    def backing_off(self, source_type):
+        """上次背景更新失敗後還在退避期間內"""
+        count, failed_at = self.failures.get(source_type, (0, 0.0))
+        return count > 0 and time.time() - failed_at < min(DB_RETRY_SECONDS * 2 ** (count - 1), DB_TTL)
+
+    def refresh_async(self, source_type, generation):
+        """
+        背景更新；同一來源同時只會有一條執行緒在跑，失敗後退避期間內不再啟動。
+        須在腳本執行緒呼叫：連線與網址在這裡取得後才交給背景執行緒。
+        """
+        with self._lock:
+            if source_type in self.refreshing or self.backing_off(source_type):
+                return
+            self.refreshing.add(source_type)
+        try:
+            conn, url = sheets_source(source_type)
+        except Exception as e:
+            with self._lock:
+                self.refreshing.discard(source_type)
+            self._record_failure(source_type, e)
+            return
+
+        def _run():
+            try:
+                self.put(source_type, fetch_db(source_type, generation, conn=conn, url=url), generation)
+            except Exception as e:
+                # 失敗就繼續供應舊資料，退避後再試
+                self._record_failure(source_type, e)
+            finally:
+                with self._lock:
+                    self.refreshing.discard(source_type)
+
+        threading.Thread(target=_run, name=f"db-refresh-{source_type}", daemon=True).start()
+
+@st.cache_resource
+def get_snapshot_store():
+    return SnapshotStore()
+
+def commit_entry(row, source_type="Google Sheets"):
+    """
+    資料來源寫入成功後呼叫：發布到變更紀錄，並立刻修補本副本的快照。
+    不清任何快取；其他副本最多 5 秒後 (feed_head 的 TTL) 就會看到新條目。
+    """
+    seq = publish_change(row)
+    get_snapshot_store().apply(source_type, [row], seq)
+
+def with_pending_entries(df, source_type="Google Sheets"):
+    """
+    疊加日誌裡還沒寫回試算表的解碼條目：重新讀表的時間若早於重放，
+    這些條目不在表上、也還沒發布到變更紀錄，不疊加就會從快照消失。
+    """
+    if source_type != "Google Sheets":
+        return df
+    pending = get_sheets_journal().pending_payloads('entry')
+    if not pending:
+        return df
+    df = apply_changes(df, pending)
+    # 這是新快照而非增量修補，不沿用 patch (衍生索引整份重建)
+    df.attrs.pop('patch', None)
+    return df
+
+def fetch_db(source_type="Google Sheets", generation=0, conn=None, url=None):
+    """
+    真正讀取資料庫 (L2 → Google Sheets / 本地 JSON)；失敗時拋出例外。
+    背景執行緒呼叫時要帶入在腳本執行緒取得的 conn / url。
+    """
+    l2_key = cache_key("db", source_type, generation=generation)
+    cached = l2_get(l2_key)
+    if cached:
+        try:
+            return with_pending_entries(df_from_bytes(cached), source_type)
+        except Exception:
+            pass
+
+    # 先記下變更序號再讀：讀取期間發生的寫入之後會再套用一次 (upsert 可重複套用)
+    feed_seq = read_feed_head()
+    df = pd.DataFrame(columns=COL_NAMES)
+
+    if source_type == "Google Sheets":
+        if conn is None:
+            conn, url = sheets_source(source_type)
+        cfg = sheets_read_config()
+        if cfg['ranged']:
+            df = call_sheets(read_sheet_ranged, conn, url, chunk_rows=cfg['chunk_rows'], workers=cfg['workers'])
+        else:
+            df = call_sheets(conn.read, spreadsheet=url, ttl=0)
+    
+    elif source_type == "Local JSON":
+        json_file = "master_db.json"
+        if os.path.exists(json_file):
+            with open(json_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data: df = pd.DataFrame(data)
+    
+    # 1. 自動補齊缺失欄位
+    for col in COL_NAMES:
+        if col not in df.columns:
+            df[col] = 0 if col == 'term' else "無"
+    
+    # 2. 清洗與排序 (缺值保留為 null，不再填入「無」字串)
+    df = df.dropna(subset=['word'])
+    df = compact_db(df[COL_NAMES].reset_index(drop=True))
+    df.attrs['feed_seq'] = feed_seq
+
+    # 3. 寫入 L2 (attrs 會跟著 Parquet 一起保存)，其他副本在 TTL 內直接共用這份快照；
+    #    本副本日誌裡的待寫回條目只疊加在自己的快照上，不寫進 L2
+    l2_set(l2_key, df_to_bytes(df), ttl=DB_TTL)
+    return with_pending_entries(df, source_type)
+
+def load_db(source_type="Google Sheets", generation=0, force=False, feed_seq=0):
+    """
+    取得資料庫 (stale-while-revalidate)：
+    - 有快照且未過期：直接回傳。
+    - 快照過期或世代改變：先回傳舊快照，背景執行緒更新。
+    - 變更紀錄有新的寫入 (feed_seq 較新)：只修補變動的列。
+    - 完全沒有快照 (冷啟動) 或 force=True：同步讀取。
+    回傳的 DataFrame 由所有 session 共用，請勿就地修改；
+    只含 CORE_COLS，長文欄位用 hydrate_row / with_columns 按需讀取。
+    """
+    store = get_snapshot_store()
+    entry = store.get(source_type)
+
+    if entry is not None and not force:
+        stale = time.time() - entry['fetched_at'] > DB_TTL or entry['generation'] != generation
+        if stale:
+            store.refresh_async(source_type, generation)
+        elif entry['feed_seq'] < feed_seq:
+            entry = store.catch_up(source_type, feed_seq) or entry
+        return entry['df']
+
+    try:
+        return store.put(source_type, fetch_db(source_type, generation), generation)
+    except Exception as e:
+        if entry is not None:
+            st.warning(f"⚠️ 雲端同步失敗，暫時顯示舊資料: {e}")
+            return entry['df']
+        st.error(f"❌ 資料庫載入失敗: {e}")
+        return pd.DataFrame(columns=COL_NAMES)
+
+def db_status(source_type="Google Sheets"):
+    """給側欄顯示的快照狀態：資料年齡、是否更新中、斷路器狀態"""
+    store = get_snapshot_store()
+    entry = store.get(source_type)
+    return {
+        'age': time.time() - entry['fetched_at'] if entry else None,
+        'refreshing': source_type in store.refreshing,
+        'last_error': store.last_error.get(source_type),
+        'breaker_open': get_sheets_breaker().is_open,
+    }
+
+# ==========================================
+# 衍生索引：每份快照只建一次，所有 session 共用
+# ==========================================
+@st.cache_resource
+def get_index_registry():
+    return {'lock': threading.Lock(), 'name_locks': {}, 'slots': {}}
+
+def get_db_index(name, df, builder):
+    """
+    依 DataFrame 物件快取衍生索引：快照換新 (df 物件不同) 才重建。
+    同名索引同時只會有一個 session 在建，其他人等它建好直接共用；
+    每個索引各自一把鎖，索引之間可以互相依賴 (例如相關概念圖會用到干擾選項表)。
+    新快照若只是上一版套用變更紀錄的結果，且索引有登記在 INDEX_PATCHERS，就只更新變動的列。
+    """
+    registry = get_index_registry()
+    slot = registry['slots'].get(name)
+    if slot is not None and slot[0] is df:
+        return slot[1]
+    with registry['lock']:
+        name_lock = registry['name_locks'].setdefault(name, threading.Lock())
+    with name_lock:
+        slot = registry['slots'].get(name)
+        if slot is None or slot[0] is not df:
+            patch = df.attrs.get('patch')
+            patcher = INDEX_PATCHERS.get(name)
+            if (slot is not None and patch and patcher and patch['parent'] is not None
+                    and slot[0].attrs.get('token') == patch['parent']):
+                slot = (df, patcher(slot[1], df, patch['rows']))
+            else:
+                slot = (df, builder(df))
+            registry['slots'][name] = slot
+    return slot[1]
+
+# --- 增量索引共用的分層表 (copy-on-write) ---
+PATCH_COMPACT = 1024   # 差異層累積超過這麼多筆才攤平成新的基底
+_DELETED = object()
+
+class LayeredMap:
+    """
+    唯讀基底 (list / dict / ndarray，跨索引版本共用、建好後不再修改) + 小的差異層 dict。
+    derive() 只複製差異層，修補一列的成本與整張表的大小無關；
+    差異層超過 PATCH_COMPACT 時才攤平一次，攤提下來每次修補仍只跟變動量有關。
+    """
+    def __init__(self, base, delta=None):
+        self.base = base
+        self.delta = delta if delta is not None else {}
+
+    def get(self, key, default=None):
+        if key in self.delta:
+            value = self.delta[key]
+            return default if value is _DELETED else value
+        if isinstance(self.base, dict):
+            return self.base.get(key, default)
+        return self.base[key] if 0 <= key < len(self.base) else default
+
+    def __setitem__(self, key, value):
+        self.delta[key] = value
+
+    def __delitem__(self, key):
+        self.delta[key] = _DELETED
+
+    def items(self):
+        for key, value in (self.base.items() if isinstance(self.base, dict) else enumerate(self.base)):
+            if key not in self.delta:
+                yield key, value
+        for key, value in self.delta.items():
+            if value is not _DELETED:
+                yield key, value
+
+    def values(self):
+        return (value for _, value in self.items())
+
+    def flattened(self):
+        """基底 + 差異層合併成新的基底 (不修改舊基底)"""
+        if isinstance(self.base, dict):
+            out = dict(self.base)
+            for key, value in self.delta.items():
+                if value is _DELETED:
+                    out.pop(key, None)
+                else:
+                    out[key] = value
+            return out
+        size = max([len(self.base)] + [key + 1 for key in self.delta])
+        if isinstance(self.base, np.ndarray):
+            out = np.zeros((size,) + self.base.shape[1:], dtype=self.base.dtype)
+            out[:len(self.base)] = self.base
+        else:
+            out = list(self.base) + [None] * (size - len(self.base))
+        for key, value in self.delta.items():
+            out[key] = value
+        return out
+
+    def derive(self):
+        """給下一版索引用的可寫副本：共用基底，只複製差異層"""
+        if len(self.delta) > PATCH_COMPACT:
+            return LayeredMap(self.flattened())
+        return LayeredMap(self.base, dict(self.delta))
+
+_MORPHEME_RE = re.compile(r"[a-zA-Z]{2,}")
+
+def hashed_ngram_matrix(texts, dim=512, n=2):
+    """
+    把文字轉成雜湊字元 n-gram 向量 (L2 正規化，float32)：
+    中文定義沒有空白斷詞，用字元 bigram 比詞袋穩定。
+    """
+    rows, cols = [], []
+    for i, text in enumerate(texts):
+        text = "" if text is None or (not isinstance(text, str) and pd.isna(text)) else str(text).lower()
+        grams = {text[j:j + n] for j in range(max(len(text) - n + 1, 0))}
+        for g in grams:
+            rows.append(i)
+            cols.append(zlib.crc32(g.encode("utf-8")) % dim)
+    mat = np.zeros((len(texts), dim), dtype=np.float32)
+    if rows:
+        np.add.at(mat, (np.array(rows), np.array(cols)), 1.0)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    return mat / np.maximum(norms, 1e-6)
+
+def morpheme_matrix(roots_series, dim=256):
+    """字根欄位中的英文詞素 (geno, type, vis...) 做成雜湊 one-hot 向量"""
+    mat = np.zeros((len(roots_series), dim), dtype=np.float32)
+    for i, roots in enumerate(roots_series.astype("string").fillna("")):
+        for m in {m.lower() for m in _MORPHEME_RE.findall(roots)}:
+            mat[i, zlib.crc32(m.encode("utf-8")) % dim] = 1.0
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    return mat / np.maximum(norms, 1e-6)
+
+DISTRACTOR_K = 8
+
+def build_distractor_index(df, k=DISTRACTOR_K, block=512):
+    """
+    為每個單字預先算好 k 個「長得像」的干擾選項 (回傳 n x k 的列位置陣列，-1 代表不足)：
+    分數 = 定義相似度 + 0.5 × 字根詞素相似度 + 0.3 × 同分類。
+    以分類為分區做分塊矩陣乘法 (分類太小時才跨全表)，避免 n² 全表比對。
+    """
+    n = len(df)
+    result = np.full((n, k), -1, dtype=np.int32)
+    if n < 2:
+        return result
+    _fill_distractors(result, df, np.arange(n), block)
+    return result
+
+def _fill_distractors(result, df, targets, block=512):
+    """替 targets 這些列重算干擾選項，直接寫進 result (全表建立與增量更新共用)"""
+    n, k = result.shape
+    defs = hashed_ngram_matrix(df['definition'].astype("string").fillna("").tolist())
+    roots = morpheme_matrix(df['roots'])
+    words = df['word'].astype(str).str.lower().to_numpy()
+    cats = df['category'].astype("string").fillna("").to_numpy(dtype=object)
+
+    for cat in np.unique(cats[targets]):
+        members = np.flatnonzero(cats == cat)
+        # 分類內選項不夠時，候選擴大到全表
+        candidates = members if len(members) > k else np.arange(n)
+        cat_targets = targets[cats[targets] == cat]
+        for start in range(0, len(cat_targets), block):
+            rows = cat_targets[start:start + block]
+            score = defs[rows] @ defs[candidates].T + 0.5 * (roots[rows] @ roots[candidates].T)
+            score += 0.3 * (cats[candidates][None, :] == cats[rows][:, None])
+            # 排除自己與同名單字 (同一個答案不能當干擾選項)
+            score[words[rows][:, None] == words[candidates][None, :]] = -np.inf
+            kk = min(k, len(candidates))
+            top = np.argpartition(-score, kk - 1, axis=1)[:, :kk]
+            top_scores = np.take_along_axis(score, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            picked = candidates[top]
+            picked[np.take_along_axis(top_scores, order, axis=1) == -np.inf] = -1
+            result[rows, :kk] = picked
+
+def patch_distractor_index(prev, df, rows):
+    """
+    增量更新：只重算變動列自己的干擾選項 (向量化仍是全表，但省掉 n² 的比對)；
+    其他列的選項沿用舊表，新條目要等下一次整份重建才會出現在別人的選項裡。
+    """
+    n, k = len(df), prev.shape[1]
+    result = np.full((n, k), -1, dtype=np.int32)
+    result[:len(prev)] = prev[:n]
+    if n >= 2:
+        _fill_distractors(result, df, np.asarray(rows, dtype=np.int64))
+    return result
+
+# --- 近似重複偵測 (MinHash + LSH) ---
+NEAR_DUP_FIELDS = ['word', 'definition', 'breakdown']
+NEAR_DUP_THRESHOLD = 0.6
+MINHASH_PERM = 64
+LSH_BANDS = 16            # 16 bands × 4 rows：Jaccard 約 0.5 以上才容易同桶
+LSH_MAX_BUCKET = 200      # 超過這個大小的桶再用其他 band 的鍵細分，避免退化成兩兩比對
+_MERSENNE_P = (1 << 31) - 1
+_rng = np.random.default_rng(20240601)
+_MINHASH_A = _rng.integers(1, _MERSENNE_P, MINHASH_PERM, dtype=np.uint64)
+_MINHASH_B = _rng.integers(0, _MERSENNE_P, MINHASH_PERM, dtype=np.uint64)
+
+def near_dup_text(row):
+    """串接比對用文字：去掉「無」、空白與大小寫差異"""
+    parts = [fix_content(row.get(col, "")) for col in NEAR_DUP_FIELDS]
+    return re.sub(r"\s+", " ", " ".join(p for p in parts if p)).lower()
+
+def minhash_signature(text, n=3):
+    """字元 3-gram 的 MinHash 簽章 (長度 MINHASH_PERM)"""
+    grams = {text[i:i + n] for i in range(max(len(text) - n + 1, 1))}
+    x = np.fromiter((zlib.crc32(g.encode("utf-8")) % _MERSENNE_P for g in grams),
+                    dtype=np.uint64, count=len(grams))
+    # (a·x + b) mod p，a、x 都小於 2^31，乘積不會溢位 uint64
+    hashed = (_MINHASH_A[:, None] * x[None, :] + _MINHASH_B[:, None]) % _MERSENNE_P
+    return hashed.min(axis=1).astype(np.uint32)
+
+class NearDupIndex:
+    """
+    MinHash/LSH 近似重複索引：
+    建立時間與比對都與資料量接近線性，只有落在同一個 band 桶的列才會實際比較簽章。
+    """
+    def __init__(self, df):
+        self.n = len(df)
+        self.words = LayeredMap(df['word'].astype(str).tolist())
+        records = with_columns(df, NEAR_DUP_FIELDS)[NEAR_DUP_FIELDS].to_dict('records')
+        sigs = np.vstack([minhash_signature(near_dup_text(r)) for r in records]) \
+            if records else np.zeros((0, MINHASH_PERM), dtype=np.uint32)
+        self.rows_per_band = MINHASH_PERM // LSH_BANDS
+        buckets = [dict() for _ in range(LSH_BANDS)]
+        for i, sig in enumerate(sigs):
+            for b, key in enumerate(self._band_keys(sig)):
+                buckets[b].setdefault(key, []).append(i)
+        self.sigs = LayeredMap(sigs)
+        self.buckets = [LayeredMap(table) for table in buckets]
+
+    def patched(self, df, rows):
+        """
+        回傳套用變動列後的新索引 (copy-on-write：舊索引可能仍被拿著舊快照的 session 使用)。
+        只重算變動列的簽章並把它們從舊桶移到新桶；簽章陣列與桶都是共用基底 + 差異層，不整份複製。
+        """
+        new = copy.copy(self)
+        new.n = len(df)
+        new.words = self.words.derive()
+        new.sigs = self.sigs.derive()
+        new.buckets = [table.derive() for table in self.buckets]
+        records = with_columns(df.iloc[rows], NEAR_DUP_FIELDS)[NEAR_DUP_FIELDS].to_dict('records')
+        for i, rec in zip(rows, records):
+            old_sig = new.sigs.get(i)
+            if old_sig is not None:
+                for b, key in enumerate(self._band_keys(old_sig)):
+                    rest = [j for j in new.buckets[b].get(key, ()) if j != i]
+                    if rest:
+                        new.buckets[b][key] = rest
+                    else:
+                        del new.buckets[b][key]
+            new.words[i] = str(rec['word'])
+            new.sigs[i] = minhash_signature(near_dup_text(rec))
+            for b, key in enumerate(self._band_keys(new.sigs.get(i))):
+                new.buckets[b][key] = new.buckets[b].get(key, []) + [i]
+        return new
+
+    def _band_keys(self, sig):
+        r = self.rows_per_band
+        return [sig[b * r:(b + 1) * r].tobytes() for b in range(LSH_BANDS)]
+
+    def similarity(self, i, sig):
+        return float(np.mean(self.sigs.get(i) == sig))
+
+    def query(self, row, threshold=NEAR_DUP_THRESHOLD, exclude_word=None):
+        """寫入前檢查：回傳 [(列位置, 估計 Jaccard)]，依相似度排序"""
+        sig = minhash_signature(near_dup_text(row))
+        candidates = set()
+        for b, key in enumerate(self._band_keys(sig)):
+            candidates.update(self.buckets[b].get(key, ()))
+        hits = []
+        for i in candidates:
+            if exclude_word and self.words.get(i).lower() == exclude_word.lower():
+                continue
+            score = self.similarity(i, sig)
+            if score >= threshold:
+                hits.append((i, score))
+        return sorted(hits, key=lambda h: -h[1])
+
+    def _bucket_groups(self, members, band, keys):
+        """
+        把一個桶拆成要兩兩比較的子群，產生 (子群, 是否只跟第一筆比較)；keys[i] 為第 i 列各 band 的鍵。
+        不超過 LSH_MAX_BUCKET 的桶就是一個子群；超大桶依其他每個 band 的鍵各細分一次，
+        只有在這個 band 以外完全沒有共同桶的配對才不會被比較 (這種配對的相似度通常遠低於門檻)。
+        """
+        if len(members) <= LSH_MAX_BUCKET:
+            yield members, False
+            return
+        for other in range(LSH_BANDS):
+            if other != band:
+                yield from self._split_groups(members, {band, other}, other, keys)
+
+    def _split_groups(self, members, used, band, keys):
+        """依 band 的鍵細分；子桶仍然太大就再用還沒用過的 band，全部用完 (簽章一樣) 時只跟第一筆比較"""
+        sub = {}
+        for i in members:
+            sub.setdefault(keys[i][band], []).append(i)
+        for group in sub.values():
+            if len(group) < 2:
+                continue
+            if len(group) <= LSH_MAX_BUCKET:
+                yield group, False
+                continue
+            rest = [b for b in range(LSH_BANDS) if b not in used]
+            if not rest:
+                yield group, True
+                continue
+            yield from self._split_groups(group, used | {rest[0]}, rest[0], keys)
+
+    def clusters(self, threshold=NEAR_DUP_THRESHOLD):
+        """全表近似重複分群 (union-find)，回傳 [[列位置...], ...] (只含 2 筆以上的群)"""
+        parent = list(range(self.n))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        keys = None
+        for band, table in enumerate(self.buckets):
+            for members in table.values():
+                if len(members) < 2:
+                    continue
+                if len(members) > LSH_MAX_BUCKET and keys is None:
+                    keys = [self._band_keys(self.sigs.get(i)) for i in range(self.n)]
+                for group, chain in self._bucket_groups(members, band, keys):
+                    # 整個子群已經在同一群就不必再比較
+                    if len({find(i) for i in group}) == 1:
+                        continue
+                    pairs = ([(group[0], j) for j in group[1:]] if chain
+                             else ((a, b) for k, a in enumerate(group) for b in group[k + 1:]))
+                    for a, b in pairs:
+                        ra, rb = find(a), find(b)
+                        if ra != rb and self.similarity(a, self.sigs.get(b)) >= threshold:
+                            parent[rb] = ra
+
+        groups = {}
+        for i in range(len(parent)):
+            groups.setdefault(find(i), []).append(i)
+        return sorted((g for g in groups.values() if len(g) > 1), key=len, reverse=True)
+
+# --- 發音相近搜尋 (Metaphone 式鍵值) ---
+_VOWELS = set("AEIOU")
+_IPA_VOWELS = set("aeiouæɑɒɔəɛɪʊʌɜɐœøyɨʉɯɤɵɘ")
+_IPA_CONSONANTS = {
+    'p': "P", 'b': "B", 't': "T", 'd': "T", 'k': "K", 'g': "K", 'ɡ': "K", 'x': "K",
+    'f': "F", 'v': "F", 'θ': "0", 'ð': "0", 's': "S", 'z': "S", 'ʃ': "X", 'ʒ': "X",
+    'ʧ': "X", 'ʤ': "J", 'm': "M", 'n': "N", 'ŋ': "NK", 'l': "L", 'ɫ': "L",
+    'r': "R", 'ɹ': "R", 'ɾ': "T", 'ɚ': "R", 'ɝ': "R",
+}
+SOUND_MIN_KEY = 2   # 太短的鍵 (例如只剩一個子音) 命中太多，不列入
+
+def _squeeze(key):
+    """連續相同的音只算一次 (JJ → J)"""
+    return re.sub(r"(.)\1+", r"\1", key)
+
+def metaphone_key(text):
+    """
+    拼字 → Metaphone 式發音鍵 (簡化版 Lawrence Philips 規則)：
+    子音依發音歸類 (C→K/S/X、PH→F、TH→0、D→T…)，母音只保留字首 (統一成 A)。
+    """
+    w = "".join(c for c in str(text).upper() if "A" <= c <= "Z")
+    if not w:
+        return ""
+    if w[:2] in ("AE", "GN", "KN", "PN", "WR"):
+        w = w[1:]
+    elif w[0] == "X":
+        w = "S" + w[1:]
+    elif w[:2] == "WH":
+        w = "W" + w[2:]
+
+    out = []
+    n = len(w)
+    for i, c in enumerate(w):
+        prev = w[i - 1] if i else ""
+        nxt = w[i + 1] if i + 1 < n else ""
+        nxt2 = w[i + 2] if i + 2 < n else ""
+        if c == prev and c != "C":
+            continue
+        if c in _VOWELS:
+            if i == 0:
+                out.append("A")
+        elif c == "B":
+            if not (prev == "M" and i == n - 1):
+                out.append("B")
+        elif c == "C":
+            if nxt == "I" and nxt2 == "A":
+                out.append("X")
+            elif nxt == "H":
+                out.append("K" if prev == "S" else "X")
+            elif nxt in ("I", "E", "Y"):
+                if prev != "S":
+                    out.append("S")
+            else:
+                out.append("K")
+        elif c == "D":
+            out.append("J" if nxt == "G" and nxt2 in ("E", "I", "Y") else "T")
+        elif c == "G":
+            if nxt == "H" and not (i + 2 >= n or nxt2 in _VOWELS):
+                continue
+            if nxt == "N" and (i + 2 == n or w[i + 2:] == "ED"):
+                continue
+            if prev == "D" and nxt in ("E", "I", "Y"):
+                continue
+            out.append("J" if nxt in ("E", "I", "Y") and prev != "G" else "K")
+        elif c == "H":
+            if nxt in _VOWELS and prev not in set("CSPTG"):
+                out.append("H")
+        elif c == "K":
+            if prev != "C":
+                out.append("K")
+        elif c == "P":
+            out.append("F" if nxt == "H" else "P")
+        elif c == "Q":
+            out.append("K")
+        elif c == "S":
+            out.append("X" if nxt == "H" or (nxt == "I" and nxt2 in ("O", "A")) else "S")
+        elif c == "T":
+            if nxt == "I" and nxt2 in ("O", "A"):
+                out.append("X")
+            elif nxt == "H":
+                out.append("0")
+            elif not (nxt == "C" and nxt2 == "H"):
+                out.append("T")
+        elif c == "V":
+            out.append("F")
+        elif c in ("W", "Y"):
+            if nxt in _VOWELS:
+                out.append(c)
+        elif c == "X":
+            out.append("KS")
+        elif c == "Z":
+            out.append("S")
+        else:  # F J L M N R
+            out.append(c)
+    return _squeeze("".join(out))
+
+def ipa_key(ipa):
+    """
+    IPA 音標 → 與 metaphone_key 同一套字母的發音鍵：
+    去掉重音、長音、音節點與附加符號，tʃ / dʒ 等塞擦音先合併，母音只保留字首 (A)。
+    """
+    text = unicodedata.normalize("NFD", str(ipa).split(",")[0].split(";")[0].lower())
+    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+    text = text.replace("tʃ", "ʧ").replace("dʒ", "ʤ")
+    text = "".join(c for c in text if c in _IPA_VOWELS or c in _IPA_CONSONANTS or c in "jwh")
+    out = []
+    for i, c in enumerate(text):
+        nxt = text[i + 1] if i + 1 < len(text) else ""
+        if c in _IPA_VOWELS:
+            if i == 0:
+                out.append("A")
+        elif c in "jwh":
+            if nxt in _IPA_VOWELS:
+                out.append({'j': "Y", 'w': "W", 'h': "H"}[c])
+        else:
+            out.append(_IPA_CONSONANTS[c])
+    return _squeeze("".join(out))
+
+class SoundIndex:
+    """
+    發音鍵 → 列位置 的雜湊表：每列登記「拼字鍵」與「音標鍵」。
+    查詢時把使用者輸入 (照發音亂拼也行) 轉成拼字鍵，一次 dict 查詢就能找到同音條目。
+    """
+    def __init__(self, df):
+        row_keys = []
+        table = {}
+        phonetics = with_columns(df, ['phonetic'])['phonetic']
+        for i, (word, ipa) in enumerate(zip(df['word'].astype("string").fillna(""), phonetics)):
+            keys = self._row_keys(word, ipa)
+            row_keys.append(keys)
+            for key in keys:
+                table.setdefault(key, []).append(i)
+        self.row_keys = LayeredMap(row_keys)
+        self.table = LayeredMap(table)
+
+    @staticmethod
+    def _row_keys(word, ipa):
+        keys = {metaphone_key(word)}
+        if isinstance(ipa, str) and ipa:
+            keys.add(ipa_key(ipa))
+        return tuple(k for k in keys if len(k) >= SOUND_MIN_KEY)
+
+    def lookup(self, text):
+        """回傳發音相近的列位置 (依原始順序)；輸入太短或不是英文時回傳空串列"""
+        key = metaphone_key(text)
+        if len(key) < SOUND_MIN_KEY:
+            return []
+        return self.table.get(key, [])
+
+    def patched(self, df, rows):
+        """copy-on-write 增量更新：只重算變動列的鍵，雜湊表共用基底、只複製差異層"""
+        new = copy.copy(self)
+        new.row_keys = self.row_keys.derive()
+        new.table = self.table.derive()
+        changed = with_columns(df.iloc[rows], ['phonetic'])
+        for i, word, ipa in zip(rows, changed['word'].astype("string").fillna(""), changed['phonetic']):
+            for key in new.row_keys.get(i, ()):
+                rest = [j for j in new.table.get(key, ()) if j != i]
+                if rest:
+                    new.table[key] = rest
+                else:
+                    del new.table[key]
+            new.row_keys[i] = self._row_keys(word, ipa)
+            for key in new.row_keys.get(i):
+                new.table[key] = sorted(new.table.get(key, []) + [i])
+        return new
+
+# --- 搜尋框自動完成 (排序陣列 + bisect) ---
+COMPLETE_LIMIT = 8
+
+class PrefixIndex:
+    """
+    單字與字根詞素的排序鍵陣列：(小寫鍵, 種類) 依字典序排好，
+    前綴查詢是兩次 bisect 取出連續區段，不必掃描整張表。
+    增量更新後，基底之後才出現的鍵放在另一個小的排序陣列 extra_keys，查詢時兩邊各取一段。
+    """
+    def __init__(self, df):
+        row_keys = [self._row_keys(w, r) for w, r in zip(df['word'], df['roots'])]
+        info = {}          # (鍵, 種類) -> [顯示文字, 條目數]
+        for keys in row_keys:
+            for key, display in keys:
+                entry = info.get(key)
+                if entry is None:
+                    info[key] = [display, 1]
+                else:
+                    entry[1] += 1
+        self.row_keys = LayeredMap(row_keys)
+        self.info = LayeredMap(info)
+        self.keys = sorted(info)   # 基底的鍵 (與 info.base 一致，跨版本共用)
+        self.extra_keys = []       # 不在基底裡的新鍵
+
+    @staticmethod
+    def _row_keys(word, roots):
+        keys = []
+        if isinstance(word, str) and word.strip():
+            keys.append(((word.strip().lower(), 'word'), word.strip()))
+        if isinstance(roots, str):
+            keys.extend(((m, 'root'), m) for m in {m.lower() for m in _MORPHEME_RE.findall(roots)})
+        return keys
+
+    def complete(self, prefix, limit=COMPLETE_LIMIT):
+        """回傳 [(顯示文字, 種類, 條目數)]：完全相符 → 單字優先 → 條目多的 → 較短的"""
+        p = str(prefix).strip().lower()
+        if not p:
+            return []
+
+        def candidates():
+            for keys in (self.keys, self.extra_keys):
+                lo = bisect.bisect_left(keys, (p,))
+                hi = bisect.bisect_left(keys, (p + "\uffff",), lo)
+                for j in range(lo, hi):
+                    entry = self.info.get(keys[j])
+                    if entry is not None:     # 基底裡的鍵可能已經被後來的修補移除
+                        yield keys[j], entry
+
+        # 整段 [lo, hi) 都參與排名 (只保留前 limit 名的堆積)，前綴很短時也不會漏掉條目多的鍵
+        ranked = heapq.nsmallest(limit, candidates(),
+                                 key=lambda f: (f[0][0] != p, f[0][1] != 'word', -f[1][1], len(f[0][0]), f[0]))
+        return [(entry[0], k[1], entry[1]) for k, entry in ranked]
+
+    def patched(self, df, rows):
+        """
+        copy-on-write 增量更新：變動列的舊鍵減一 (歸零就移除)，新鍵加一。
+        基底的排序陣列與計數表都共用，只複製差異層與 extra_keys。
+        """
+        new = copy.copy(self)
+        new.row_keys = self.row_keys.derive()
+        new.info = self.info.derive()
+        new.extra_keys = list(self.extra_keys)
+        if new.info.base is not self.info.base:
+            # 計數表剛攤平：基底鍵 = 舊基底鍵 + extra_keys (兩者都已排序，線性合併)
+            new.keys = [k for k in heapq.merge(self.keys, self.extra_keys) if k in new.info.base]
+            new.extra_keys = []
+        for i in rows:
+            for key, _ in new.row_keys.get(i, ()):
+                display, count = new.info.get(key)
+                if count > 1:
+                    new.info[key] = [display, count - 1]
+                    continue
+                del new.info[key]
+                if key not in new.info.base:
+                    new.extra_keys.pop(bisect.bisect_left(new.extra_keys, key))
+            new.row_keys[i] = self._row_keys(df.at[i, 'word'], df.at[i, 'roots'])
+            for key, display in new.row_keys.get(i):
+                entry = new.info.get(key)
+                if entry is not None:
+                    new.info[key] = [entry[0], entry[1] + 1]
+                    continue
+                new.info[key] = [display, 1]
+                if key not in new.info.base:
+                    bisect.insort(new.extra_keys, key)
+        return new
+
+# 可以增量更新的衍生索引 (get_db_index 依名稱查表)；沒登記的索引遇到新快照就整份重建
+INDEX_PATCHERS = {
+    'distractors': patch_distractor_index,
+    'near_dup': NearDupIndex.patched,
+    'sound': SoundIndex.patched,
+    'prefix': PrefixIndex.patched,
+}
+
+# --- 相關概念圖 (稀疏鄰接表) ---
+RELATED_K = 6
+RELATED_MAX_MORPHEME_ROWS = 200   # 太常見的詞素 (如 -tion) 不當作關聯依據
+RELATED_WEIGHTS = {'字根': 1.0, '搭配提及': 1.5, '定義相近': 0.5}
+_WORD_TOKEN_RE = re.compile(r"[a-zA-Z][a-zA-Z\-']+")
+
+class RelatedGraph:
+    """
+    每份快照建一次的相關條目圖：
+    1. 共用字根詞素 2. collocation / synonym_nuance 提到其他條目 3. 定義相近 (沿用干擾選項表)。
+    每列只保留分數最高的 RELATED_K 個鄰居，查詢就是一次陣列讀取。
+    """
+    def __init__(self, df, k=RELATED_K):
+        n = len(df)
+        words = df['word'].astype(str).tolist()
+        self.word_pos = {}
+        for i, w in enumerate(words):
+            self.word_pos.setdefault(w.lower(), i)
+        scores = [dict() for _ in range(n)]
+
+        def link(a, b, reason):
+            if a == b or words[a].lower() == words[b].lower():
+                return
+            w = RELATED_WEIGHTS[reason]
+            for x, y in ((a, b), (b, a)):
+                score, best = scores[x].get(y, (0.0, reason))
+                scores[x][y] = (score + w, best if RELATED_WEIGHTS[best] >= w else reason)
+
+        # 1. 共用字根詞素
+        morpheme_rows = {}
+        for i, roots in enumerate(df['roots'].astype("string").fillna("")):
+            for m in {m.lower() for m in _MORPHEME_RE.findall(roots)}:
+                morpheme_rows.setdefault(m, []).append(i)
+        for rows in morpheme_rows.values():
+            if 1 < len(rows) <= RELATED_MAX_MORPHEME_ROWS:
+                for a_i, a in enumerate(rows):
+                    for b in rows[a_i + 1:]:
+                        link(a, b, '字根')
+
+        # 2. 搭配 / 辨析文字中提到的其他條目 (以 1~3 個英文詞的片語查表)
+        mentions = with_columns(df, ['collocation', 'synonym_nuance'])
+        mention_text = (mentions['collocation'].astype("string").fillna("") + " " +
+                        mentions['synonym_nuance'].astype("string").fillna(""))
+        for i, text in enumerate(mention_text):
+            tokens = [t.lower() for t in _WORD_TOKEN_RE.findall(text)]
+            seen = set()
+            for size in (1, 2, 3):
+                for j in range(len(tokens) - size + 1):
+                    phrase = " ".join(tokens[j:j + size])
+                    pos = self.word_pos.get(phrase)
+                    if pos is not None and pos not in seen and len(phrase) > 3:
+                        seen.add(pos)
+                        link(i, pos, '搭配提及')
 
-    try:
-        # 2. 用 Google 轉出高品質 MP3
-        tts = gTTS(text=english_only, lang='en')
-        fp = BytesIO()
-        tts.write_to_fp(fp)
-        
-        # 3. 把 MP3 變成一串文字 (Base64)，直接塞進 HTML 裡
-        audio_base64 = base64.b64encode(fp.getvalue()).decode()
-        unique_id = f"audio_{int(time.time()*1000)}_{key_suffix}"
-
-        # 4. 建立一個獨立的 HTML 按鈕組件
-        # 這裡面包含完整的 MP3 資料，不依賴外部連結，點擊瞬間直接播放
-        html_code = f"""
-        <html>
-        <style>
-            .btn {{
-                background: white;
-                border: 1px solid #e0e0e0;
-                border-radius: 8px;
-                padding: 5px 10px;
-                cursor: pointer;
-                display: flex;
-                align-items: center;
-                gap: 5px;
-                font-family: sans-serif;
-                font-size: 14px;
-                color: #333;
-                transition: 0.2s;
-                box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-            }}
-            .btn:hover {{
-                background: #f8f9fa;
-                border-color: #ccc;
-            }}
-            .btn:active {{
-                background: #eef;
-                transform: scale(0.98);
-            }}
-        </style>
-        <body>
-            <button class="btn" onclick="playAudio()">
-                🔊 聽發音
-            </button>
-            
-            <audio id="{unique_id}" style="display:none">
-                <source src="data:audio/mp3;base64,{audio_base64}" type="audio/mp3">
-            </audio>
-
-            <script>
-                function playAudio() {{
-                    var audio = document.getElementById("{unique_id}");
-                    audio.currentTime = 0; // 每次點擊都從頭播放
-                    audio.play().catch(e => console.log(e));
-                }}
-            </script>
-        </body>
-        </html>
-        """
-        
-        # 5. 渲染這個獨立組件 (設定高度避免留白太大)
-        st.components.v1.html(html_code, height=40)
-        
-    except Exception as e:
-        st.error(f"語音生成失敗: {e}")
+        # 3. 定義相近：直接取干擾選項表的前 3 名
+        distractors = get_db_index("distractors", df, build_distractor_index)
+        for i in range(n):
+            for j in distractors[i][:3]:
+                if j >= 0:
+                    link(i, int(j), '定義相近')
 
-def get_spreadsheet_url():
-    """安全地獲取試算表網址，相容兩種 secrets 格式"""
-    try:
-        return st.secrets["connections"]["gsheets"]["spreadsheet"]
-    except:
-        try:
-            return st.secrets["gsheets"]["spreadsheet"]
-        except:
-            st.error("找不到 spreadsheet 設定，請檢查 secrets.toml")
-            return ""
-def track_intent(label):
-    """紀錄用戶意願 (點擊次數) 到 Google Sheets 的 metrics 分頁"""
-    try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        url = get_spreadsheet_url()
-        # 讀取 metrics 分頁 (建議你在 Sheet 裡先建好這一頁，欄位為 feature_name, count)
-        try:
-            m_df = conn.read(spreadsheet=url, worksheet="metrics", ttl=0)
-        except:
-            # 如果沒這一頁，建立初始資料
-            m_df = pd.DataFrame(columns=['feature_name', 'count'])
-        
-        if label in m_df['feature_name'].values:
-            m_df.loc[m_df['feature_name'] == label, 'count'] += 1
-        else:
-            new_row = pd.DataFrame([{'feature_name': label, 'count': 1}])
-            m_df = pd.concat([m_df, new_row], ignore_index=True)
-        
-        # 寫回雲端 (注意：這會更新整頁)
-        conn.update(spreadsheet=url, worksheet="metrics", data=m_df)
-    except Exception as e:
-        # 靜默處理，不干擾用戶
-        pass
-@st.cache_data(ttl=360) 
-def load_db(source_type="Google Sheets"):
-    # 定義標準 21 個欄位名稱
-    COL_NAMES = [
-        'category', 'roots', 'meaning', 'word', 'breakdown', 
-        'definition', 'phonetic', 'example', 'translation', 'native_vibe',
-        'synonym_nuance', 'visual_prompt', 'social_status', 'emotional_tone', 'street_usage',
-        'collocation', 'etymon_story', 'usage_warning', 'memory_hook', 'audio_tag',
-        'term'  # <-- 補上第 21 個欄位
-    ]
-    
-    df = pd.DataFrame(columns=COL_NAMES)
+        self.neighbors = np.full((n, k), -1, dtype=np.int32)
+        self.weights = np.zeros((n, k), dtype=np.float32)
+        self.reasons = [[] for _ in range(n)]
+        for i, row_scores in enumerate(scores):
+            top = sorted(row_scores.items(), key=lambda kv: -kv[1][0])[:k]
+            for slot, (j, (score, reason)) in enumerate(top):
+                self.neighbors[i, slot] = j
+                self.weights[i, slot] = score
+                self.reasons[i].append(reason)
+
+    def related(self, word):
+        """回傳 [(列位置, 分數, 原因)]；不在圖中的單字回傳空串列"""
+        pos = self.word_pos.get(str(word).lower())
+        if pos is None:
+            return []
+        return [(int(j), float(w), r) for j, w, r in zip(self.neighbors[pos], self.weights[pos], self.reasons[pos]) if j >= 0]
 
-    try:
-        if source_type == "Google Sheets":
-            conn = st.connection("gsheets", type=GSheetsConnection)
-            url = get_spreadsheet_url()
-            df = conn.read(spreadsheet=url, ttl=0)
-        
-        elif source_type == "Local JSON":
-            json_file = "master_db.json"
-            if os.path.exists(json_file):
-                with open(json_file, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                if data: df = pd.DataFrame(data)
-        
-        # 1. 自動補齊缺失欄位
-        for col in COL_NAMES:
-            if col not in df.columns:
-                df[col] = 0 if col == 'term' else "無"
-        
-        # 2. 清洗與排序
-        df = df.dropna(subset=['word']).fillna("無")
-        return df[COL_NAMES].reset_index(drop=True)
-        
-    except Exception as e:
-        st.error(f"❌ 資料庫載入失敗: {e}")
-        return pd.DataFrame(columns=COL_NAMES)
 def submit_report(row_data):
     """
     將單字資料一鍵寫入反饋試算表，並標記 term=1 (待修理)
     """
     try:
-        # 1. 指定你的回饋表單 URL
-        FEEDBACK_URL = "https://docs.google.com/spreadsheets/d/1NNfKPadacJ6SDDLw9c23fmjq-26wGEeinTbWcg7-gFg/edit?gid=0#gid=0"
-        
-        # 2. 建立連線 (確保 secrets.toml 已配置 GSheets 權限)
+        # 1. 建立連線 (確保 secrets.toml 已配置 GSheets 權限)；回饋表單 URL 見 FEEDBACK_URL
         conn_fb = st.connection("gsheets", type=GSheetsConnection)
         
-        # 3. 處理資料：複製該列並強制設定 term=1
+        # 2. 處理資料：複製該列並強制設定 term=1
         # row_data 如果是從 page_home 傳進來的 row.to_dict()
-        report_row = row_data.copy()
+        # 底線開頭的是內部欄位 (例如 _pos)，不寫進試算表
+        report_row = {k: ("無" if not isinstance(v, str) and pd.isna(v) else v)
+                      for k, v in row_data.items() if not str(k).startswith("_")}
         report_row['term'] = 1  # 標記為待修理
         
-        # 4. 讀取現有資料進行合併 (Append 邏輯)
-        # ttl=0 確保每次按按鈕都是讀取最新狀態，避免寫入衝突
-        existing_fb = conn_fb.read(spreadsheet=FEEDBACK_URL, ttl=0)
-        
-        # 5. 轉換為 DataFrame 並確保欄位順序正確
-        report_df = pd.DataFrame([report_row])
-        
-        # 6. 合併新舊資料
-        updated_fb = pd.concat([existing_fb, report_df], ignore_index=True)
-        
-        # 7. 寫回 Google Sheets
-        conn_fb.update(spreadsheet=FEEDBACK_URL, data=updated_fb)
+        # 3. 先寫入本地日誌 (立即返回)，背景重放器再附加到回饋表單最後；
+        #    試算表暫時無法使用時回報不會遺失，恢復後自動補寫
+        journal_write('report', report_row, conn_fb, get_spreadsheet_url())
         
-        # 8. 顯示輕量化提示 (Toast) 
+        # 4. 顯示輕量化提示 (Toast) 
         # 這不會像 st.success 佔用頁面空間，也不會強制阻斷使用者操作
         st.toast(f"✅ 已成功將「{row_data.get('word', '該單字')}」記錄至待修清單", icon="🛠️")
         
@@ -282,85 +2092,636 @@ def submit_report(row_data):
         st.error(f"❌ 回報寫入失敗: {e}")
         return False
 # ==========================================
+# 2-2. 資料匯出 (分塊串流，不一次吃滿記憶體)
+# ==========================================
+EXPORT_FORMATS = {"CSV": ".csv", "JSONL": ".jsonl", "Parquet": ".parquet"}
+EXPORT_COMPRESSIONS = ["無", "gzip", "zstd"]
+EXPORT_DIR = "exports"
+EXPORT_KEEP = 5             # exports/ 保留最近幾份存到磁碟的備份
+EXPORT_DOWNLOAD_PREFIX = "etymon_download_"
+
+def _has_zstandard():
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def export_compressions(fmt):
+    """可選的壓縮格式：Parquet 內建 zstd；CSV / JSONL 的 zstd 需要 zstandard 套件，沒裝就不列出"""
+    if fmt == "Parquet" or _has_zstandard():
+        return EXPORT_COMPRESSIONS
+    return [c for c in EXPORT_COMPRESSIONS if c != "zstd"]
+
+def _open_compressed_sink(path, compression):
+    """依壓縮格式開啟可串流寫入的二進位檔案"""
+    if compression == "gzip":
+        return gzip.open(path, "wb", compresslevel=5)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd 壓縮需要安裝 zstandard 套件 (pip install zstandard)")
+        return zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb"), closefd=True)
+    return open(path, "wb")
+
+def iter_text_chunks(df, chunk_rows=2000):
+    """逐塊還原成試算表格式的全文字表：每次只轉 chunk_rows 列，不會先做出整張表的字串副本"""
+    for start in range(0, len(df), chunk_rows):
+        yield start, to_sheet_layout(df.iloc[start:start + chunk_rows]).astype(str)
+
+def iter_export_chunks(df, fmt="CSV", chunk_rows=2000):
+    """
+    將 DataFrame 切成小塊逐一序列化 (只適用文字格式 CSV / JSONL)：
+    每次只產生 chunk_rows 列的 bytes，記憶體用量與總列數無關。
+    """
+    if df.empty:
+        if fmt != "JSONL":
+            yield to_sheet_layout(df).to_csv(index=False).encode("utf-8")
+        return
+    for start, chunk in iter_text_chunks(df, chunk_rows):
+        if fmt == "JSONL":
+            yield chunk.to_json(orient="records", lines=True, force_ascii=False).encode("utf-8")
+        else:
+            # 只有第一塊帶表頭，串接後即為完整 CSV
+            yield chunk.to_csv(index=False, header=(start == 0)).encode("utf-8")
+
+def _export_suffix(fmt, compression):
+    suffix = EXPORT_FORMATS[fmt]
+    if fmt != "Parquet" and compression == "gzip":
+        suffix += ".gz"
+    elif fmt != "Parquet" and compression == "zstd":
+        suffix += ".zst"
+    return suffix
+
+def prune_exports(export_dir=EXPORT_DIR):
+    """清理 exports/：刪掉下載用的殘留暫存檔，存到磁碟的備份只留最近 EXPORT_KEEP 份"""
+    if not os.path.isdir(export_dir):
+        return
+    backups = []
+    for name in os.listdir(export_dir):
+        path = os.path.join(export_dir, name)
+        if name.startswith(EXPORT_DOWNLOAD_PREFIX):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        elif name.startswith("etymon_backup_"):
+            backups.append(path)
+    for path in sorted(backups, key=os.path.getmtime, reverse=True)[EXPORT_KEEP:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def export_db(df, fmt="CSV", compression="無", path=None, chunk_rows=2000, prefix="etymon_backup_"):
+    """
+    分塊將資料庫寫到磁碟，回傳檔案路徑。
+    - CSV / JSONL：逐塊轉成文字再寫入壓縮串流 (gzip / zstd)。
+    - Parquet：每塊寫成一個 row group，壓縮交給 Parquet 內建編碼。
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支援的匯出格式: {fmt}")
+
+    if path is None:
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=prefix, suffix=_export_suffix(fmt, compression), dir=EXPORT_DIR)
+        os.close(fd)
+
+    try:
+        _write_export(full_db(df), fmt, compression, path, chunk_rows)
+    except Exception:
+        # 寫到一半失敗就刪掉殘檔，避免留下看似完整的壞備份
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return path
+
+def export_bytes(df, fmt="CSV", compression="無"):
+    """
+    下載用：分塊寫到暫存檔後讀回 bytes 並立即刪檔。
+    st.download_button 本來就會把整份內容放進記憶體 (壓縮後的大小)，
+    這裡只保證序列化過程不會做出整張表的文字副本，也不會在 exports/ 留下檔案。
+    """
+    prune_exports()
+    path = export_db(df, fmt, compression, prefix=EXPORT_DOWNLOAD_PREFIX)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+def _write_export(df, fmt, compression, path, chunk_rows):
+    if fmt == "Parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([(c, pa.string()) for c in df.columns])
+        codec = "none" if compression == "無" else compression
+        with pq.ParquetWriter(path, schema, compression=codec) as writer:
+            for _, chunk in iter_text_chunks(df, chunk_rows):
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        return
+
+    with _open_compressed_sink(path, compression) as sink:
+        for block in iter_export_chunks(df, fmt, chunk_rows):
+            sink.write(block)
+
+def render_memory_panel(df):
+    """管理員側欄：舊佈局 vs 精簡佈局的記憶體對照 (放大到 10 萬列)"""
+    with st.sidebar.expander("🧠 記憶體佈局報告", expanded=False):
+        st.caption(f"目前快取：{df.memory_usage(deep=True).sum() / 1024:,.0f} KB / {len(df)} 列 / "
+                   f"常駐 {len(df.columns)} 欄 (其餘按需讀取)")
+        if st.button("產生 100k 列對照", use_container_width=True):
+            report = memory_report(full_db(df))
+            total = report.loc['總計']
+            st.metric("精簡後 / 原本", f"{total['compact_bytes'] / 2**20:,.1f} MB",
+                      f"{(total['ratio'] - 1) * 100:.0f}% (原 {total['legacy_bytes'] / 2**20:,.1f} MB)",
+                      delta_color="inverse")
+            st.dataframe(report, use_container_width=True)
+
+def render_export_panel(df):
+    """管理員側欄：匯出目前資料庫 (下載或存到伺服器磁碟)"""
+    with st.sidebar.expander("📦 匯出資料庫備份", expanded=False):
+        fmt = st.selectbox("格式", list(EXPORT_FORMATS), key="export_fmt")
+        compression = st.selectbox("壓縮", export_compressions(fmt), key="export_comp")
+        target = st.radio("輸出方式", ["下載", "存到伺服器磁碟"], horizontal=True, key="export_target")
+
+        if target == "下載":
+            # 傳入 callable：只有按下按鈕才開始分塊寫檔，平常重跑不會產生備份
+            st.download_button(
+                "⬇️ 下載備份",
+                data=lambda: export_bytes(df, fmt, compression),
+                file_name=f"etymon_backup{_export_suffix(fmt, compression)}",
+                mime="application/octet-stream",
+                use_container_width=True,
+            )
+        else:
+            out_path = st.text_input("輸出路徑 (留空則存到 exports/)", key="export_path")
+            if st.button("💾 寫入磁碟", use_container_width=True):
+                try:
+                    if not out_path:
+                        prune_exports()
+                    saved = export_db(df, fmt, compression, path=out_path or None)
+                    st.success(f"✅ 已匯出 {len(df)} 筆至 {saved}")
+                except Exception as e:
+                    st.error(f"❌ 匯出失敗: {e}")
+
+# ==========================================
+# 2-3. 效能剖析：管理員開啟後剖析接下來 N 次重跑
+# ==========================================
+PROFILE_KEEP = 5          # 每個 session 保留最近幾次的剖析結果
+PROFILE_MAX_DEPTH = 64
+PROFILE_MIN_US = 20       # 展開呼叫堆疊時忽略小於此時間的分支，避免路徑數爆炸
+PROFILE_FORMATS = {
+    "speedscope (.json)": ("speedscope", ".speedscope.json", "application/json"),
+    "collapsed stack / flamegraph (.txt)": ("collapsed", ".collapsed.txt", "text/plain"),
+    "pstats (.prof)": ("pstats", ".prof", "application/octet-stream"),
+}
+
+_profiling = threading.local()   # 本執行緒 (= 這次重跑) 是否已在剖析中
+
+def _run_profiled(fn, args=(), kwargs=None, name=None):
+    """
+    沒有待剖析的重跑時只多一次 session_state 查詢，其餘與直接呼叫 fn 相同。
+    有的話用 cProfile 包住這一次呼叫，結果存進 session_state['profiles']。
+    """
+    remaining = st.session_state.get('profile_remaining', 0)
+    if not remaining or getattr(_profiling, 'active', False):
+        return fn(*args, **(kwargs or {}))
+    profiler = cProfile.Profile()
+    t0 = time.perf_counter()
+    _profiling.active = True
+    profiler.enable()
+    try:
+        return fn(*args, **(kwargs or {}))
+    finally:
+        # st.rerun() / st.stop() 也是以例外結束，一樣要收尾
+        profiler.disable()
+        _profiling.active = False
+        record_profile(profiler, time.perf_counter() - t0, name)
+        st.session_state.profile_remaining = remaining - 1
+
+def run_main():
+    """App 入口：整頁重跑經過剖析掛勾"""
+    _run_profiled(main)
+
+def profiled(fn):
+    """
+    片段 (st.fragment) 用：片段單獨重跑時不會經過 run_main，由這裡接上剖析掛勾。
+    整頁重跑時外層的 run_main 已在剖析，這裡直接呼叫。
+    需放在 @st.fragment 之下。
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return _run_profiled(fn, args, kwargs, name=fn.__name__)
+    return wrapper
+
+def record_profile(profiler, wall, name=None):
+    profiler.create_stats()
+    profiles = st.session_state.setdefault('profiles', [])
+    profiles.append({
+        'label': f"{time.strftime('%H:%M:%S')}｜{wall * 1000:.0f} ms" + (f"｜片段 {name}" if name else ""),
+        'ts': time.strftime('%Y%m%d-%H%M%S'),
+        'stats': profiler.stats,
+    })
+    del profiles[:-PROFILE_KEEP]
+
+def _frame_name(func):
+    filename, lineno, name = func
+    if filename == "~":  # 內建函式
+        return name.replace(";", ",")
+    return f"{name} ({os.path.basename(filename)}:{lineno})".replace(";", ",")
+
+def collapsed_stacks(stats):
+    """
+    cProfile 只記錄「呼叫者 → 被呼叫者」的邊，這裡從根節點往下展開成完整呼叫堆疊：
+    每條邊的累計時間依比例分給該函式的自身時間與子呼叫，遇到遞迴就停。
+    回傳 {堆疊 (tuple of 名稱): 微秒}。
+    """
+    children = {}
+    roots = []
+    for func, (_, _, _, _, callers) in stats.items():
+        if not any(c in stats for c in callers):
+            roots.append(func)
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+
+    out = {}
+
+    def walk(func, names, path, share):
+        _, _, tt, ct, _ = stats[func]
+        names = names + (_frame_name(func),)
+        scale = share / ct if ct else 0.0
+        self_us = tt * scale * 1e6
+        if self_us >= 1:
+            out[names] = out.get(names, 0.0) + self_us
+        if len(names) >= PROFILE_MAX_DEPTH:
+            return
+        for child, edge_ct in children.get(func, ()):
+            child_share = edge_ct * scale
+            if child not in path and child_share * 1e6 >= PROFILE_MIN_US:
+                walk(child, names, path | {child}, child_share)
+
+    for root in roots:
+        walk(root, (), {root}, stats[root][3])
+    return out
+
+def speedscope_json(stacks, name):
+    """collapsed stacks → speedscope 的 sampled 格式 (每個堆疊一個樣本，權重為微秒)"""
+    frames, index, samples, weights = [], {}, [], []
+    for stack, us in stacks.items():
+        ids = []
+        for frame in stack:
+            if frame not in index:
+                index[frame] = len(frames)
+                frames.append({'name': frame})
+            ids.append(index[frame])
+        samples.append(ids)
+        weights.append(round(us))
+    return json.dumps({
+        '$schema': "https://www.speedscope.app/file-format-schema.json",
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': "sampled", 'name': name, 'unit': "microseconds",
+            'startValue': 0, 'endValue': sum(weights), 'samples': samples, 'weights': weights,
+        }],
+        'name': name,
+        'exporter': "etymon-decoder",
+    }).encode("utf-8")
+
+def export_profile(profile, kind):
+    if kind == "pstats":
+        # 與 cProfile.Profile.dump_stats 相同格式，可直接用 pstats / snakeviz 開啟
+        return marshal.dumps(profile['stats'])
+    stacks = collapsed_stacks(profile['stats'])
+    if kind == "speedscope":
+        return speedscope_json(stacks, f"Etymon rerun {profile['label']}")
+    return "\n".join(f"{';'.join(stack)} {round(us)}" for stack, us in stacks.items()).encode("utf-8")
+
+def profile_top(stats, n=15):
+    """累計時間最多的函式 (側欄快速瀏覽用)"""
+    rows = sorted(stats.items(), key=lambda kv: -kv[1][3])[:n]
+    return pd.DataFrame([{
+        '函式': _frame_name(func), '呼叫次數': nc,
+        '自身_ms': round(tt * 1000, 1), '累計_ms': round(ct * 1000, 1),
+    } for func, (_, nc, tt, ct, _) in rows])
+
+def render_profiler_panel():
+    """管理員側欄：開啟剖析、查看熱點、下載火焰圖檔案"""
+    with st.sidebar.expander("⏱️ 效能剖析", expanded=False):
+        remaining = st.session_state.get('profile_remaining', 0)
+        if remaining:
+            st.caption(f"剖析中：接下來還有 {remaining} 次重跑 (片段單獨重跑也算一次)")
+        n = st.number_input("剖析接下來幾次重跑", min_value=1, max_value=20, value=3, key="profile_n")
+        if st.button("▶️ 開始剖析", use_container_width=True):
+            st.session_state.profile_remaining = int(n)
+
+        profiles = st.session_state.get('profiles', [])
+        if not profiles:
+            st.caption("尚無剖析結果。")
+            return
+        pick = st.selectbox("剖析結果", list(range(len(profiles)))[::-1], key="profile_pick",
+                            format_func=lambda i: profiles[i]['label'])
+        profile = profiles[min(pick, len(profiles) - 1)]
+        st.dataframe(profile_top(profile['stats']), use_container_width=True, hide_index=True)
+        fmt = st.selectbox("下載格式", list(PROFILE_FORMATS), key="profile_fmt")
+        kind, suffix, mime = PROFILE_FORMATS[fmt]
+        st.download_button(
+            "⬇️ 下載剖析檔",
+            data=lambda: export_profile(profile, kind),
+            file_name=f"etymon_profile_{profile['ts']}{suffix}",
+            mime=mime,
+            use_container_width=True,
+        )
+
+# ==========================================
 # 3. AI 解碼核心 (還原中文 Prompt)
 # ==========================================
-def ai_decode_and_save(input_text, fixed_category):
+DECODE_CACHE_TTL = 7 * 24 * 3600
+
+# 模型選擇：不需要深度推導的領域改用較便宜、較快的 lite 模型
+# (模型名稱、system instruction、Prompt 組裝與回應解析放在 etymon_core，評測工具共用)
+DECODE_MODEL_OPTIONS = ["自動 (依領域)", DECODE_MODEL_FULL, DECODE_MODEL_LITE]
+LITE_CATEGORIES = {"雜類", "流行文化", "料理食觀", "運動健身", "影視文學", "藝術美學"}
+
+def pick_decode_model(fixed_category, choice=None):
+    """使用者指定模型優先；「自動」時依領域決定是否使用 lite 模型"""
+    if choice and choice in (DECODE_MODEL_FULL, DECODE_MODEL_LITE):
+        return choice
+    return DECODE_MODEL_LITE if fixed_category in LITE_CATEGORIES else DECODE_MODEL_FULL
+
+@st.cache_resource
+def get_decode_model(model_name, system_instruction=DECODE_SYSTEM_INSTRUCTION):
+    """每個 (模型, system instruction) 只建立一次，安全設定由 build_decode_model 統一掛上"""
+    return build_decode_model(model_name, system_instruction)
+
+@st.cache_resource
+def get_decode_stats():
+    """整個副本共用的解碼紀錄 (最近 500 筆)：模型、token 數、延遲、是否命中快取"""
+    return deque(maxlen=500)
+
+def record_decode_stats(model_name, fixed_category, latency, usage=None, cache_hit=False):
+    get_decode_stats().append({
+        'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'model': model_name,
+        'category': fixed_category,
+        'latency_s': round(latency, 2),
+        'prompt_tokens': getattr(usage, 'prompt_token_count', 0) or 0,
+        'cached_tokens': getattr(usage, 'cached_content_token_count', 0) or 0,
+        'output_tokens': getattr(usage, 'candidates_token_count', 0) or 0,
+        'total_tokens': getattr(usage, 'total_token_count', 0) or 0,
+        'l2_hit': cache_hit,
+    })
+
+def decode_topic(input_text, fixed_category, api_key, use_cache=True, model_choice=None):
     """
     核心解碼函式：將 Prompt 直接寫入程式碼，確保執行穩定。
+    相同的 Prompt 結果會存在 L2，其他副本不會再對同一主題重複呼叫 Gemini；
+    use_cache=False (強制刷新) 時略過快取重新解碼。
+    每次呼叫的 token 數與延遲都記錄在 get_decode_stats()。
+    不碰任何 st.* 介面元件，可在背景執行緒執行；失敗時拋出例外。
     """
-    api_key = st.secrets.get("GEMINI_API_KEY")
-    if not api_key:
-        st.error("❌ 找不到 GEMINI_API_KEY，請檢查 Streamlit Secrets 設定。")
-        return None
-
     genai.configure(api_key=api_key)
-    
-    from google.generativeai.types import HarmCategory, HarmBlockThreshold
-    safety_settings = {
-        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-    }
+    model_name = pick_decode_model(fixed_category, model_choice)
+    user_prompt = build_decode_prompt(input_text, fixed_category)
 
-    # 還原原本的中文 Prompt
-    SYSTEM_PROMPT = f"""
-    Role: 全領域知識解構專家 (Polymath Decoder).
-    Task: 深度分析輸入內容，並將其解構為高品質、結構化的百科知識 JSON。
-    
-    【領域鎖定】：你目前的身份是「{fixed_category}」專家，請務必以此專業視角進行解構、評論與推導。
-
-    ## 處理邏輯 (Field Mapping Strategy):
-    1. category: 必須固定填寫為「{fixed_category}」。
-    2. word: 核心概念名稱 (標題)。
-    3. roots: 底層邏輯 / 核心原理 / 關鍵公式。使用 LaTeX 格式並用 $ 包圍。
-    4. meaning: 該概念解決了什麼核心痛點或其存在的本質意義。
-    5. breakdown: 結構拆解。步驟流程或組成要素，逐步條列並使用 \\n 換行。
-    6. definition: 用五歲小孩都能聽懂的話 (ELI5) 解釋該概念。
-    7. phonetic: 關鍵年代、發明人名、或該領域的專門術語。標註正確發音與背景。若是外語詞彙，請先提供國際音標 (IPA) 或通用音譯，再針對其中的「專有名詞人名」或「關鍵術語」提供「注音+拼音」對照。
-    8. example: 兩個以上最具代表性的實際應用場景。
-    9. translation: 生活類比。以「🍎 生活比喻：」開頭。
-    10. native_vibe: 專家視角。以「🌊 專家心法：」開頭。
-    11. synonym_nuance: 相似概念對比與辨析。
-    12. visual_prompt: 視覺化圖景描述。
-    13. social_status: 在該領域的重要性評級。
-    14. emotional_tone: 學習此知識的心理感受。
-    15. street_usage: 避坑指南。常見認知誤區。
-    16. collocation: 關聯圖譜。三個延伸知識點。
-    17. etymon_story: 歷史脈絡或發現瞬間。
-    18. usage_warning: 邊界條件與失效場景。
-    19. memory_hook: 記憶金句。
-    20. audio_tag: 相關標籤 (以 # 開頭)。
-
-    ## 輸出規範 (Strict JSON Rules):
-    1. 必須輸出純 JSON 格式，不含任何 Markdown 標記 (如 ```json)。
-    2. 必須遵循標準 JSON 格式，所有的鍵名 (Keys) 與字串值 (Values) 必須使用雙引號 (") 包裹。若內容中需要表示引號，請一律使用中文引號「」或單引號 '，嚴禁在字串內容中使用原始的雙引號。
-    3. LaTeX 公式請使用單個反斜線格式，但在 JSON 內需雙重轉義。
-    4. 換行統一使用 \\\\n。
+    t0 = time.perf_counter()
+    l2_key = cache_key("decode", model_name, DECODE_SYSTEM_INSTRUCTION, user_prompt)
+    if use_cache:
+        cached = l2_get(l2_key)
+        if cached:
+            record_decode_stats(model_name, fixed_category, time.perf_counter() - t0, cache_hit=True)
+            return cached.decode("utf-8")
+
+    response = get_decode_model(model_name).generate_content(user_prompt)
+    record_decode_stats(model_name, fixed_category, time.perf_counter() - t0,
+                        usage=getattr(response, 'usage_metadata', None))
+
+    if not (response and response.text):
+        raise ValueError("AI 無回應。")
+    l2_set(l2_key, response.text.encode("utf-8"), ttl=DECODE_CACHE_TTL)
+    return response.text
+
+# ==========================================
+# 3-1. 解碼背景工作：有上限的執行緒池 + 狀態落地
+# ==========================================
+DECODE_WORKERS = 2
+JOB_DIR = os.path.join(DEFAULT_CACHE_DIR, "jobs")
+JOB_KEEP = 50              # 保留最近幾筆已結束的工作
+JOB_POLL_SECONDS = 2
+JOB_ACTIVE = ('queued', 'decoding', 'saving')
+JOB_STATUS_LABELS = {
+    'queued': "⏳ 排隊中", 'decoding': "🧠 解碼中", 'saving': "💾 寫入中",
+    'done': "✅ 完成", 'exists': "ℹ️ 已在書架上", 'near_dup': "⚠️ 近似重複",
+    'failed': "❌ 失敗", 'interrupted': "⛔ 中斷",
+}
+
+class DecodeJobRunner:
     """
+    解碼工作佇列：Gemini 呼叫與寫回試算表都在背景執行緒跑，管理員送出後可以繼續操作。
+    每次狀態變更都寫成 JOB_DIR/<id>.json，重啟後還看得到結果 (未完成的標記為中斷)。
+    """
+    def __init__(self, workers=DECODE_WORKERS, job_dir=JOB_DIR):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode")
+        self.job_dir = job_dir
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.isdir(self.job_dir):
+            return
+        for name in os.listdir(self.job_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.job_dir, name), "r", encoding="utf-8") as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if job.get('status') in JOB_ACTIVE:
+                job.update(status='interrupted', error="伺服器重新啟動，工作未完成，請重新送出。")
+                self._persist(job)
+            self.jobs[job['id']] = job
+
+    def _persist(self, job):
+        try:
+            os.makedirs(self.job_dir, exist_ok=True)
+            path = os.path.join(self.job_dir, f"{job['id']}.json")
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(job, f, ensure_ascii=False, default=str)
+            os.replace(f"{path}.tmp", path)
+        except OSError:
+            pass  # 落地失敗只影響重啟後的紀錄，不影響工作本身
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = dict(self.jobs[job_id], **fields, updated_at=time.time())
+            self.jobs[job_id] = job
+        self._persist(job)
+        return job
+
+    def submit(self, params, context):
+        """
+        params：word / category / force / use_cache / allow_near_dup / model (會落地)，
+                「仍要寫入」另帶 result (先前的解碼結果，直接存檔不再解碼)；
+        context：conn / url / api_key / source_type (在腳本執行緒取得，不落地)。
+        """
+        now = time.time()
+        job = {
+            'id': f"{int(now * 1000):x}-{random.getrandbits(16):04x}", 'params': params,
+            'status': 'queued', 'created_at': now, 'updated_at': now,
+            'result': None, 'near_dups': [], 'error': None, 'raw': None,
+        }
+        with self._lock:
+            self.jobs[job['id']] = job
+        self._persist(job)
+        self._trim()
+        self.pool.submit(run_decode_job, self, job['id'], context)
+        return job['id']
+
+    def list(self):
+        with self._lock:
+            return sorted(self.jobs.values(), key=lambda j: j['created_at'], reverse=True)
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for j in self.jobs.values() if j['status'] in JOB_ACTIVE)
+
+    def _trim(self):
+        finished = [j for j in self.list() if j['status'] not in JOB_ACTIVE][JOB_KEEP:]
+        for job in finished:
+            with self._lock:
+                self.jobs.pop(job['id'], None)
+            try:
+                os.remove(os.path.join(self.job_dir, f"{job['id']}.json"))
+            except OSError:
+                pass
+
+@st.cache_resource
+def get_job_runner():
+    return DecodeJobRunner()
+
+def decode_context(source_type="Google Sheets"):
+    """背景工作需要的連線與金鑰：在腳本執行緒先取好，工作執行緒不碰 st.secrets"""
+    return {
+        'conn': st.connection("gsheets", type=GSheetsConnection),
+        'url': get_spreadsheet_url(),
+        'api_key': st.secrets.get("GEMINI_API_KEY"),
+        'source_type': source_type,
+    }
+
+def _find_word(sheet_df, word):
+    if sheet_df.empty:
+        return pd.Series(False, index=sheet_df.index)
+    return sheet_df['word'].astype(str).str.lower() == word.lower()
+
+def _existing_entry(ctx, word):
+    """查重：先讀試算表；讀不到 (斷線、斷路中) 就查本副本的快照，存檔本身交給寫入日誌"""
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash', safety_settings=safety_settings)
-        final_prompt = f"{SYSTEM_PROMPT}\n\n解碼目標：「{input_text}」"
-        
-        response = model.generate_content(final_prompt)
-        
-        if response and response.text:
-            return response.text
+        existing_data = call_sheets(ctx['conn'].read, spreadsheet=ctx['url'], ttl=0)
+    except Exception:
+        snapshot = get_snapshot_store().get(ctx['source_type'])
+        if snapshot is None:
+            return None
+        df = snapshot['df']
+        match = df.index[_find_word(df, word)]
+        return hydrate_row(entry_dict(df, match[0]), df) if len(match) else None
+    match_mask = _find_word(existing_data, word)
+    if not match_mask.any():
         return None
+    return {k: compact_value(v) for k, v in existing_data[match_mask].iloc[0].items()}
+
+def run_decode_job(runner, job_id, ctx):
+    """背景執行緒：查重 → 解碼 → 解析 → 近似重複檢查 → 寫入日誌 → 發布變更"""
+    p = runner.jobs[job_id]['params']
+    raw_res = None
+    try:
+        runner.update(job_id, status='decoding')
+        existing = _existing_entry(ctx, p['word'])
+        if existing is not None and not p['force']:
+            runner.update(job_id, status='exists',
+                          result={k: v for k, v in existing.items() if not str(k).startswith("_")})
+            return
+
+        if p.get('result'):
+            res_data = p['result']   # 近似重複被擋下後確認寫入：沿用上次的結果，不依賴解碼快取
+        else:
+            raw_res = decode_topic(p['word'], p['category'], ctx['api_key'],
+                                   use_cache=p['use_cache'], model_choice=p['model'])
+            res_data = parse_decode_result(raw_res)
+
+        # 寫入前檢查：標題不同但內容近似的主題 (MinHash/LSH，比對目前的快照)
+        snapshot = get_snapshot_store().get(ctx['source_type'])
+        if snapshot is not None and not p['allow_near_dup']:
+            df = snapshot['df']
+            near_dups = get_db_index("near_dup", df, NearDupIndex).query(res_data, exclude_word=p['word'])
+            if near_dups:
+                runner.update(job_id, status='near_dup', result=res_data, near_dups=[
+                    {'word': str(df.at[i, 'word']), 'category': compact_value(df.at[i, 'category']),
+                     '相似度': round(score, 2)}
+                    for i, score in near_dups[:10]
+                ])
+                return
+
+        runner.update(job_id, status='saving', result=res_data)
+        # 寫入日誌後立即完成；日誌重放器是唯一的整表寫回者 (以 word 為鍵 upsert)，
+        # 多個工作同時存檔也不會互相覆蓋，試算表暫時掛掉時等恢復後再補寫。
+        # 這裡只修補本副本的快照；寫回成功後重放器才發布到變更紀錄 (見 _apply_entries)
+        journal_write('entry', res_data, ctx['conn'], ctx['url'])
+        get_snapshot_store().apply(ctx['source_type'], [res_data])
+        runner.update(job_id, status='done')
     except Exception as e:
-        st.error(f"Gemini API 錯誤: {e}")
-        return None
-def show_encyclopedia_card(row):
-    # 變數定義與清洗
-    r_word = str(row.get('word', '未命名主題'))
-    r_roots = fix_content(row.get('roots', "")).replace('$', '$$')
-    r_phonetic = fix_content(row.get('phonetic', "")) 
-    r_breakdown = fix_content(row.get('breakdown', ""))
-    r_def = fix_content(row.get('definition', ""))
-    r_meaning = str(row.get('meaning', ""))
-    r_hook = fix_content(row.get('memory_hook', ""))
-    r_vibe = fix_content(row.get('native_vibe', ""))
-    r_trans = str(row.get('translation', ""))
+        runner.update(job_id, status='failed', error=str(e), raw=raw_res)
+@st.cache_data(show_spinner=False, max_entries=512)
+def card_fields(row):
+    """卡片所需的清洗後文字 (有快取，預取執行緒可先把下一張卡算好)"""
+    return {
+        'word': str(row.get('word', '未命名主題')),
+        'roots': fix_content(row.get('roots', "")).replace('$', '$$'),
+        'phonetic': fix_content(row.get('phonetic', "")),
+        'breakdown': fix_content(row.get('breakdown', "")),
+        'definition': fix_content(row.get('definition', "")),
+        'meaning': fix_content(row.get('meaning', "")),
+        'memory_hook': fix_content(row.get('memory_hook', "")),
+        'native_vibe': fix_content(row.get('native_vibe', "")),
+        'translation': fix_content(row.get('translation', "")),
+        'example': fix_content(row.get('example', "")),
+        'synonym_nuance': fix_content(row.get('synonym_nuance', '無')),
+        'usage_warning': fix_content(row.get('usage_warning', '無')),
+    }
+
+def _open_card(row):
+    """相關概念連結的 callback：切換學習頁的目前卡片 (callback 在重跑前執行，不需要 st.rerun)"""
+    st.session_state.curr_w = row
+
+def show_related_links(df, word):
+    """卡片底部的相關概念：讀預先算好的鄰接表，每張卡只是一次陣列讀取"""
+    related = get_db_index("related", df, RelatedGraph).related(word)
+    if not related:
+        return
+    st.markdown("**🔗 相關概念**")
+    cols = st.columns(min(len(related), 3))
+    for n, (pos, score, reason) in enumerate(related):
+        target = df.loc[pos]
+        with cols[n % len(cols)]:
+            st.button(f"{target['word']}｜{reason}", key=f"rel_{word}_{pos}", use_container_width=True,
+                      on_click=_open_card, args=(entry_dict(df, pos),))
+
+def show_encyclopedia_card(row, df=None):
+    # 變數定義與清洗 (資料庫只常駐核心欄位，打開完整卡片時才補讀長文欄位)
+    row = hydrate_row(row, df)
+    f = card_fields(row)
+    r_word = f['word']
+    r_roots = f['roots']
+    r_phonetic = f['phonetic']
+    r_breakdown = f['breakdown']
+    r_def = f['definition']
+    r_meaning = f['meaning']
+    r_hook = f['memory_hook']
+    r_vibe = f['native_vibe']
+    r_trans = f['translation']
 
     # 1. 標題區 (會隨系統主題變色)
     st.markdown(f"<div class='hero-word'>{r_word}</div>", unsafe_allow_html=True)
@@ -368,6 +2729,8 @@ def show_encyclopedia_card(row):
     if r_phonetic and r_phonetic != "無":
         st.caption(f"/{r_phonetic}/")
 
+    speak(r_word, key_suffix="card")
+
     # 2. 邏輯拆解 (深色底漸層)
     st.markdown(f"""
         <div class='breakdown-wrapper'>
@@ -380,7 +2743,7 @@ def show_encyclopedia_card(row):
     
     # 3. 核心內容區 (st.info/success 會自動處理深淺色)
     c1, c2 = st.columns(2)
-    r_ex = fix_content(row.get('example', ""))
+    r_ex = f['example']
     
     with c1:
         st.info("### 🎯 定義與解釋")
@@ -408,9 +2771,13 @@ def show_encyclopedia_card(row):
     with st.expander("🔍 深度百科 (辨析、起源、邊界條件)"):
         sub_c1, sub_c2 = st.columns(2)
         with sub_c1:
-            st.markdown(f"**⚖️ 相似對比：** \n{fix_content(row.get('synonym_nuance', '無'))}")
+            st.markdown(f"**⚖️ 相似對比：** \n{f['synonym_nuance']}")
         with sub_c2:
-            st.markdown(f"**⚠️ 使用注意：** \n{fix_content(row.get('usage_warning', '無'))}")
+            st.markdown(f"**⚠️ 使用注意：** \n{f['usage_warning']}")
+
+    # 6. 相關概念 (只有傳入資料庫時才顯示可導覽的連結)
+    if df is not None and not df.empty:
+        show_related_links(df, r_word)
 
     # --- [關鍵修正：變數名稱統一為 rep_col] ---
     st.write("---")
@@ -422,12 +2789,32 @@ def show_encyclopedia_card(row):
     with rep_col2:
         # 使用唯一 key 以免在隨機探索時發生元件 ID 衝突
         if st.button("🚩 有誤", key=f"rep_card_{r_word}", use_container_width=True):
-            submit_report(row.to_dict() if hasattr(row, 'to_dict') else row)
+            submit_report(row)
 # 4. 頁面邏輯
 # ==========================================
 
+def render_decode_stats():
+    """解碼實驗室：每個模型的平均延遲與 token 用量"""
+    stats = list(get_decode_stats())
+    with st.expander(f"📈 解碼成本與延遲紀錄 (最近 {len(stats)} 次)"):
+        if not stats:
+            st.caption("尚無紀錄。")
+            return
+        log_df = pd.DataFrame(stats)
+        summary = log_df.groupby('model').agg(
+            次數=('latency_s', 'size'),
+            平均延遲_s=('latency_s', 'mean'),
+            平均輸入tokens=('prompt_tokens', 'mean'),
+            平均快取tokens=('cached_tokens', 'mean'),
+            平均輸出tokens=('output_tokens', 'mean'),
+            L2命中率=('l2_hit', 'mean'),
+        ).round(2)
+        st.dataframe(summary, use_container_width=True)
+        st.dataframe(log_df.iloc[::-1], use_container_width=True, hide_index=True)
+
 def page_ai_lab():
     st.title("🔬 Kadowsella 解碼實驗室")
+    render_decode_stats()
     
     FIXED_CATEGORIES = [
         "英語辭源", "語言邏輯", "物理科學", "生物醫學", "天文地質", "數學邏輯", 
@@ -448,66 +2835,101 @@ def page_ai_lab():
     else:
         final_category = selected_category
 
-    force_refresh = st.checkbox("🔄 強制刷新 (覆蓋舊資料)")
+    col_force, col_model = st.columns([1, 1])
+    with col_force:
+        force_refresh = st.checkbox("🔄 強制刷新 (覆蓋舊資料)")
+        allow_near_dup = st.checkbox("允許寫入近似重複的主題", help="預設會擋下與書架上內容高度相似的解碼結果")
+    with col_model:
+        model_choice = st.selectbox("解碼模型", DECODE_MODEL_OPTIONS,
+                                    help=f"自動：{', '.join(sorted(LITE_CATEGORIES))} 使用 {DECODE_MODEL_LITE}")
     
     if st.button("啟動解碼", type="primary"):
         if not new_word:
             st.warning("請先輸入內容。")
-            return
+        elif not st.secrets.get("GEMINI_API_KEY"):
+            st.error("❌ 找不到 GEMINI_API_KEY，請檢查 Streamlit Secrets 設定。")
+        else:
+            get_job_runner().submit(
+                {'word': new_word, 'category': final_category, 'force': force_refresh,
+                 'use_cache': not force_refresh, 'allow_near_dup': allow_near_dup, 'model': model_choice},
+                decode_context(),
+            )
+            st.toast(f"已送出背景解碼：{new_word} (可以先去別頁，完成後回來查看)")
 
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        url = get_spreadsheet_url()
-        existing_data = conn.read(spreadsheet=url, ttl=0)
-        
-        is_exist = False
-        if not existing_data.empty:
-            match_mask = existing_data['word'].astype(str).str.lower() == new_word.lower()
-            is_exist = match_mask.any()
-
-        if is_exist and not force_refresh:
-            st.warning(f"⚠️ 「{new_word}」已在書架上。")
-            show_encyclopedia_card(existing_data[match_mask].iloc[0].to_dict())
-            return
+    render_decode_jobs()
 
-        with st.spinner(f'正在以【{final_category}】視角進行三位一體解碼...'):
-            raw_res = ai_decode_and_save(new_word, final_category)
-            
-            if raw_res is None:
-                st.error("AI 無回應。")
-                return
+def render_decode_jobs():
+    """工作清單：有進行中的工作時以 fragment 定時輪詢，只重跑這一區"""
+    active = get_job_runner().active_count() > 0
+    st.fragment(run_every=JOB_POLL_SECONDS if active else None)(_decode_job_panel)(active)
 
-            try:
-                # 1. 提取 JSON
-                match = re.search(r'\{.*\}', raw_res, re.DOTALL)
-                if not match:
-                    st.error("解析失敗：找不到 JSON 結構。")
-                    return
-                
-                json_str = match.group(0)
+def _decode_job_panel(was_active):
+    runner = get_job_runner()
+    if was_active and runner.active_count() == 0:
+        # 全部完成：整頁重跑一次，停止輪詢並讓其他區塊看到新條目
+        st.rerun()
 
-                # 2. 解析 JSON
-                try:
-                    res_data = json.loads(json_str, strict=False)
-                except json.JSONDecodeError:
-                    fixed_json = json_str.replace('\n', '\\n').replace('\r', '\\r')
-                    res_data = json.loads(fixed_json, strict=False)
-
-                # 3. 寫回資料庫
-                if is_exist and force_refresh:
-                    existing_data = existing_data[~match_mask]
-                
-                new_row = pd.DataFrame([res_data])
-                updated_df = pd.concat([existing_data, new_row], ignore_index=True)
-                
-                conn.update(spreadsheet=url, data=updated_df)
-                st.success(f"🎉 「{new_word}」解碼完成並已存入雲端！")
-                st.balloons()
-                show_encyclopedia_card(res_data)
+    st.subheader("📋 背景解碼工作")
+    jobs = runner.list()
+    if not jobs:
+        st.caption("尚無工作。")
+        return
+    st.dataframe(pd.DataFrame([{
+        '主題': j['params']['word'], '領域': j['params']['category'],
+        '狀態': JOB_STATUS_LABELS.get(j['status'], j['status']),
+        '送出時間': time.strftime("%m-%d %H:%M:%S", time.localtime(j['created_at'])),
+        '耗時_s': round(j['updated_at'] - j['created_at'], 1),
+    } for j in jobs]), use_container_width=True, hide_index=True)
+
+    finished = {j['id']: j for j in jobs if j['status'] not in JOB_ACTIVE}
+    if not finished:
+        return
+    job_id = st.selectbox("查看結果", list(finished), key="job_pick",
+                          format_func=lambda i: f"{finished[i]['params']['word']}｜"
+                                                f"{JOB_STATUS_LABELS.get(finished[i]['status'])}")
+    show_job_result(finished[job_id])
+
+def show_job_result(job):
+    p = job['params']
+    if job['status'] == 'done':
+        st.success(f"🎉 「{p['word']}」解碼完成並已存檔 (背景寫回雲端)！")
+        show_encyclopedia_card(job['result'])
+    elif job['status'] == 'exists':
+        st.warning(f"⚠️ 「{p['word']}」已在書架上 (勾選「強制刷新」可覆蓋)。")
+        if job['result']:
+            show_encyclopedia_card(job['result'])
+    elif job['status'] == 'near_dup':
+        st.warning("⚠️ 書架上已有內容近似的主題，這次先不寫入。")
+        st.dataframe(pd.DataFrame(job['near_dups']), use_container_width=True, hide_index=True)
+        if st.button("仍要寫入 (沿用這次的結果，不會重新呼叫 Gemini)", key=f"job_force_{job['id']}"):
+            get_job_runner().submit(dict(p, allow_near_dup=True, result=job['result']), decode_context())
+            st.rerun()
+        show_encyclopedia_card(job['result'])
+    else:
+        st.error(f"⚠️ 處理失敗: {job['error']}")
+        if job.get('raw'):
+            with st.expander("查看原始數據回報錯誤"):
+                st.code(job['raw'])
+
+def page_near_dup_report(df):
+    st.title("🧹 近似重複報告")
+    st.caption("以 MinHash/LSH 比對 word + definition + breakdown，找出標題不同、內容幾乎相同的條目。")
+    if df.empty:
+        st.warning("目前書架是空的。")
+        return
+
+    threshold = st.slider("相似度門檻 (估計 Jaccard)", 0.3, 0.95, NEAR_DUP_THRESHOLD, 0.05)
+    t0 = time.perf_counter()
+    index = get_db_index("near_dup", df, NearDupIndex)
+    groups = index.clusters(threshold)
+    st.caption(f"{len(df)} 筆｜找到 {len(groups)} 群｜耗時 {time.perf_counter() - t0:.2f}s")
+
+    for n, group in enumerate(groups[:100], start=1):
+        members = df.iloc[group]
+        with st.expander(f"#{n}｜{len(group)} 筆｜" + " / ".join(members['word'].astype(str).tolist()[:4])):
+            st.dataframe(with_columns(members, ['breakdown'])[['word', 'category', 'definition', 'breakdown']],
+                         use_container_width=True)
 
-            except Exception as e:
-                st.error(f"⚠️ 處理失敗: {e}")
-                with st.expander("查看原始數據回報錯誤"):
-                    st.code(raw_res)
 def log_user_intent(label):
     """將用戶點擊意願寫入 Google Sheets 的 metrics 分頁"""
     try:
@@ -515,25 +2937,9 @@ def log_user_intent(label):
         conn = st.connection("gsheets", type=GSheetsConnection)
         url = get_spreadsheet_url()
         
-        # 2. 嘗試讀取名為 'metrics' 的工作表
-        try:
-            # ttl=0 確保我們拿到的是最即時的計數
-            m_df = conn.read(spreadsheet=url, worksheet="metrics", ttl=0)
-        except Exception:
-            # 如果找不到 metrics 工作表，就建立一個初始的 DataFrame
-            m_df = pd.DataFrame(columns=['label', 'count'])
-        
-        # 3. 更新計數邏輯
-        if label in m_df['label'].values:
-            # 如果這個標籤（如 click_coffee）已存在，次數 +1
-            m_df.loc[m_df['label'] == label, 'count'] = m_df.loc[m_df['label'] == label, 'count'].astype(int) + 1
-        else:
-            # 如果是第一次點擊，新增一行紀錄
-            new_record = pd.DataFrame([{'label': label, 'count': 1}])
-            m_df = pd.concat([m_df, new_record], ignore_index=True)
-        
-        # 4. 寫回雲端 (覆蓋 metrics 分頁)
-        conn.update(spreadsheet=url, worksheet="metrics", data=m_df)
+        # 2. 先寫入本地日誌就返回；背景重放器把累積的點擊一次加回 metrics 分頁
+        #    (標籤如 click_coffee 已存在就 +1，第一次點擊則新增一行)
+        journal_write('metric', {'label': label, 'key': 'label'}, conn, url)
         
     except Exception as e:
         # 為了不干擾用戶體驗，後台紀錄失敗時我們靜默處理
@@ -552,16 +2958,24 @@ def page_home(df):
     
     st.write("---")
 
-    # 2. 隨機推薦區標頭
+    # 2. 隨機推薦區 (獨立重跑的片段：換一批 / 有誤 / 聽發音 只重畫這一區)
+    home_recommendations(df)
+
+    st.write("---")
+    st.info("👈 點擊左側選單進入「學習與搜尋」查看完整資料庫。")
+
+@st.fragment
+@profiled
+def home_recommendations(df):
     col_header, col_btn = st.columns([4, 1])
     with col_header:
         st.subheader("💡 今日隨機推薦")
     with col_btn:
         # 當點擊「換一批」時，清除 Session State 讓它重新抽樣
+        # 卡片畫在按鈕下方，同一輪就會抽出新的一批，不需要 st.rerun()
         if st.button("🔄 換一批", use_container_width=True):
             if 'home_sample' in st.session_state:
                 del st.session_state.home_sample
-            st.rerun()
     
     # --- 關鍵修正：鎖定隨機抽樣的結果 ---
     if not df.empty:
@@ -572,6 +2986,8 @@ def page_home(df):
         
         # 從 Session State 讀取單字，確保按下「🚩 有誤」刷新後單字不變
         sample = st.session_state.home_sample
+        # 三張卡的發音同時在背景合成，卡片不必等待
+        prefetch_audio(sample['word'])
         
         cols = st.columns(3)
         for i, (index, row) in enumerate(sample.iterrows()):
@@ -598,11 +3014,111 @@ def page_home(df):
                         # 點擊「🚩 有誤」會觸發 submit_report 寫入 feedback 試算表
                         # 加入 term=1 的邏輯已封裝在 submit_report 內
                         if st.button("🚩 有誤", key=f"rep_home_{i}_{row['word']}", use_container_width=True):
-                            # 呼叫回報函式
-                            submit_report(row.to_dict())
+                            # 抽樣結果可能來自背景刷新前的舊快照：用抽樣本身 (帶著它的快照檔) 組列，再對目前快照補欄位
+                            submit_report(hydrate_row(entry_dict(sample, index), df))
+
+PREFETCH_DEPTH = 3  # 每個分類預先抽好的下一張卡數量
+
+@st.cache_resource
+def get_prefetch_pool():
+    """預取用的背景執行緒池 (所有 session 共用，大小固定)"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+
+def _warm_card(row, df):
+    """背景暖機：先補讀長文欄位、算好卡片文字，結果留在 st.cache_data 裡 (發音交給 AudioPrefetcher)"""
+    try:
+        card_fields(hydrate_row(row, df))
+    except Exception:
+        # 預取失敗不影響使用者，真正顯示時會再試一次
+        pass
+
+def next_card(f_df, sel_cat):
+    """
+    從該分類的預取佇列取出下一張卡，並補滿佇列：
+    新抽到的卡交給背景執行緒暖機，使用者閱讀目前卡片時就已準備好。
+    """
+    queues = st.session_state.setdefault('card_queue', {})
+    queue = queues.setdefault(sel_cat, [])
+    if not queue:
+        queue.append(entry_dict(f_df, f_df.sample(1).index[0]))
+    row = queue.pop(0)
+
+    need = min(PREFETCH_DEPTH - len(queue), len(f_df))
+    if need > 0:
+        refill = [entry_dict(f_df, pos) for pos in f_df.sample(need).index]
+        queue.extend(refill)
+        pool = get_prefetch_pool()
+        for r in refill:
+            pool.submit(_warm_card, r, f_df)
+        # 發音與首頁推薦共用同一個合成池與逾時 / 重試策略
+        prefetch_audio(r['word'] for r in refill)
+    return row
+
+LIST_COLUMNS = ['word', 'definition', 'roots', 'category', 'meaning']
+LIST_SORT_COLUMNS = ['word', 'category', 'roots']
+LIST_PAGE_SIZES = [25, 50, 100, 200]
+
+def paginate_index(df, matched, sort_col, page_no, page_size):
+    """
+    伺服器端分頁：只對符合列的排序鍵做穩定排序 (同鍵依原始順序)，
+    回傳第 page_no 頁的 index，長文字欄位完全不參與排序與序列化。
+    """
+    keys = df.loc[matched, sort_col].astype("string").str.lower()
+    order = keys.sort_values(kind="stable", na_position="last").index
+    start = (page_no - 1) * page_size
+    return order[start:start + page_size]
+
+def _apply_completion():
+    """自動完成的 callback：把選到的字填回搜尋框 (callback 在重跑前執行，可以改 widget 的值)"""
+    picked = st.session_state.get('list_complete')
+    if picked:
+        st.session_state.list_search = picked
+    st.session_state.list_complete = None
+
+def render_completions(df, search):
+    """搜尋框下方的自動完成：每次查詢只是 PrefixIndex 的兩次 bisect"""
+    suggestions = get_db_index("prefix", df, PrefixIndex).complete(search)
+    labels = {}
+    for display, kind, count in suggestions:
+        if display.lower() != search.strip().lower() and display not in labels:
+            labels[display] = f"📘 {display}" if kind == 'word' else f"🧩 {display} ({count})"
+    if labels:
+        st.pills("自動完成", list(labels), format_func=labels.get, key="list_complete",
+                 on_change=_apply_completion, label_visibility="collapsed")
+
+def category_options(df):
+    """分類下拉選單的選項：空白分類在 compact_db 後是缺值，不列入 (也不能和字串一起排序)"""
+    return sorted(str(c) for c in df['category'].dropna().unique())
+
+@st.fragment
+@profiled
+def explore_card(df):
+    """隨機探索卡片 (獨立重跑的片段：換卡、相關概念、有誤回報只重畫卡片區)"""
+    cats = ["全部"] + category_options(df)
+    sel_cat = st.selectbox("選擇學習分類", cats)
+    f_df = df if sel_cat == "全部" else df[df['category'] == sel_cat]
+
+    # --- [關鍵修正] Session State 鎖定邏輯 ---
+    # 1. 初始化 State
+    if 'curr_w' not in st.session_state:
+        st.session_state.curr_w = None
+
+    # 2. 只有按鈕點擊時才更新 State (換題)
+    # 卡片就畫在按鈕下方，同一輪就會顯示新卡片，不需要再 st.rerun()
+    if st.button("🎲 隨機探索下一字 (Next Word)", use_container_width=True, type="primary"):
+        if not f_df.empty:
+            st.session_state.curr_w = next_card(f_df, sel_cat)
+        else:
+            st.warning("此分類目前沒有資料。")
+
+    # 3. 初始載入 (如果原本是空的)
+    if st.session_state.curr_w is None and not f_df.empty:
+        st.session_state.curr_w = next_card(f_df, sel_cat)
+
+    # 4. 顯示卡片 (speak 函式已內建在 show_encyclopedia_card 中)
+    if st.session_state.curr_w:
+        show_encyclopedia_card(st.session_state.curr_w, df)
 
-    st.write("---")
-    st.info("👈 點擊左側選單進入「學習與搜尋」查看完整資料庫。")
 def page_learn_search(df):
     st.title("📖 學習與搜尋")
     if df.empty:
@@ -612,73 +3128,125 @@ def page_learn_search(df):
     tab_card, tab_list = st.tabs(["🎲 隨機探索", "🔍 資料庫列表"])
     
     with tab_card:
-        cats = ["全部"] + sorted(df['category'].unique().tolist())
-        sel_cat = st.selectbox("選擇學習分類", cats)
-        f_df = df if sel_cat == "全部" else df[df['category'] == sel_cat]
-
-        # --- [關鍵修正] Session State 鎖定邏輯 ---
-        # 1. 初始化 State
-        if 'curr_w' not in st.session_state:
-            st.session_state.curr_w = None
-
-        # 2. 只有按鈕點擊時才更新 State (換題)
-        if st.button("🎲 隨機探索下一字 (Next Word)", use_container_width=True, type="primary"):
-            if not f_df.empty:
-                st.session_state.curr_w = f_df.sample(1).iloc[0].to_dict()
-                st.rerun() # 強制刷新以顯示新卡片
-            else:
-                st.warning("此分類目前沒有資料。")
-
-        # 3. 初始載入 (如果原本是空的)
-        if st.session_state.curr_w is None and not f_df.empty:
-            st.session_state.curr_w = f_df.sample(1).iloc[0].to_dict()
-
-        # 4. 顯示卡片 (speak 函式已內建在 show_encyclopedia_card 中)
-        if st.session_state.curr_w:
-            show_encyclopedia_card(st.session_state.curr_w)
+        explore_card(df)
 
     with tab_list:
-        search = st.text_input("🔍 搜尋書架內容...")
+        c_search, c_sound = st.columns([3, 1])
+        with c_search:
+            search = st.text_input("🔍 搜尋書架內容...", key="list_search")
+        with c_sound:
+            sound_alike = st.checkbox("🔊 包含發音相近", value=True, key="list_sound_alike",
+                                      help="照發音拼也找得到，例如 filosofy → philosophy")
         if search:
-            mask = df.astype(str).apply(lambda x: x.str.contains(search, case=False)).any(axis=1)
-            display_df = df[mask]
+            render_completions(df, search)
+            matched = search_rows(df, search)
+            if sound_alike:
+                sound_hits = df.index[get_db_index("sound", df, SoundIndex).lookup(search)]
+                extra = sound_hits.difference(matched)
+                if len(extra):
+                    st.caption(f"🔊 另有 {len(extra)} 筆發音相近：" +
+                               "、".join(df.loc[extra[:8], 'word'].astype(str)))
+                matched = matched.union(sound_hits)
         else:
-            display_df = df.head(50)
-        st.dataframe(display_df[['word', 'definition', 'roots', 'category', 'native_vibe']], use_container_width=True)
+            matched = df.index
+
+        c_sort, c_size, c_page = st.columns([2, 1, 1])
+        with c_sort:
+            sort_col = st.selectbox("排序欄位", LIST_SORT_COLUMNS, key="list_sort")
+        with c_size:
+            page_size = st.selectbox("每頁筆數", LIST_PAGE_SIZES, index=1, key="list_page_size")
+
+        # 搜尋條件 (含發音相近)、排序或每頁筆數改變時回到第一頁
+        query_sig = (search, sound_alike, sort_col, page_size)
+        if st.session_state.get('list_query_sig') != query_sig:
+            st.session_state.list_query_sig = query_sig
+            st.session_state.list_page = 1
+
+        n_pages = max(1, -(-len(matched) // page_size))
+        # 資料庫更新後筆數可能變少：頁碼超出範圍時停在最後一頁
+        if st.session_state.get('list_page', 1) > n_pages:
+            st.session_state.list_page = n_pages
+        with c_page:
+            page_no = st.number_input("頁碼", min_value=1, max_value=n_pages, step=1, key="list_page")
+
+        page_idx = paginate_index(df, matched, sort_col, page_no, page_size)
+        st.caption(f"共 {len(matched)} 筆｜第 {page_no} / {n_pages} 頁")
+        # 只把這一頁的切片送進前端
+        st.dataframe(df.loc[page_idx, LIST_COLUMNS], use_container_width=True)
+
+QUIZ_CHOICES = 4
+
+def quiz_options(df, pos):
+    """選擇題選項：直接讀預先算好的干擾選項表 (O(1))，再與正解一起洗牌"""
+    neighbors = get_db_index("distractors", df, build_distractor_index)
+    answer = str(df.at[pos, 'word'])
+    options = [answer]
+    for j in neighbors[pos]:
+        if j < 0:
+            break
+        w = str(df.at[int(j), 'word'])
+        if w not in options:
+            options.append(w)
+        if len(options) == QUIZ_CHOICES:
+            break
+    random.shuffle(options)
+    return options
 
 def page_quiz(df):
     st.title("🧠 字根記憶挑戰")
     if df.empty: return
     
-    cat = st.selectbox("選擇測驗範圍", df['category'].unique())
+    quiz_panel(df)
+
+@st.fragment
+@profiled
+def quiz_panel(df):
+    """測驗區 (獨立重跑的片段：抽題、作答、揭曉只重畫這一區)"""
+    cats = category_options(df)
+    if not cats:
+        st.warning("目前沒有已分類的單字可以測驗。")
+        return
+    cat = st.selectbox("選擇測驗範圍", cats)
     pool = df[df['category'] == cat]
     
+    mode = st.radio("測驗方式", ["自由回想", "選擇題"], horizontal=True, key="quiz_mode")
+
     # 初始化測驗 State
     if 'q' not in st.session_state:
         st.session_state.q = None
     if 'show_ans' not in st.session_state:
         st.session_state.show_ans = False
 
-    # 按鈕只更新題目
+    # 按鈕只更新題目；題目畫在按鈕下方，同一輪就會顯示，不需要 st.rerun()
     if st.button("🎲 抽一題", use_container_width=True):
-        st.session_state.q = pool.sample(1).iloc[0].to_dict()
+        pos = int(pool.sample(1).index[0])
+        st.session_state.q = entry_dict(df, pos)
+        st.session_state.q_options = quiz_options(df, pos)
         st.session_state.show_ans = False
-        st.rerun()
 
     if st.session_state.q:
         st.markdown(f"### ❓ 請問這對應哪個單字？")
-        st.info(st.session_state.q['definition'])
-        st.write(f"**提示 (字根):** {st.session_state.q['roots']} ({st.session_state.q['meaning']})")
-        
-        if st.button("揭曉答案"):
+        st.info(fix_content(st.session_state.q['definition']))
+        st.write(f"**提示 (字根):** {fix_content(st.session_state.q['roots'])} ({fix_content(st.session_state.q['meaning'])})")
+
+        if mode == "選擇題" and st.session_state.get('q_options'):
+            picked = st.radio("選出正確的單字：", st.session_state.q_options, index=None,
+                              key=f"quiz_pick_{st.session_state.q['word']}")
+            if picked is not None:
+                if picked == st.session_state.q['word']:
+                    st.success("✅ 答對了！")
+                else:
+                    st.error(f"❌ 不是「{picked}」")
+                st.session_state.show_ans = True
+        elif st.button("揭曉答案"):
             st.session_state.show_ans = True
-            st.rerun()
         
         if st.session_state.show_ans:
             st.success(f"💡 答案是：**{st.session_state.q['word']}**")
             # 顯示原生播放器
             speak(st.session_state.q['word'], "quiz")
-            st.write(f"結構拆解：`{st.session_state.q['breakdown']}`")
+            answer = hydrate_row(st.session_state.q, df)
+            st.write(f"結構拆解：`{fix_content(answer.get('breakdown'))}`")
 
 # ==========================================
 # 5. 主程式入口
@@ -717,9 +3285,11 @@ def main():
 
     # --- [選單邏輯] ---
     if is_admin:
-        menu_options = ["首頁", "學習與搜尋", "測驗模式", "🔬 解碼實驗室"]
-        if st.sidebar.button("🔄 強制同步雲端", help="清除 App 快取"):
-            st.cache_data.clear()
+        menu_options = ["首頁", "學習與搜尋", "測驗模式", "🔬 解碼實驗室", "🧹 近似重複報告"]
+        if st.sidebar.button("🔄 強制同步雲端", help="重新讀取資料庫 (所有副本一起換到新的快照世代)"):
+            # 只淘汰版本化的資料庫快照；發音、AI 結果、卡片文字都以內容為鍵，不需要清
+            generation = bump_generation()
+            load_db(generation=generation, force=True)
             st.rerun()
     else:
         menu_options = ["首頁", "學習與搜尋", "測驗模式"]
@@ -727,7 +3297,28 @@ def main():
     page = st.sidebar.radio("功能選單", menu_options)
     st.sidebar.markdown("---")
     
-    df = load_db()
+    df = load_db(generation=current_generation(), feed_seq=feed_head())
+    journal = replay_journal()
+    if is_admin:
+        status_info = db_status()
+        if status_info['age'] is not None:
+            flags = "｜更新中" if status_info['refreshing'] else ""
+            flags += "｜⚡ Sheets 斷路中" if status_info['breaker_open'] else ""
+            st.sidebar.caption(f"資料快照：{status_info['age']:.0f} 秒前{flags}")
+        if status_info['last_error']:
+            st.sidebar.caption(f"⚠️ 上次背景更新失敗：{status_info['last_error'][:80]}")
+        l2_fallback = getattr(get_l2_cache(), 'fallback_reason', None)
+        if l2_fallback:
+            st.sidebar.caption(f"⚠️ 快取：{l2_fallback[:80]}")
+        active_jobs = get_job_runner().active_count()
+        if active_jobs:
+            st.sidebar.caption(f"🔬 背景解碼進行中：{active_jobs} 件")
+        if journal.pending:
+            err = f"｜上次失敗：{journal.last_error[:60]}" if journal.last_error else ""
+            st.sidebar.caption(f"📝 待寫回試算表：{journal.pending} 筆{err}")
+        render_export_panel(df)
+        render_memory_panel(df)
+        render_profiler_panel()
     
     if page == "首頁":
         page_home(df)
@@ -735,6 +3326,11 @@ def main():
         page_learn_search(df)
     elif page == "測驗模式":
         page_quiz(df)
+    elif page == "🧹 近似重複報告":
+        if is_admin:
+            page_near_dup_report(df)
+        else:
+            st.error("⛔ 請先登入")
     elif page == "🔬 解碼實驗室":
         if is_admin:
             page_ai_lab()
@@ -745,4 +3341,4 @@ def main():
     st.sidebar.caption(f"v3.0 Ultimate | {status}")
 
 if __name__ == "__main__":
-    main()
+    run_main()
@@ -0,0 +1,331 @@
+"""
+解碼 Prompt / 模型評測工具：把一組固定主題丟給「Prompt 版本 × 模型」的每個組合，
+同時送出多個主題，統計延遲、token 用量、JSON 解析成功率與 20 個欄位的完整度，
+找出仍能產出有效卡片、又最快最省的設定。
+
+三種後端：
+    - gemini：真的呼叫 Gemini (需要 GEMINI_API_KEY 或 --api-key)；可用 --record 把回應錄下來
+    - replay：重播 --record 錄下的回應 (含當時的延遲與 token 數)，不打任何外部服務；Prompt 內容改過就要重錄
+    - stub：本地替身模型，依 --stub-* 參數產生固定種子的回應 (含截斷、缺欄位)，用來驗證評測流程本身
+
+用法範例：
+    python bench_decode.py --backend gemini --record runs/baseline.jsonl
+    python bench_decode.py --backend replay --record runs/baseline.jsonl --json report.json
+    python bench_decode.py --backend gemini --prompt short=prompts/short.txt --model gemini-2.5-flash-lite
+    python bench_decode.py --backend stub --topics topics.jsonl --concurrency 8
+
+主題檔：JSON 陣列或 JSONL，每筆 {"word": "...", "category": "..."}；不指定時使用內建的 8 個主題。
+解析與使用者訊息沿用 etymon_core 的 parse_decode_result / build_decode_prompt (與 App 共用)，結果與解碼實驗室一致。
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from etymon_core import (
+    COL_NAMES, DECODE_MODEL_FULL, DECODE_MODEL_LITE, DECODE_SYSTEM_INSTRUCTION,
+    build_decode_model, build_decode_prompt, parse_decode_result,
+)
+
+DECODE_FIELDS = [c for c in COL_NAMES if c != 'term']   # Prompt 要求的 20 個欄位
+DEFAULT_TOPICS = [
+    {'word': "benevolent", 'category': "英語辭源"},
+    {'word': "photosynthesis", 'category': "生物醫學"},
+    {'word': "entropy", 'category': "物理科學"},
+    {'word': "recursion", 'category': "程式開發"},
+    {'word': "compound interest", 'category': "金融投資"},
+    {'word': "game theory", 'category': "數學邏輯"},
+    {'word': "Renaissance", 'category': "歷史文明"},
+    {'word': "umami", 'category': "料理食觀"},
+]
+
+
+def load_topics(path):
+    if not path:
+        return list(DEFAULT_TOPICS)
+    with open(path, "r", encoding="utf-8") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def load_prompts(specs):
+    """--prompt name=path；不指定時只評測 App 目前的 DECODE_SYSTEM_INSTRUCTION"""
+    prompts = {}
+    for spec in specs:
+        name, _, path = spec.partition("=")
+        if not path:
+            raise ValueError(f"--prompt 格式錯誤，應為 名稱=檔案: {spec}")
+        with open(path, "r", encoding="utf-8") as f:
+            prompts[name] = f.read()
+    return prompts or {'current': DECODE_SYSTEM_INSTRUCTION}
+
+
+def _usage(usage):
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_token_count', 0) or 0,
+        'output_tokens': getattr(usage, 'candidates_token_count', 0) or 0,
+        'total_tokens': getattr(usage, 'total_token_count', 0) or 0,
+    }
+
+
+class GeminiBackend:
+    """真的呼叫 Gemini：每個 (Prompt, 模型) 建一次模型物件，設定與 App 相同 (共用 build_decode_model)"""
+    def __init__(self, api_key):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model(self, prompt_name, system_prompt, model_name):
+        with self._lock:
+            key = (prompt_name, model_name)
+            if key not in self._models:
+                self._models[key] = build_decode_model(model_name, system_prompt)
+            return self._models[key]
+
+    def generate(self, prompt_name, system_prompt, model_name, topic):
+        t0 = time.perf_counter()
+        response = self._model(prompt_name, system_prompt, model_name).generate_content(
+            build_decode_prompt(topic['word'], topic['category']))
+        latency = time.perf_counter() - t0
+        return response.text or "", latency, _usage(getattr(response, 'usage_metadata', None))
+
+
+def prompt_digest(system_prompt):
+    """Prompt 內容的短雜湊：同名 Prompt 改過內容後，舊錄音不能再拿來重播"""
+    return hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def record_key(rec):
+    return rec['prompt'], rec.get('prompt_sha'), rec['model'], rec['word']
+
+
+def load_records(path):
+    """讀取錄音檔 (JSONL)；同一個鍵錄過多次時以最後一筆為準"""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                records[record_key(rec)] = rec
+    return records
+
+
+def compact_records(path):
+    """把錄音檔改寫成每個鍵只留最新一筆 (寫暫存檔再替換)，重複錄製不會一直累積"""
+    records = load_records(path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for rec in records.values():
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+class ReplayBackend:
+    """
+    重播錄下的回應：以 (Prompt 名稱, Prompt 雜湊, 模型, 主題) 為鍵，延遲照錄下時的數字回報 (不真的等待)。
+    Prompt 內容跟錄下時不同就報錯，不會把舊 Prompt 的回應算到新 Prompt 頭上。
+    """
+    def __init__(self, path):
+        self.records = load_records(path)
+
+    def generate(self, prompt_name, system_prompt, model_name, topic):
+        rec = self.records.get((prompt_name, prompt_digest(system_prompt), model_name, topic['word']))
+        if rec is not None:
+            return rec['text'], rec['latency_s'], rec['usage']
+        if any(k[0] == prompt_name and k[2] == model_name and k[3] == topic['word'] for k in self.records):
+            raise KeyError(f"{prompt_name} 的 Prompt 內容與錄下時不同，請重新錄製 {model_name} / {topic['word']}")
+        raise KeyError(f"沒有錄到 {prompt_name} / {model_name} / {topic['word']} 的回應")
+
+
+class StubBackend:
+    """
+    本地替身模型：延遲、截斷、缺欄位都由固定種子決定，同樣的參數每次結果相同。
+    token 數以「字元數 / 4」粗估，只用來比較相對大小。
+    """
+    def __init__(self, latency=0.2, fail_rate=0.1, missing_rate=0.1, seed=0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.missing_rate = missing_rate
+        self.seed = seed
+
+    def generate(self, prompt_name, system_prompt, model_name, topic):
+        rng = random.Random(f"{self.seed}|{prompt_name}|{model_name}|{topic['word']}")
+        # lite 模型較快；Prompt 越長，輸入 token 越多
+        scale = 0.6 if "lite" in model_name else 1.0
+        latency = self.latency * scale * rng.uniform(0.7, 1.5)
+        time.sleep(latency)
+        card = {f: f"{topic['word']} 的 {f}" for f in DECODE_FIELDS
+                if rng.random() >= self.missing_rate}
+        card['category'], card['word'] = topic['category'], topic['word']
+        text = json.dumps(card, ensure_ascii=False)
+        if rng.random() < self.fail_rate:
+            text = text[: len(text) // 2]   # 模擬輸出被截斷
+        user_prompt = build_decode_prompt(topic['word'], topic['category'])
+        usage = {
+            'prompt_tokens': (len(system_prompt) + len(user_prompt)) // 4,
+            'output_tokens': len(text) // 4,
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['output_tokens']
+        return text, latency, usage
+
+
+def score_card(text):
+    """(JSON 是否解析成功, 20 個欄位中有內容的比例)"""
+    try:
+        card = parse_decode_result(text)
+    except ValueError:
+        return False, 0.0
+    if not isinstance(card, dict):
+        return False, 0.0
+    filled = sum(1 for f in DECODE_FIELDS if str(card.get(f) or "").strip() not in ("", "無"))
+    return True, filled / len(DECODE_FIELDS)
+
+
+def run_one(backend, prompt_name, system_prompt, model_name, topic, recorder=None):
+    result = {'prompt': prompt_name, 'model': model_name, 'word': topic['word'], 'category': topic['category']}
+    try:
+        text, latency, usage = backend.generate(prompt_name, system_prompt, model_name, topic)
+    except Exception as e:
+        result.update(error=str(e), parsed=False, completeness=0.0)
+        return result
+    parsed, completeness = score_card(text)
+    result.update(latency_s=latency, usage=usage, parsed=parsed, completeness=completeness, error=None)
+    if recorder is not None:
+        recorder(dict(result, prompt_sha=prompt_digest(system_prompt), text=text))
+    return result
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(results, min_parse=0.95, min_complete=0.95):
+    """依 (Prompt, 模型) 彙總；recommended 是達標設定中最快的 (同速時 token 少者優先)"""
+    groups = {}
+    for r in results:
+        groups.setdefault((r['prompt'], r['model']), []).append(r)
+    rows = []
+    for (prompt_name, model_name), items in groups.items():
+        ok = [r for r in items if r['error'] is None]
+        latencies = [r['latency_s'] for r in ok]
+        rows.append({
+            'prompt': prompt_name, 'model': model_name, 'n': len(items),
+            'errors': len(items) - len(ok),
+            'p50_s': round(percentile(latencies, 0.50), 2),
+            'p95_s': round(percentile(latencies, 0.95), 2),
+            'prompt_tokens': round(statistics.fmean(r['usage']['prompt_tokens'] for r in ok), 1) if ok else 0.0,
+            'output_tokens': round(statistics.fmean(r['usage']['output_tokens'] for r in ok), 1) if ok else 0.0,
+            'total_tokens': round(statistics.fmean(r['usage']['total_tokens'] for r in ok), 1) if ok else 0.0,
+            'parse_rate': round(sum(r['parsed'] for r in items) / len(items), 3),
+            'completeness': round(statistics.fmean(r['completeness'] for r in items), 3),
+            'full_cards': round(sum(r['completeness'] == 1.0 for r in items) / len(items), 3),
+        })
+    for row in rows:
+        row['valid'] = row['parse_rate'] >= min_parse and row['completeness'] >= min_complete
+    valid = [row for row in rows if row['valid']]
+    recommended = min(valid, key=lambda row: (row['p50_s'], row['total_tokens']), default=None)
+    return rows, recommended
+
+
+def run_bench(backend, topics, prompts, models, concurrency=4, record_path=None):
+    recorder = None
+    if record_path:
+        os.makedirs(os.path.dirname(os.path.abspath(record_path)), exist_ok=True)
+        record_file = open(record_path, "a", encoding="utf-8")
+        record_lock = threading.Lock()
+
+        def recorder(rec):
+            with record_lock:
+                record_file.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                record_file.flush()
+
+    tasks = [(p, text, m, t) for p, text in prompts.items() for m in models for t in topics]
+    t0 = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda task: run_one(backend, *task, recorder=recorder), tasks))
+    finally:
+        if recorder is not None:
+            record_file.close()
+            compact_records(record_path)
+    return results, time.perf_counter() - t0
+
+
+def print_report(rows, recommended, wall, results):
+    print(f"\n=== {len(results)} 次解碼｜{len(rows)} 個設定｜總耗時 {wall:.2f}s ===")
+    print(f"{'Prompt':<12}{'模型':<24}{'p50(s)':>8}{'p95(s)':>8}{'輸入tok':>9}{'輸出tok':>9}"
+          f"{'解析率':>8}{'完整度':>8}{'全欄位':>8}{'錯誤':>6}")
+    for row in sorted(rows, key=lambda r: (r['prompt'], r['model'])):
+        mark = "" if row['valid'] else "  ✗"
+        print(f"{row['prompt']:<12}{row['model']:<24}{row['p50_s']:>8}{row['p95_s']:>8}"
+              f"{row['prompt_tokens']:>9}{row['output_tokens']:>9}{row['parse_rate']:>8}"
+              f"{row['completeness']:>8}{row['full_cards']:>8}{row['errors']:>6}{mark}")
+    if recommended:
+        print(f"建議設定：Prompt「{recommended['prompt']}」+ {recommended['model']}"
+              f" (p50 {recommended['p50_s']}s，平均 {recommended['total_tokens']} tokens)")
+    else:
+        print("⚠️ 沒有設定達到解析率 / 完整度門檻。")
+    errors = [r for r in results if r['error']]
+    for r in errors[:5]:
+        print(f"  {r['prompt']} / {r['model']} / {r['word']}: {r['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Etymon Decoder 解碼 Prompt / 模型評測")
+    parser.add_argument("--backend", choices=["gemini", "replay", "stub"], default="stub")
+    parser.add_argument("--topics", help="主題檔 (JSON / JSONL)")
+    parser.add_argument("--prompt", action="append", default=[], help="Prompt 版本，如 short=prompts/short.txt (可重複)")
+    parser.add_argument("--model", action="append", default=[], help="要比較的模型 (可重複，預設 flash 與 flash-lite)")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時送出的主題數")
+    parser.add_argument("--record", help="gemini / stub：把回應錄進這個 JSONL (同一組合重錄會取代舊的)；replay：從這個檔案重播")
+    parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"), help="Gemini API 金鑰")
+    parser.add_argument("--stub-latency", type=float, default=0.2, help="替身模型的基準延遲 (秒)")
+    parser.add_argument("--stub-fail-rate", type=float, default=0.1, help="替身模型輸出被截斷的機率")
+    parser.add_argument("--stub-missing-rate", type=float, default=0.1, help="替身模型每個欄位缺漏的機率")
+    parser.add_argument("--seed", type=int, default=0, help="替身模型的隨機種子")
+    parser.add_argument("--min-parse", type=float, default=0.95, help="有效設定的最低 JSON 解析率")
+    parser.add_argument("--min-complete", type=float, default=0.95, help="有效設定的最低欄位完整度")
+    parser.add_argument("--json", help="另存完整報告為 JSON")
+    args = parser.parse_args()
+
+    if args.backend == "gemini":
+        if not args.api_key:
+            parser.error("gemini 後端需要 --api-key 或 GEMINI_API_KEY")
+        backend = GeminiBackend(args.api_key)
+    elif args.backend == "replay":
+        if not args.record:
+            parser.error("replay 後端需要 --record 指定錄下的回應")
+        backend = ReplayBackend(args.record)
+    else:
+        backend = StubBackend(args.stub_latency, args.stub_fail_rate, args.stub_missing_rate, args.seed)
+
+    topics = load_topics(args.topics)
+    prompts = load_prompts(args.prompt)
+    models = args.model or [DECODE_MODEL_FULL, DECODE_MODEL_LITE]
+    record_path = args.record if args.backend != "replay" else None
+
+    results, wall = run_bench(backend, topics, prompts, models, args.concurrency, record_path)
+    rows, recommended = summarize(results, args.min_parse, args.min_complete)
+    print_report(rows, recommended, wall, results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'wall_s': round(wall, 2), 'configs': rows, 'recommended': recommended,
+                       'results': results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
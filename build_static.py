@@ -0,0 +1,213 @@
+"""
+靜態唯讀版打包工具：把詞庫輸出成「依分類切分的 JSON + 預先建好的搜尋索引 + 預先合成的發音」，
+訪客的 首頁 / 學習與搜尋 / 測驗模式 流量可以直接交給任何靜態主機 (Nginx、GitHub Pages、CDN)，
+Streamlit 只需要服務管理員與解碼實驗室。
+
+用法範例：
+    python build_static.py --source master_db.json --out static_site
+    python build_static.py --source sheets --out static_site --audio-workers 8
+    python build_static.py --source "VocabularyDB - sheet1 (1).csv" --no-audio
+
+輸出結構：
+    static_site/
+        index.html            靜態瀏覽頁 (複製自 static/index.html)
+        manifest.json         版本、分類清單與各分片檔名
+        data/<slug>.json      每個分類一個分片
+        search_index.json     詞條清單 + 倒排索引 (英文詞素 / 中文字元 bigram)
+        audio/<hash>.mp3      每個單字的發音 (已存在的檔案會跳過，可增量重建)
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pandas as pd
+from gtts import gTTS
+
+from etymon_core import COL_NAMES, compact_db, english_only
+
+TEMPLATE_HTML = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "index.html")
+_EN_TOKEN_RE = re.compile(r"[a-z]{2,}")
+_CJK_RE = re.compile(r"[一-鿿]+")
+
+
+def load_source(source):
+    """讀取詞庫：'sheets' 走 App 的 fetch_db，其他視為本地 JSON / CSV / Parquet 檔"""
+    if source == "sheets":
+        # 只有讀試算表才需要 App 的連線設定 (會一併載入 streamlit)
+        from app import fetch_db
+        return fetch_db("Google Sheets")
+    lower = source.lower()
+    if lower.endswith(".csv"):
+        df = pd.read_csv(source, dtype=str)
+    elif lower.endswith(".parquet"):
+        df = pd.read_parquet(source)
+    else:
+        with open(source, "r", encoding="utf-8") as f:
+            df = pd.DataFrame(json.load(f))
+    for col in COL_NAMES:
+        if col not in df.columns:
+            df[col] = 0 if col == 'term' else "無"
+    df = df.dropna(subset=['word'])
+    return compact_db(df[COL_NAMES].reset_index(drop=True))
+
+
+def category_slug(name, used):
+    """分類名稱 → 檔名安全的 slug (中文分類用雜湊，重複時加序號)"""
+    base = re.sub(r"[^a-z0-9]+", "-", str(name).lower()).strip("-")
+    if not base:
+        base = "cat-" + hashlib.sha1(str(name).encode("utf-8")).hexdigest()[:8]
+    slug, n = base, 2
+    while slug in used:
+        slug, n = f"{base}-{n}", n + 1
+    used.add(slug)
+    return slug
+
+
+def audio_name(word):
+    spoken = english_only(word)
+    if not spoken:
+        return None
+    return hashlib.sha1(spoken.encode("utf-8")).hexdigest()[:16] + ".mp3"
+
+
+def search_tokens(row):
+    """倒排索引用的詞：單字 / 字根 / 意義中的英文詞素，加上定義中的中文字元 bigram"""
+    tokens = set()
+    for col in ('word', 'roots', 'meaning'):
+        value = row.get(col)
+        if isinstance(value, str):
+            tokens.update(_EN_TOKEN_RE.findall(value.lower()))
+    definition = row.get('definition')
+    if isinstance(definition, str):
+        for run in _CJK_RE.findall(definition):
+            tokens.update(run[i:i + 2] for i in range(max(len(run) - 1, 1)))
+    return tokens
+
+
+def _clean_record(row):
+    """JSON 分片：缺值輸出 null，term 轉成一般整數"""
+    out = {}
+    for col in COL_NAMES:
+        value = row.get(col)
+        if col == 'term':
+            out[col] = int(value) if value is not None and not pd.isna(value) else 0
+        else:
+            out[col] = None if value is None or pd.isna(value) else str(value)
+    return out
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def synth_to_file(text, path):
+    if os.path.exists(path):
+        return "skipped"
+    try:
+        fp = BytesIO()
+        gTTS(text=text, lang='en').write_to_fp(fp)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(fp.getvalue())
+        os.replace(tmp_path, path)
+        return "created"
+    except Exception:
+        return "failed"
+
+
+def build_bundle(df, out_dir, with_audio=True, audio_workers=4):
+    t0 = time.perf_counter()
+    os.makedirs(os.path.join(out_dir, "data"), exist_ok=True)
+
+    records = [_clean_record(r) for r in df.to_dict("records")]
+    version = hashlib.sha1(json.dumps(records, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+
+    # 1. 依分類切分片
+    used_slugs = set()
+    categories = []
+    entries = []
+    postings = {}
+    by_category = {}
+    for rec in records:
+        by_category.setdefault(rec['category'] or "未分類", []).append(rec)
+
+    for name in sorted(by_category):
+        rows = by_category[name]
+        slug = category_slug(name, used_slugs)
+        _write_json(os.path.join(out_dir, "data", f"{slug}.json"), rows)
+        categories.append({'name': name, 'slug': slug, 'file': f"data/{slug}.json", 'count': len(rows)})
+
+        # 2. 搜尋索引：entries 存 (分片, 分片內位置)，postings 存 token → entry id
+        for pos, rec in enumerate(rows):
+            entry_id = len(entries)
+            entries.append({
+                'w': rec['word'], 'c': slug, 'i': pos,
+                'd': (rec['definition'] or "")[:80],
+                'a': audio_name(rec['word']),
+            })
+            for token in search_tokens(rec):
+                postings.setdefault(token, []).append(entry_id)
+
+    _write_json(os.path.join(out_dir, "search_index.json"), {'version': version, 'entries': entries, 'postings': postings})
+
+    # 3. 預先合成發音 (受 gTTS 網路延遲限制，用執行緒池平行處理)
+    audio_stats = {'created': 0, 'skipped': 0, 'failed': 0}
+    if with_audio:
+        audio_dir = os.path.join(out_dir, "audio")
+        os.makedirs(audio_dir, exist_ok=True)
+        jobs = {}
+        for rec in records:
+            name = audio_name(rec['word'])
+            if name:
+                jobs[name] = english_only(rec['word'])
+        with ThreadPoolExecutor(max_workers=audio_workers) as pool:
+            for result in pool.map(lambda item: synth_to_file(item[1], os.path.join(audio_dir, item[0])), jobs.items()):
+                audio_stats[result] += 1
+
+    manifest = {
+        'version': version,
+        'generated_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'count': len(records),
+        'categories': categories,
+        'search_index': "search_index.json",
+        'audio': with_audio,
+    }
+    _write_json(os.path.join(out_dir, "manifest.json"), manifest)
+
+    if os.path.exists(TEMPLATE_HTML):
+        shutil.copyfile(TEMPLATE_HTML, os.path.join(out_dir, "index.html"))
+
+    return {
+        'count': len(records), 'categories': len(categories), 'tokens': len(postings),
+        'audio': audio_stats, 'version': version, 'seconds': round(time.perf_counter() - t0, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Etymon Decoder 靜態唯讀版打包")
+    parser.add_argument("--source", default="master_db.json", help="'sheets' 或本地 JSON / CSV / Parquet 檔")
+    parser.add_argument("--out", default="static_site", help="輸出目錄")
+    parser.add_argument("--no-audio", action="store_true", help="不預先合成發音")
+    parser.add_argument("--audio-workers", type=int, default=4, help="發音合成的平行數")
+    args = parser.parse_args()
+
+    df = load_source(args.source)
+    stats = build_bundle(df, args.out, with_audio=not args.no_audio, audio_workers=args.audio_workers)
+    print(
+        f"版本 {stats['version']}｜{stats['count']} 筆 / {stats['categories']} 個分類｜"
+        f"索引詞 {stats['tokens']}｜發音 新增 {stats['audio']['created']} 跳過 {stats['audio']['skipped']} "
+        f"失敗 {stats['audio']['failed']}｜耗時 {stats['seconds']}s → {args.out}/"
+    )
+
+
+if __name__ == "__main__":
+    main()
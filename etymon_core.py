@@ -0,0 +1,149 @@
+"""
+App 與離線工具 (import_datasets.py、build_static.py、bench_decode.py) 共用的純函式：
+欄位 schema、精簡表格佈局、解碼 Prompt 與回應解析。
+這裡不能匯入 streamlit —— 離線工具匯入時不應該觸發 App 的頁面設定與連線。
+"""
+import json
+import re
+
+import pandas as pd
+
+# ==========================================
+# 資料表 schema 與精簡佈局
+# ==========================================
+# 定義標準 21 個欄位名稱 (App 與匯入 / 打包 / 評測工具共用這份 schema)
+COL_NAMES = [
+    'category', 'roots', 'meaning', 'word', 'breakdown', 
+    'definition', 'phonetic', 'example', 'translation', 'native_vibe',
+    'synonym_nuance', 'visual_prompt', 'social_status', 'emotional_tone', 'street_usage',
+    'collocation', 'etymon_story', 'usage_warning', 'memory_hook', 'audio_tag',
+    'term'  # <-- 補上第 21 個欄位
+]
+
+# 低基數欄位 → category dtype (只有重複率夠高才轉，否則反而更佔空間)
+CATEGORICAL_COLS = ['category', 'roots', 'social_status', 'emotional_tone', 'audio_tag']
+CATEGORICAL_MAX_RATIO = 0.5
+
+def _text_dtype():
+    """長文字欄位優先使用 Arrow 字串，沒有 pyarrow 時退回 pandas 內建字串"""
+    try:
+        import pyarrow  # noqa: F401
+        return pd.StringDtype("pyarrow")
+    except ImportError:
+        return pd.StringDtype("python")
+
+def compact_value(v):
+    """單一格的正規化：缺值 /「無」/ 空字串 → None，其餘轉成字串"""
+    if v is None or (not isinstance(v, str) and pd.isna(v)):
+        return None
+    v = str(v)
+    return None if v.strip() in ("無", "") else v
+
+def compact_db(df):
+    """
+    將「全 object + 「無」填空」的表格轉成精簡記憶體佈局：
+    1. 低基數欄位轉 category。
+    2. 其餘文字欄改用 Arrow 字串。
+    3. 「無」/ 空字串改為真正的缺值 (null mask)，term 轉成 int8。
+    """
+    out = {}
+    text_dtype = _text_dtype()
+    for col in df.columns:
+        series = df[col]
+        if col == 'term':
+            out[col] = pd.to_numeric(series, errors='coerce').fillna(0).astype('int8')
+            continue
+
+        series = series.astype(object).where(series.notna(), None).map(compact_value)
+        non_null = series.notna().sum()
+        if col in CATEGORICAL_COLS and non_null and series.nunique() <= non_null * CATEGORICAL_MAX_RATIO:
+            out[col] = series.astype('category')
+        else:
+            out[col] = series.astype(text_dtype)
+    return pd.DataFrame(out, index=df.index)
+
+def english_only(text):
+    """英語濾網：只保留 gTTS 念得出來的英文、數字與連字號"""
+    cleaned = re.sub(r"[^a-zA-Z0-9\s\-\']", " ", str(text))
+    return " ".join(cleaned.split()).strip()
+
+# ==========================================
+# AI 解碼 Prompt 與回應解析
+# ==========================================
+DECODE_MODEL_FULL = 'gemini-2.5-flash'
+DECODE_MODEL_LITE = 'gemini-2.5-flash-lite'
+
+# 還原原本的中文 Prompt —— 固定不變的部分抽成 system instruction：
+# 每次呼叫的前綴完全相同，Gemini 2.5 會自動命中隱式快取，只有領域與主題需要重新計費。
+DECODE_SYSTEM_INSTRUCTION = """
+Role: 全領域知識解構專家 (Polymath Decoder).
+Task: 深度分析輸入內容，並將其解構為高品質、結構化的百科知識 JSON。
+
+使用者會在訊息中以【領域鎖定】指定你的專家身份，請務必以該專業視角進行解構、評論與推導。
+
+## 處理邏輯 (Field Mapping Strategy):
+1. category: 必須固定填寫為【領域鎖定】指定的領域名稱。
+2. word: 核心概念名稱 (標題)。
+3. roots: 底層邏輯 / 核心原理 / 關鍵公式。使用 LaTeX 格式並用 $ 包圍。
+4. meaning: 該概念解決了什麼核心痛點或其存在的本質意義。
+5. breakdown: 結構拆解。步驟流程或組成要素，逐步條列並使用 \\n 換行。
+6. definition: 用五歲小孩都能聽懂的話 (ELI5) 解釋該概念。
+7. phonetic: 關鍵年代、發明人名、或該領域的專門術語。標註正確發音與背景。若是外語詞彙，請先提供國際音標 (IPA) 或通用音譯，再針對其中的「專有名詞人名」或「關鍵術語」提供「注音+拼音」對照。
+8. example: 兩個以上最具代表性的實際應用場景。
+9. translation: 生活類比。以「🍎 生活比喻：」開頭。
+10. native_vibe: 專家視角。以「🌊 專家心法：」開頭。
+11. synonym_nuance: 相似概念對比與辨析。
+12. visual_prompt: 視覺化圖景描述。
+13. social_status: 在該領域的重要性評級。
+14. emotional_tone: 學習此知識的心理感受。
+15. street_usage: 避坑指南。常見認知誤區。
+16. collocation: 關聯圖譜。三個延伸知識點。
+17. etymon_story: 歷史脈絡或發現瞬間。
+18. usage_warning: 邊界條件與失效場景。
+19. memory_hook: 記憶金句。
+20. audio_tag: 相關標籤 (以 # 開頭)。
+
+## 輸出規範 (Strict JSON Rules):
+1. 必須輸出純 JSON 格式，不含任何 Markdown 標記 (如 ```json)。
+2. 必須遵循標準 JSON 格式，所有的鍵名 (Keys) 與字串值 (Values) 必須使用雙引號 (") 包裹。若內容中需要表示引號，請一律使用中文引號「」或單引號 '，嚴禁在字串內容中使用原始的雙引號。
+3. LaTeX 公式請使用單個反斜線格式，但在 JSON 內需雙重轉義。
+4. 換行統一使用 \\\\n。
+"""
+
+def build_decode_prompt(input_text, fixed_category):
+    """每次呼叫只送出會變動的部分：領域鎖定 + 解碼目標"""
+    return (
+        f"【領域鎖定】：你目前的身份是「{fixed_category}」專家，"
+        f"category 請填寫「{fixed_category}」。\n\n解碼目標：「{input_text}」"
+    )
+
+def build_decode_model(model_name, system_instruction=DECODE_SYSTEM_INSTRUCTION):
+    """
+    建立解碼用的 Gemini 模型物件：App (get_decode_model) 與評測工具共用同一組安全設定。
+    呼叫前需先 genai.configure(api_key=...)。
+    """
+    import google.generativeai as genai
+    from google.generativeai.types import HarmCategory, HarmBlockThreshold
+    safety_settings = {
+        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+    }
+    return genai.GenerativeModel(
+        model_name,
+        safety_settings=safety_settings,
+        system_instruction=system_instruction,
+    )
+
+def parse_decode_result(raw_res):
+    """從模型回應取出 JSON 物件；字串內有未跳脫的換行時修正後再試一次。失敗拋出 ValueError"""
+    match = re.search(r'\{.*\}', raw_res, re.DOTALL)
+    if not match:
+        raise ValueError("解析失敗：找不到 JSON 結構。")
+    json_str = match.group(0)
+    try:
+        return json.loads(json_str, strict=False)
+    except json.JSONDecodeError:
+        fixed_json = json_str.replace('\n', '\\n').replace('\r', '\\r')
+        return json.loads(fixed_json, strict=False)
@@ -0,0 +1,247 @@
+"""
+離線批次匯入工具：把外部辭源資料集 (Kaggle 等 CSV / JSON / JSONL) 轉成 COL_NAMES 格式，
+以行程池平行清洗，並用雜湊索引對既有 word 欄去重，最後寫成本地快照 (master_db.json)。
+
+用法範例：
+    python import_datasets.py etymology.csv --category 英語辭源 --map-pair lemma=word
+    python import_datasets.py a.jsonl b.csv --map mapping.json --workers 8 --out master_db.json
+
+產生的 master_db.json 可直接被 load_db(source_type="Local JSON") 讀取，
+整個流程只碰本地磁碟，不經過 Google Sheets API。
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from etymon_core import COL_NAMES
+
+# 常見外部資料集欄位 → 本專案欄位 (使用者以 --map / --map-pair 指定者優先)
+DEFAULT_ALIASES = {
+    'lemma': 'word', 'headword': 'word', 'entry': 'word', 'vocabulary': 'word',
+    'root': 'roots', 'morpheme': 'roots', 'morphemes': 'roots',
+    'gloss': 'definition', 'definitions': 'definition', 'sense': 'definition',
+    'ipa': 'phonetic', 'pronunciation': 'phonetic',
+    'etymology': 'etymon_story', 'origin': 'etymon_story',
+    'sentence': 'example', 'examples': 'example',
+    'domain': 'category', 'topic': 'category',
+}
+
+_WS_RE = re.compile(r"[ \t　]+")
+
+
+def word_key(word):
+    """去重用的雜湊鍵：NFKC + 小寫 + 去空白後取 8 bytes blake2b"""
+    norm = unicodedata.normalize("NFKC", str(word)).strip().lower()
+    norm = _WS_RE.sub(" ", norm)
+    return hashlib.blake2b(norm.encode("utf-8"), digest_size=8).digest()
+
+
+def _clean_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value != value:  # NaN
+        return ""
+    text = unicodedata.normalize("NFKC", str(value))
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines = [_WS_RE.sub(" ", line).strip() for line in text.split("\n")]
+    return "\n".join(line for line in lines if line).strip()
+
+
+def normalize_chunk(args):
+    """
+    行程池工作函式：把一批原始 dict 轉成標準欄位。
+    回傳 (rows, 無 word 被丟棄的筆數)。
+    """
+    records, mapping, default_category = args
+    rows = []
+    dropped = 0
+    for rec in records:
+        row = {}
+        for src, value in rec.items():
+            dst = mapping.get(src, mapping.get(str(src).strip().lower()))
+            if dst in COL_NAMES and not row.get(dst):
+                row[dst] = _clean_text(value)
+
+        if not row.get('word'):
+            dropped += 1
+            continue
+        if not row.get('category'):
+            row['category'] = default_category
+
+        # 與 load_db 一致：缺少的欄位補「無」，term 預設 0
+        for col in COL_NAMES:
+            if col == 'term':
+                row[col] = 0
+            elif not row.get(col):
+                row[col] = "無"
+        rows.append(row)
+    return rows, dropped
+
+
+def iter_source_chunks(path, chunk_rows):
+    """依副檔名逐塊讀取來源檔，每塊為 list[dict]"""
+    lower = path.lower()
+    if lower.endswith((".csv", ".tsv")):
+        sep = "\t" if lower.endswith(".tsv") else ","
+        for chunk in pd.read_csv(path, sep=sep, dtype=str, chunksize=chunk_rows, keep_default_na=False):
+            yield chunk.to_dict("records")
+    elif lower.endswith((".jsonl", ".ndjson")):
+        batch = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                batch.append(json.loads(line))
+                if len(batch) >= chunk_rows:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+    elif lower.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            # 支援 {"data": [...]} 或 {"word": {...}} 兩種常見包裝
+            data = data.get("data") or [dict(v, word=k) if isinstance(v, dict) else {"word": k, "definition": v}
+                                        for k, v in data.items()]
+        for start in range(0, len(data), chunk_rows):
+            yield data[start:start + chunk_rows]
+    else:
+        raise ValueError(f"不支援的檔案格式: {path}")
+
+
+def load_snapshot(path):
+    """讀取既有快照 (master_db.json 或 CSV 匯出檔)，不存在時回傳空表"""
+    if not path or not os.path.exists(path):
+        return pd.DataFrame(columns=COL_NAMES)
+    if path.lower().endswith(".csv"):
+        return pd.read_csv(path, dtype=str, keep_default_na=False)
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return pd.DataFrame(data) if data else pd.DataFrame(columns=COL_NAMES)
+
+
+def write_snapshot(df, path):
+    """原子寫入：先寫暫存檔再 os.replace，避免寫到一半被 App 讀到"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(df.to_dict("records"), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def build_mapping(map_file=None, pairs=()):
+    mapping = {c: c for c in COL_NAMES}
+    mapping.update(DEFAULT_ALIASES)
+    if map_file:
+        with open(map_file, "r", encoding="utf-8") as f:
+            mapping.update({str(k).strip().lower(): v for k, v in json.load(f).items()})
+    for pair in pairs:
+        src, _, dst = pair.partition("=")
+        if not dst or dst not in COL_NAMES:
+            raise ValueError(f"--map-pair 格式錯誤或目標欄位不存在: {pair}")
+        mapping[src.strip().lower()] = dst
+    return mapping
+
+
+def run_import(sources, existing_path, out_path, mapping, default_category,
+               workers=None, chunk_rows=5000, overwrite=False, dry_run=False):
+    t0 = time.perf_counter()
+    existing = load_snapshot(existing_path)
+    for col in COL_NAMES:
+        if col not in existing.columns:
+            existing[col] = 0 if col == 'term' else "無"
+    existing = existing[COL_NAMES]
+
+    # 雜湊索引：word_key -> 既有列位置
+    index = {word_key(w): i for i, w in enumerate(existing['word'].astype(str))}
+    stats = {"read": 0, "dropped": 0, "duplicates": 0, "updated": 0, "inserted": 0}
+    new_rows = []
+    updates = {}
+
+    def tasks():
+        for src in sources:
+            for chunk in iter_source_chunks(src, chunk_rows):
+                stats["read"] += len(chunk)
+                yield (chunk, mapping, default_category)
+
+    def merge(rows, dropped):
+        stats["dropped"] += dropped
+        for row in rows:
+            key = word_key(row['word'])
+            pos = index.get(key)
+            if pos is None:
+                index[key] = len(existing) + len(new_rows)
+                new_rows.append(row)
+            elif overwrite and pos < len(existing):
+                updates[pos] = row
+            else:
+                stats["duplicates"] += 1
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # 最多同時送出 2×workers 塊 (pool.map 會先把整個產生器讀完，大檔案會整份進記憶體)；
+        # 依送出順序取回結果，去重在主行程進行，確保「先出現者優先」的結果可重現
+        window = deque()
+        for task in tasks():
+            window.append(pool.submit(normalize_chunk, task))
+            if len(window) >= 2 * workers:
+                merge(*window.popleft().result())
+        while window:
+            merge(*window.popleft().result())
+
+    stats["inserted"] = len(new_rows)
+    stats["updated"] = len(updates)
+
+    if not dry_run and (new_rows or updates):
+        # 批次 upsert：覆寫的列整批指派，新列一次 concat
+        if updates:
+            positions = sorted(updates)
+            existing.iloc[positions] = pd.DataFrame([updates[p] for p in positions])[COL_NAMES].values
+        merged = pd.concat([existing, pd.DataFrame(new_rows, columns=COL_NAMES)], ignore_index=True)
+        write_snapshot(merged, out_path)
+        stats["total"] = len(merged)
+    else:
+        stats["total"] = len(existing) + (0 if dry_run else len(new_rows))
+
+    stats["seconds"] = round(time.perf_counter() - t0, 2)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Etymon Decoder 外部資料集批次匯入")
+    parser.add_argument("sources", nargs="+", help="CSV / TSV / JSON / JSONL 檔案")
+    parser.add_argument("--existing", default="master_db.json", help="既有快照 (JSON 或 CSV)，用於去重")
+    parser.add_argument("--out", default="master_db.json", help="輸出快照路徑")
+    parser.add_argument("--map", dest="map_file", help="欄位對應 JSON 檔：{\"來源欄\": \"目標欄\"}")
+    parser.add_argument("--map-pair", action="append", default=[], help="單一欄位對應，如 lemma=word")
+    parser.add_argument("--category", default="英語辭源", help="來源沒有分類時使用的預設分類")
+    parser.add_argument("--workers", type=int, default=None, help="行程池大小 (預設為 CPU 數)")
+    parser.add_argument("--chunk-rows", type=int, default=5000, help="每個工作批次的列數")
+    parser.add_argument("--overwrite", action="store_true", help="word 已存在時以新資料覆蓋")
+    parser.add_argument("--dry-run", action="store_true", help="只統計，不寫檔")
+    args = parser.parse_args()
+
+    mapping = build_mapping(args.map_file, args.map_pair)
+    stats = run_import(
+        args.sources, args.existing, args.out, mapping, args.category,
+        workers=args.workers, chunk_rows=args.chunk_rows,
+        overwrite=args.overwrite, dry_run=args.dry_run,
+    )
+    print(
+        f"讀取 {stats['read']} 筆｜新增 {stats['inserted']}｜覆蓋 {stats['updated']}｜"
+        f"重複略過 {stats['duplicates']}｜缺 word 丟棄 {stats['dropped']}｜"
+        f"快照共 {stats['total']} 筆｜耗時 {stats['seconds']}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
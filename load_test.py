@@ -0,0 +1,483 @@
+"""
+同時多 session 壓力測試：啟動一個真正的 Streamlit 伺服器 (單一行程 = 一個副本)，
+再用 N 個 websocket 客戶端同時連上去，依序走過 首頁 → 學習與搜尋 → 測驗模式，
+統計每一步重跑 (rerun) 的延遲百分位、失敗次數，以及伺服器行程的記憶體與 CPU。
+
+所有 session 共用同一個伺服器的 st.cache_resource、執行緒池、鎖與 GIL，
+量到的就是「一個副本能同時服務多少學習者」。客戶端照瀏覽器的方式送 BackMsg：
+一般元件觸發整頁重跑，片段 (st.fragment) 裡的按鈕只重跑那個片段。
+客戶端只用到 streamlit 本身依賴的 websockets 與 protobuf 訊息，不需要瀏覽器。
+
+Google Sheets、gTTS、Gemini 在伺服器行程裡全部換成本地替身，不會打到任何外部服務：
+    - Sheets：讀取本地 CSV / JSON 快照 (可用 --sheets-latency 模擬網路延遲)
+    - gTTS：回傳固定的假 MP3 bytes (可用 --tts-latency 模擬延遲)
+    - Gemini：回傳固定的 JSON 解碼結果
+
+用法範例：
+    python load_test.py --sessions 20 --iterations 3
+    python load_test.py --sessions 50 --data "VocabularyDB - sheet1 (1).csv" --json report.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import pandas as pd
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+DEFAULT_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "VocabularyDB - sheet1 (1).csv")
+ADMIN_PASSWORD = "load-test"
+FAKE_MP3 = b"ID3" + b"\x00" * 1024
+STEP_TIMEOUT = 120      # 單一步驟等待 script_finished 的秒數上限
+SAMPLE_INTERVAL = 0.2   # 伺服器 RSS / CPU 的取樣間隔 (秒)
+
+
+def install_stand_ins(data_path, sheets_latency=0.0, tts_latency=0.0):
+    """把外部服務換成本地替身 (在伺服器行程裡直接替換類別方法，App 每次重跑都會拿到替身)"""
+    import gtts
+    import google.generativeai as genai
+    import streamlit_gsheets
+
+    if data_path.lower().endswith(".csv"):
+        snapshot = pd.read_csv(data_path)
+    else:
+        with open(data_path, "r", encoding="utf-8") as f:
+            snapshot = pd.DataFrame(json.load(f))
+
+    def fake_read(self, *args, worksheet=None, **kwargs):
+        time.sleep(sheets_latency)
+        if worksheet == "metrics":
+            return pd.DataFrame(columns=['label', 'count'])
+        return snapshot.copy()
+
+    def fake_update(self, *args, data=None, **kwargs):
+        time.sleep(sheets_latency)
+        return data
+
+    streamlit_gsheets.GSheetsConnection.read = fake_read
+    streamlit_gsheets.GSheetsConnection.update = fake_update
+
+    class FakeTTS:
+        def __init__(self, text, lang='en', **kwargs):
+            self.text = text
+
+        def write_to_fp(self, fp):
+            time.sleep(tts_latency)
+            fp.write(FAKE_MP3)
+
+    gtts.gTTS = FakeTTS
+
+    class FakeResponse:
+        text = json.dumps({'category': '雜類', 'word': 'load test', 'definition': '壓力測試'}, ensure_ascii=False)
+        usage_metadata = None
+
+    class FakeModel:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def generate_content(self, prompt):
+            return FakeResponse()
+
+    genai.GenerativeModel = FakeModel
+    genai.configure = lambda **kwargs: None
+
+
+SECRETS = {
+    'ADMIN_PASSWORD': ADMIN_PASSWORD,
+    'GEMINI_API_KEY': "stand-in",
+    'connections': {'gsheets': {'spreadsheet': "https://docs.google.com/spreadsheets/d/load-test/edit"}},
+    'cache': {'backend': "none"},
+    # 替身只取代 conn.read；分塊讀取會直接連到 Google，壓測時關閉
+    'sheets': {'ranged_read': False},
+}
+
+
+# ==========================================
+# 伺服器行程
+# ==========================================
+def _toml_lines(table, prefix=""):
+    """SECRETS 只有字串 / 布林 / 巢狀表，手寫最小的 TOML 輸出即可"""
+    lines, subtables = [], []
+    for key, value in table.items():
+        if isinstance(value, dict):
+            subtables.append((key, value))
+        else:
+            lines.append(f"{key} = {json.dumps(value)}")
+    for key, value in subtables:
+        name = f"{prefix}.{key}" if prefix else key
+        lines += ["", f"[{name}]"] + _toml_lines(value, name)
+    return lines
+
+
+def serve(port, data_path, sheets_latency, tts_latency):
+    """--serve：裝替身後在這個行程裡啟動 Streamlit 伺服器 (工作目錄由父行程準備好 secrets)"""
+    install_stand_ins(data_path, sheets_latency, tts_latency)
+    from streamlit.web import bootstrap
+
+    flags = {'server_port': port, 'server_headless': True, 'server_fileWatcherType': "none",
+             'server_runOnSave': False, 'browser_gatherUsageStats': False}
+    bootstrap.load_config_options(flags)
+    bootstrap.run(APP_PATH, False, [], flags)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(data_path, sheets_latency, tts_latency):
+    """在暫存工作目錄 (.etymon_cache、secrets 都在裡面) 啟動伺服器，等健康檢查通過；回傳 (行程, 埠號, 目錄)"""
+    workdir = tempfile.mkdtemp(prefix="etymon-load-")
+    os.makedirs(os.path.join(workdir, ".streamlit"))
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w", encoding="utf-8") as f:
+        f.write("\n".join(_toml_lines(SECRETS)) + "\n")
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port), "--data", data_path,
+         "--sheets-latency", str(sheets_latency), "--tts-latency", str(tts_latency)],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, "server.log"), "wb"),
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"伺服器啟動失敗，請看 {workdir}/server.log")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as resp:
+                if resp.status == 200:
+                    return proc, port, workdir
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("伺服器在 60 秒內沒有通過健康檢查")
+
+
+def stop_server(proc, workdir):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+class ProcessSampler:
+    """讀 /proc/<pid> 取伺服器的 RSS 與累計 CPU 秒數 (非 Linux 平台回傳 None)"""
+    def __init__(self, pid):
+        self.pid = pid
+        self.page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+        self.ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self.peak_rss = 0
+
+    def rss(self):
+        try:
+            with open(f"/proc/{self.pid}/statm") as f:
+                value = int(f.read().split()[1]) * self.page_size
+        except (OSError, ValueError):
+            return None
+        self.peak_rss = max(self.peak_rss, value)
+        return value
+
+    def cpu_seconds(self):
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self.ticks   # utime + stime
+        except (OSError, ValueError, IndexError):
+            return None
+
+    async def watch(self, stop):
+        while not stop.is_set():
+            self.rss()
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+
+# ==========================================
+# websocket 客戶端 (模擬一個瀏覽器分頁)
+# ==========================================
+class WsSession:
+    """
+    一個 websocket 連線 = 伺服器上的一個 session。
+    記住目前畫面上的元件 (依 delta_path) 與自己設定過的元件值，每次重跑都帶上，
+    其餘元件維持伺服器端的預設值。
+    """
+    def __init__(self, port):
+        self.url = f"ws://127.0.0.1:{port}/_stcore/stream"
+        self.ws = None
+        self.elements = {}       # delta_path -> (元件種類, proto, fragment_id)
+        self.widget_values = {}  # widget id -> WidgetState (非觸發型的值)
+
+    async def connect(self):
+        import websockets
+
+        self.ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def rerun(self, trigger_id=None, fragment_id=""):
+        """送出一次重跑並讀到 script_finished；回傳錯誤訊息 (成功為 None)"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+
+        msg = BackMsg()
+        state = msg.rerun_script
+        state.fragment_id = fragment_id
+        for ws_state in self.widget_values.values():
+            state.widget_states.widgets.add().CopyFrom(ws_state)
+        if trigger_id is not None:
+            trigger = state.widget_states.widgets.add()
+            trigger.id = trigger_id
+            trigger.trigger_value = True
+        await self.ws.send(msg.SerializeToString())
+        return await asyncio.wait_for(self._read_run(fragment_id), STEP_TIMEOUT)
+
+    async def _read_run(self, fragment_id):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        elements, error = {}, None
+        while True:
+            fm = ForwardMsg()
+            fm.ParseFromString(await self.ws.recv())
+            kind = fm.WhichOneof("type")
+            if kind == "delta" and fm.delta.WhichOneof("type") == "new_element":
+                element = fm.delta.new_element
+                el_kind = element.WhichOneof("type")
+                if el_kind == "exception" and error is None:
+                    error = f"{element.exception.type}: {element.exception.message}"
+                elements[tuple(fm.metadata.delta_path)] = (el_kind, getattr(element, el_kind),
+                                                          fm.delta.fragment_id)
+            elif kind == "script_finished":
+                status = fm.script_finished
+                if status == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    # App 自己呼叫了 st.rerun()：伺服器會接著再跑一次，畫面以最後一次為準
+                    elements, error = {}, None
+                    continue
+                if status == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    error = error or "compile error"
+                break
+        if fragment_id:
+            self.elements = {p: e for p, e in self.elements.items() if e[2] != fragment_id}
+            self.elements.update(elements)
+        else:
+            self.elements = elements
+        return error
+
+    def find(self, kind, label):
+        for el_kind, proto, fragment_id in self.elements.values():
+            if el_kind == kind and proto.label == label:
+                return proto, fragment_id
+        raise LookupError(f"找不到{kind}：{label}")
+
+    async def click(self, label):
+        proto, fragment_id = self.find("button", label)
+        return await self.rerun(trigger_id=proto.id, fragment_id=fragment_id)
+
+    async def set_value(self, kind, label, value):
+        """radio / selectbox / text_input 都以字串值傳送"""
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        proto, fragment_id = self.find(kind, label)
+        self.widget_values[proto.id] = WidgetState(id=proto.id, string_value=value)
+        return await self.rerun(fragment_id=fragment_id)
+
+
+async def run_session(port, session_id, iterations, timings, errors, start=None):
+    """
+    單一 session 的使用者流程；每一步記錄 (步驟名稱, 秒數, 是否成功)。
+    動作拋出例外、App 畫出例外或逾時都算失敗，失敗的步驟照樣計入，不會從統計中消失。
+    start 是等待所有 session 連線完成後同時開始的 asyncio.Event。
+    """
+    session = WsSession(port)
+
+    async def step(name, action):
+        t0 = time.perf_counter()
+        try:
+            error = await action()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        timings.append((name, time.perf_counter() - t0, error is None))
+        if error is not None:
+            errors.append(f"[{session_id}] {name}: {error}")
+
+    try:
+        await session.connect()
+        if start is not None:
+            await start.wait()
+        await step("首頁 (冷啟動)", session.rerun)
+        for _ in range(iterations):
+            await step("首頁 換一批", lambda: session.click("🔄 換一批"))
+            await step("切到 學習與搜尋", lambda: session.set_value("radio", "功能選單", "學習與搜尋"))
+            await step("下一張卡", lambda: session.click("🎲 隨機探索下一字 (Next Word)"))
+            await step("搜尋", lambda: session.set_value("text_input", "🔍 搜尋書架內容...", "a"))
+            await step("切到 測驗模式", lambda: session.set_value("radio", "功能選單", "測驗模式"))
+            await step("抽一題", lambda: session.click("🎲 抽一題"))
+            await step("揭曉答案", lambda: session.click("揭曉答案"))
+            await step("回到 首頁", lambda: session.set_value("radio", "功能選單", "首頁"))
+    except Exception as e:
+        errors.append(f"[{session_id}] 連線失敗: {e}")
+    return session
+
+
+# ==========================================
+# 統計與報告
+# ==========================================
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _latency_summary(values):
+    return {
+        'p50_ms': round(percentile(values, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 1),
+        'max_ms': round(max(values) * 1000, 1) if values else 0.0,
+    }
+
+
+def _mb(value):
+    return round(value / 2**20, 1) if value is not None else None
+
+
+async def drive(port, sampler, sessions, iterations):
+    """暖機一個 session 後，讓 N 個 session 同時連上並跑完流程；量測期間持續取樣伺服器資源"""
+    warm_timings, warm_errors = [], []
+    warm = await run_session(port, "warmup", 1, warm_timings, warm_errors)
+    await warm.close()
+    if warm_errors:
+        raise RuntimeError(f"暖機失敗：{warm_errors[0]}")
+    baseline_rss = sampler.rss()
+    cpu_before = sampler.cpu_seconds()
+    sampler.peak_rss = baseline_rss or 0
+
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(sampler.watch(stop))
+    start = asyncio.Event()
+    timings, errors = [], []
+    tasks = [asyncio.create_task(run_session(port, i, iterations, timings, errors, start))
+             for i in range(sessions)]
+    await asyncio.sleep(0.5)   # 讓所有連線先建立
+    started = time.perf_counter()
+    start.set()
+    clients = await asyncio.gather(*tasks)
+    wall = time.perf_counter() - started
+    # 所有 session 仍然連著：這時的 RSS 才包含每個 session 的狀態
+    after_rss = sampler.rss()
+    cpu_after = sampler.cpu_seconds()
+    stop.set()
+    await watcher
+    for client in clients:
+        await client.close()
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return timings, errors, wall, {
+        'baseline_rss': baseline_rss, 'after_rss': after_rss, 'peak_rss': sampler.peak_rss or None, 'cpu_s': cpu,
+    }
+
+
+def run_load_test(sessions, iterations, data_path, sheets_latency=0.0, tts_latency=0.0):
+    proc, port, workdir = start_server(os.path.abspath(data_path), sheets_latency, tts_latency)
+    try:
+        timings, errors, wall, server = asyncio.run(drive(port, ProcessSampler(proc.pid), sessions, iterations))
+    finally:
+        stop_server(proc, workdir)
+
+    by_step = {}
+    for name, seconds, ok in timings:
+        by_step.setdefault(name, []).append((seconds, ok))
+    # 延遲百分位只用成功的步驟 (失敗常常提早結束，會讓數字看起來更好)，失敗次數另外列出
+    steps = {
+        name: dict(_latency_summary([s for s, ok in items if ok]),
+                   n=len(items), failed=sum(1 for _, ok in items if not ok))
+        for name, items in by_step.items()
+    }
+    ok_values = [s for _, s, ok in timings if ok]
+    failed = sum(1 for _, _, ok in timings if not ok)
+    per_session = None
+    if server['baseline_rss'] is not None and server['after_rss'] is not None:
+        per_session = (server['after_rss'] - server['baseline_rss']) / sessions
+    return {
+        'sessions': sessions,
+        'iterations': iterations,
+        'wall_s': round(wall, 2),
+        'reruns': len(timings),
+        'failed': failed,
+        'failure_rate': round(failed / len(timings), 3) if timings else 0.0,
+        'reruns_per_s': round(len(timings) / wall, 1) if wall else 0.0,
+        'overall': dict(_latency_summary(ok_values),
+                        mean_ms=round(statistics.fmean(ok_values) * 1000, 1) if ok_values else 0.0),
+        'steps': steps,
+        'server': {
+            'baseline_rss_mb': _mb(server['baseline_rss']),
+            'after_rss_mb': _mb(server['after_rss']),
+            'peak_rss_mb': _mb(server['peak_rss']),
+            'per_session_kb': round(per_session / 1024, 1) if per_session is not None else None,
+            'cpu_s': round(server['cpu_s'], 2) if server['cpu_s'] is not None else None,
+            # 平均使用幾顆核心；Python 程式碼受 GIL 限制，接近 1.0 代表已經飽和
+            'cpu_cores': round(server['cpu_s'] / wall, 2) if server['cpu_s'] is not None and wall else None,
+        },
+        'errors': errors[:20],
+        'error_count': len(errors),
+    }
+
+
+def print_report(report):
+    print(f"\n=== {report['sessions']} 個同時 session × {report['iterations']} 輪 (單一伺服器) ===")
+    print(f"總耗時 {report['wall_s']}s｜重跑 {report['reruns']} 次 (失敗 {report['failed']}，"
+          f"{report['failure_rate']:.1%})｜{report['reruns_per_s']} 次/秒")
+    o = report['overall']
+    print(f"成功步驟延遲 p50 {o['p50_ms']}ms｜p95 {o['p95_ms']}ms｜p99 {o['p99_ms']}ms｜平均 {o['mean_ms']}ms")
+    print(f"{'步驟':<16}{'次數':>6}{'失敗':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for name, s in report['steps'].items():
+        print(f"{name:<16}{s['n']:>6}{s['failed']:>6}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}")
+    m = report['server']
+    if m['baseline_rss_mb'] is None:
+        print("伺服器記憶體 / CPU：此平台無法讀取 /proc，略過")
+    else:
+        print(f"伺服器記憶體：暖機後 {m['baseline_rss_mb']} MB → 全部 session 連線中 {m['after_rss_mb']} MB"
+              f" (峰值 {m['peak_rss_mb']} MB)｜每個 session 約 +{m['per_session_kb']} KB")
+        print(f"伺服器 CPU：{m['cpu_s']} 秒｜平均 {m['cpu_cores']} 顆核心")
+    if report['error_count']:
+        print(f"⚠️ 錯誤 {report['error_count']} 筆 (前幾筆)：")
+        for e in report['errors'][:5]:
+            print("  ", e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Etymon Decoder 同時多 session 壓力測試")
+    parser.add_argument("--sessions", type=int, default=10, help="同時連上伺服器的 session 數")
+    parser.add_argument("--iterations", type=int, default=2, help="每個 session 重複流程的輪數")
+    parser.add_argument("--data", default=DEFAULT_DATA, help="Sheets 替身使用的 CSV / JSON 快照")
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="模擬 Sheets 每次呼叫的延遲 (秒)")
+    parser.add_argument("--tts-latency", type=float, default=0.0, help="模擬 gTTS 每次合成的延遲 (秒)")
+    parser.add_argument("--json", help="另存完整報告為 JSON")
+    # 內部用：由 run_load_test 以子行程啟動伺服器
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.data, args.sheets_latency, args.tts_latency)
+        return
+
+    report = run_load_test(args.sessions, args.iterations, args.data, args.sheets_latency, args.tts_latency)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+import streamlit as st
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """直接匯入 app.py 測純函式：本地快取 (.etymon_cache) 寫在暫存目錄，st 快取每個測試清空"""
+    monkeypatch.chdir(tmp_path)
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    import app
+    return app
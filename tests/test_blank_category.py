@@ -0,0 +1,56 @@
+"""
+回歸測試：試算表裡有空白分類時，學習與搜尋 / 測驗模式不能當掉。
+compact_db 會把空白分類轉成缺值，分類選單必須排除它。
+"""
+import os
+
+import pandas as pd
+import pytest
+import streamlit as st
+import streamlit_gsheets
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+ROWS = pd.DataFrame([
+    {'word': "benevolent", 'category': "英語辭源", 'definition': "善意的", 'roots': "bene", 'meaning': "good"},
+    {'word': "entropy", 'category': "物理科學", 'definition': "亂度", 'roots': "tropos", 'meaning': "turn"},
+    {'word': "orphan", 'category': None, 'definition': "沒有分類", 'roots': "orph", 'meaning': "bereft"},
+])
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # App 的本地快取寫在工作目錄下，換到暫存目錄避免弄髒專案
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(streamlit_gsheets.GSheetsConnection, "read",
+                        lambda self, *args, **kwargs: ROWS.copy())
+    monkeypatch.setattr(streamlit_gsheets.GSheetsConnection, "update",
+                        lambda self, *args, data=None, **kwargs: data)
+    st.cache_data.clear()
+    st.cache_resource.clear()
+
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.secrets['connections'] = {'gsheets': {'spreadsheet': "https://docs.google.com/spreadsheets/d/test/edit"}}
+    at.secrets['cache'] = {'backend': "none"}
+    at.secrets['sheets'] = {'ranged_read': False}
+    at.run()
+    assert not at.exception
+    return at
+
+
+def test_learn_page_with_blank_category(app):
+    app.sidebar.radio[0].set_value("學習與搜尋").run()
+    assert not app.exception
+    assert app.selectbox[0].options == ["全部", "物理科學", "英語辭源"]
+
+
+def test_quiz_with_blank_category(app):
+    app.sidebar.radio[0].set_value("測驗模式").run()
+    assert not app.exception
+    assert app.selectbox[0].options == ["物理科學", "英語辭源"]
+
+    for option in app.selectbox[0].options:
+        app.selectbox[0].set_value(option).run()
+        next(b for b in app.button if b.label == "🎲 抽一題").click().run()
+        assert not app.exception
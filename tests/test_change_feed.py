@@ -0,0 +1,159 @@
+"""
+變更紀錄 (publish_change → read_changes → SnapshotStore.catch_up / apply) 與衍生索引的增量更新：
+修補後的快照、以及 INDEX_PATCHERS 更新出來的索引，都要跟整份重建的結果一致。
+"""
+import pandas as pd
+import pytest
+
+from test_snapshot_positions import make_source
+
+WORDS = ["genotype", "phenotype", "vision", "visible", "revise", "tele", "telephone", "phone"]
+
+
+def source_rows(words):
+    return [{'word': w, 'category': "英語辭源" if i % 2 else "生物", 'roots': f"{w[:4]} + {w[-4:]}",
+             'definition': f"{w} 的定義", 'meaning': "m", 'phonetic': f"/{w}/", 'breakdown': f"{w} 的拆解"}
+            for i, w in enumerate(words)]
+
+
+def rebuild(app, rows):
+    """全部重讀：以 word (不分大小寫) 整列 upsert，保留第一次出現的位置"""
+    merged = {}
+    for row in rows:
+        merged[row['word'].lower()] = row
+    return app.compact_db(pd.DataFrame(list(merged.values())).reindex(columns=app.COL_NAMES))
+
+
+CHANGES = [
+    {'word': "vision", 'definition': "改寫的定義", 'roots': "vis + ion", 'category': "英語辭源",
+     'phonetic': "/ˈvɪʒən/", 'breakdown': "vis-ion"},
+    {'word': "Biology", 'definition': "生命的學問", 'roots': "bio + logy", 'category': "生物",
+     'phonetic': "/baɪˈɑləʤi/", 'breakdown': "bio-logy"},
+    {'word': "telephone", 'definition': "遠方的聲音", 'roots': "tele + phone", 'category': "新分類",
+     'phonetic': "/ˈtɛləfoʊn/", 'breakdown': "tele-phone"},
+]
+
+
+def test_apply_changes_matches_rebuild(app_module):
+    app = app_module
+    base = app.compact_db(pd.DataFrame(source_rows(WORDS)).reindex(columns=app.COL_NAMES))
+    base.attrs['token'] = 1
+    patched = app.apply_changes(base, CHANGES)
+    expected = rebuild(app, source_rows(WORDS) + CHANGES)
+
+    assert patched.attrs['patch'] == {'parent': 1, 'rows': [2, 6, len(WORDS)]}
+    assert patched.attrs['token'] != 1
+    for col in app.COL_NAMES:
+        assert patched[col].astype(object).where(patched[col].notna(), None).tolist() == \
+            expected[col].astype(object).where(expected[col].notna(), None).tolist(), col
+    # 舊快照不動
+    assert base.loc[2, 'definition'] == "vision 的定義" and len(base) == len(WORDS)
+
+
+def test_catch_up_reads_feed_and_is_idempotent(app_module):
+    app = app_module
+    store = app.SnapshotStore()
+    store.put("Google Sheets", make_source(app, ["alpha", "beta"]), 0)
+    seqs = [app.publish_change({'word': "gamma", 'definition': "g"}),
+            app.publish_change({'word': "beta", 'definition': "b2"})]
+    assert seqs == [1, 2]
+    assert app.read_changes(0, 2) == [{'word': "gamma", 'definition': "g"}, {'word': "beta", 'definition': "b2"}]
+
+    entry = store.catch_up("Google Sheets", 2)
+    assert entry['feed_seq'] == 2
+    assert list(entry['df']['word']) == ["alpha", "beta", "gamma"]
+    assert entry['df'].loc[1, 'definition'] == "b2"
+
+    # 同一段序號重送不會再套一次 (同一個 DataFrame 物件，索引不必更新)
+    assert store.apply("Google Sheets", [{'word': "delta"}], feed_seq=2)['df'] is entry['df']
+    assert store.catch_up("Google Sheets", 2)['df'] is entry['df']
+
+
+def test_catch_up_with_missing_feed_falls_back_to_refresh(app_module, monkeypatch):
+    app = app_module
+    store = app.SnapshotStore()
+    first = store.put("Google Sheets", make_source(app, ["alpha"]), 0)
+    refreshed = []
+    monkeypatch.setattr(store, "refresh_async", lambda source_type, generation: refreshed.append(source_type))
+    # 序號 1..3 從未寫入 (或已過期)：不能只套用一部分
+    assert store.catch_up("Google Sheets", 3)['df'] is first
+    assert refreshed == ["Google Sheets"]
+
+
+def index_outputs(app, name, index, df):
+    """索引的可觀察輸出 (整份重建與增量更新應該相同)"""
+    if name == 'prefix':
+        return [index.complete(p) for p in ["", "v", "vi", "vis", "tele", "phone", "bio", "gen", "zzz"]]
+    if name == 'sound':
+        return [index.lookup(w) for w in WORDS + ["biology", "vizhun", "telefone"]]
+    if name == 'near_dup':
+        queries = [dict(r) for r in source_rows(WORDS)] + CHANGES
+        return ([sorted(index.query(q)) for q in queries],
+                [sorted(c) for c in index.clusters()])
+    raise AssertionError(name)
+
+
+BUILDERS = {'prefix': 'PrefixIndex', 'sound': 'SoundIndex', 'near_dup': 'NearDupIndex'}
+
+
+@pytest.mark.parametrize("compact", [1024, 1])
+@pytest.mark.parametrize("name", sorted(BUILDERS))
+def test_patched_index_matches_rebuild(app_module, monkeypatch, name, compact):
+    app = app_module
+    monkeypatch.setattr(app, "PATCH_COMPACT", compact)
+    builder = getattr(app, BUILDERS[name])
+    built = []
+
+    def counted(df):
+        built.append(df)
+        return builder(df)
+
+    base = app.compact_db(pd.DataFrame(source_rows(WORDS)).reindex(columns=app.COL_NAMES))
+    base.attrs['token'] = 1
+
+    first = app.get_db_index(name, base, counted)
+    before = index_outputs(app, name, first, base)
+    df = base
+    # 一次一筆地套用，每一版都跟整份重建比對 (compact=1 時會反覆攤平基底)
+    for change in CHANGES + [{'word': "vision", 'definition': "再改一次", 'roots': "vid"},
+                             {'word': "biology", 'definition': "生命的學問", 'roots': "bio + logy"}]:
+        df = app.apply_changes(df, [change])
+        patched = app.get_db_index(name, df, counted)
+        assert index_outputs(app, name, patched, df) == index_outputs(app, name, builder(df), df)
+    # 只有第一次整份建立，之後都是增量更新
+    assert built == [base] and patched is not first
+    # 舊版本索引仍被拿著舊快照的 session 使用，內容不能被修補改到
+    assert index_outputs(app, name, first, base) == before
+
+
+def test_patched_distractors_for_changed_rows(app_module):
+    app = app_module
+    base = app.compact_db(pd.DataFrame(source_rows(WORDS)).reindex(columns=app.COL_NAMES))
+    base.attrs['token'] = 1
+    first = app.get_db_index('distractors', base, app.build_distractor_index)
+    before = first.copy()
+    df = app.apply_changes(base, CHANGES)
+    patched = app.get_db_index('distractors', df, app.build_distractor_index)
+    full = app.build_distractor_index(df)
+    # 變動列自己的選項與重建相同；其他列依設計沿用舊表
+    rows = df.attrs['patch']['rows']
+    assert (patched[rows] == full[rows]).all()
+    assert (patched[:len(base)][[i for i in range(len(base)) if i not in rows]] ==
+            before[[i for i in range(len(base)) if i not in rows]]).all()
+    assert (first == before).all()
+
+
+def test_layered_map_shares_base(app_module, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app, "PATCH_COMPACT", 2)
+    base = {'a': 1, 'b': 2}
+    v1 = app.LayeredMap(base)
+    v2 = v1.derive()
+    v2['c'] = 3
+    del v2['a']
+    assert v2.base is base and dict(v2.items()) == {'b': 2, 'c': 3}
+    assert dict(v1.items()) == {'a': 1, 'b': 2}
+    v2['d'] = 4
+    v3 = v2.derive()   # 差異層超過上限：攤平成新的基底，舊基底不動
+    assert v3.base is not base and v3.delta == {} and dict(v3.items()) == {'b': 2, 'c': 3, 'd': 4}
+    assert base == {'a': 1, 'b': 2}
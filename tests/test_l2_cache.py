@@ -0,0 +1,52 @@
+"""L2 快取：Redis 退回本地檔案時要留下原因；檔案快取定期清掉過期項目"""
+import os
+import time
+
+
+def entry_files(cache):
+    return sorted(name for sub in os.listdir(cache.root) if len(sub) == 2
+                  for name in os.listdir(os.path.join(cache.root, sub)) if len(name) == 40)
+
+
+def test_redis_failure_falls_back_with_reason(app_module, tmp_path, caplog):
+    app = app_module
+    cache = app.make_l2_cache({'backend': "redis", 'url': "redis://127.0.0.1:1/0", 'path': str(tmp_path / "l2")})
+    assert isinstance(cache, app.FileCache)
+    assert "本地檔案快取" in cache.fallback_reason
+    assert any("L2 快取" in r.getMessage() for r in caplog.records)
+
+    assert app.make_l2_cache({'path': str(tmp_path / "l2")}).fallback_reason is None
+    assert app.make_l2_cache({'backend': "none"}) is None
+
+
+def test_sweep_removes_only_expired_entries(app_module, tmp_path):
+    app = app_module
+    cache = app.FileCache(str(tmp_path / "l2"))
+    cache.set("short", b"x", ttl=1)
+    cache.set("long", b"y", ttl=3600)
+    cache.set("forever", b"z")
+    cache.incr("counter")
+    os.makedirs(os.path.join(cache.root, "snapshots"))
+
+    assert cache.sweep(now=time.time() + 10) == 1
+    assert cache.get("short") is None
+    assert cache.get("long") == b"y" and cache.get("forever") == b"z" and cache.get("counter") == b"1"
+    assert len(entry_files(cache)) == 3
+    assert os.path.isdir(os.path.join(cache.root, "snapshots"))
+
+
+def test_set_triggers_background_sweep(app_module, tmp_path, monkeypatch):
+    app = app_module
+    cache = app.FileCache(str(tmp_path / "l2"))
+    cache.set("old", b"x", ttl=0.01)
+    time.sleep(0.05)
+    # 還沒到清理間隔：過期檔案先留著 (讀取時當作未命中)
+    cache.set("fresh", b"y", ttl=3600)
+    assert len(entry_files(cache)) == 2
+
+    monkeypatch.setattr(app, "FILE_CACHE_SWEEP_SECONDS", 0)
+    cache.set("fresh2", b"z", ttl=3600)
+    deadline = time.time() + 5
+    while len(entry_files(cache)) != 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert cache.get("old") is None and len(entry_files(cache)) == 2
@@ -0,0 +1,41 @@
+"""近似重複分群：超過 LSH_MAX_BUCKET 的桶細分後比對，結果與不設上限時相同"""
+import random
+
+import pandas as pd
+
+COMMON = "photosynthesis converts light energy into chemical energy stored in glucose "
+
+
+def families(app, n_families=6, size=8, mutations=4, seed=1):
+    """每個家族共用一段長文字 (所以全部擠在同幾個大桶)，家族內只差幾個字元"""
+    rng = random.Random(seed)
+    rows = []
+    for f in range(n_families):
+        base = COMMON + "".join(rng.choice("abcdefghij ") for _ in range(40))
+        for v in range(size):
+            text = list(base)
+            for _ in range(mutations):
+                text[rng.randrange(len(COMMON), len(text))] = rng.choice("klmnop")
+            rows.append({'word': f"w{f}_{v}", 'definition': "".join(text)})
+    return app.compact_db(pd.DataFrame(rows).reindex(columns=app.COL_NAMES))
+
+
+def normalized(groups):
+    return sorted(sorted(g) for g in groups)
+
+
+def test_oversized_buckets_are_split_not_truncated(app_module, monkeypatch):
+    app = app_module
+    index = app.NearDupIndex(families(app))
+    expected = normalized(index.clusters())
+    assert len(expected) == 6
+    monkeypatch.setattr(app, "LSH_MAX_BUCKET", 3)
+    assert normalized(index.clusters()) == expected
+
+
+def test_identical_rows_in_oversized_bucket(app_module, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app, "LSH_MAX_BUCKET", 3)
+    rows = [{'word': "same", 'definition': COMMON} for _ in range(10)] + [{'word': "other", 'definition': "xyz"}]
+    index = app.NearDupIndex(app.compact_db(pd.DataFrame(rows).reindex(columns=app.COL_NAMES)))
+    assert normalized(index.clusters()) == [list(range(10))]
@@ -0,0 +1,62 @@
+"""離線工具 (匯入 / 打包 / 評測) 只依賴 etymon_core，不載入 streamlit 與 App 本身"""
+import json
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_tools_do_not_import_streamlit():
+    code = ("import sys, import_datasets, build_static, bench_decode; "
+            "assert 'streamlit' not in sys.modules and 'app' not in sys.modules")
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+
+
+def test_import_keeps_first_occurrence_across_chunks(tmp_path):
+    import import_datasets
+
+    words = [f"w{i % 7}" for i in range(40)]
+    src = tmp_path / "src.csv"
+    pd.DataFrame({'lemma': words, 'gloss': [f"d{i}" for i in range(40)]}).to_csv(src, index=False)
+    out = tmp_path / "out.json"
+    # 每塊 3 列、2 個 worker：送出視窗只有 4 塊，結果仍依來源順序合併
+    stats = import_datasets.run_import([str(src)], None, str(out), import_datasets.build_mapping(),
+                                       "英語辭源", workers=2, chunk_rows=3)
+    rows = json.loads(out.read_text(encoding="utf-8"))
+    assert [r['word'] for r in rows] == [f"w{i}" for i in range(7)]
+    assert [r['definition'] for r in rows] == [f"d{i}" for i in range(7)]
+    assert stats['read'] == 40 and stats['duplicates'] == 33
+
+
+def test_bench_record_replaces_and_replay_checks_prompt(tmp_path):
+    import bench_decode
+
+    path = str(tmp_path / "runs.jsonl")
+    topics = bench_decode.DEFAULT_TOPICS[:3]
+    prompts = {'current': bench_decode.DECODE_SYSTEM_INSTRUCTION}
+    models = [bench_decode.DECODE_MODEL_LITE]
+    stub = bench_decode.StubBackend(latency=0, fail_rate=0, missing_rate=0)
+    bench_decode.run_bench(stub, topics, prompts, models, record_path=path)
+    bench_decode.run_bench(stub, topics, prompts, models, record_path=path)
+    # 同一組合重錄會取代舊的，不會累積
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == len(topics)
+
+    replay = bench_decode.ReplayBackend(path)
+    results, _ = bench_decode.run_bench(replay, topics, prompts, models)
+    assert all(r['error'] is None and r['parsed'] for r in results)
+
+    # 同名 Prompt 改過內容：不能重播舊 Prompt 的回應
+    results, _ = bench_decode.run_bench(replay, topics, {'current': "edited prompt"}, models)
+    assert all("不同" in r['error'] for r in results)
+
+
+def test_decode_model_factory_uses_given_system_instruction():
+    from etymon_core import build_decode_model
+
+    model = build_decode_model("gemini-2.5-flash-lite", "short prompt")
+    assert "short prompt" in str(model._system_instruction)
+    assert len(model._safety_settings) == 4
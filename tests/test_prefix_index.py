@@ -0,0 +1,23 @@
+"""搜尋框自動完成：排名涵蓋整個前綴區段，不只字典序最前面的一段"""
+import pandas as pd
+
+
+def test_short_prefix_ranks_whole_range(app_module):
+    app = app_module
+    # 300 個只出現一次的 ab.. 字根排在字典序前面；最後的字根 azur 出現在 50 列
+    rows = [{'word': f"x{i}", 'roots': f"ab{chr(97 + i // 26)}{chr(97 + i % 26)}", 'definition': "d"}
+            for i in range(300)]
+    rows += [{'word': f"blue{i}", 'roots': "azur", 'definition': "d"} for i in range(50)]
+    df = app.compact_db(pd.DataFrame(rows).reindex(columns=app.COL_NAMES))
+    index = app.PrefixIndex(df)
+    top = index.complete("a", limit=3)
+    assert top[0] == ("azur", 'root', 50)
+    assert [t[0] for t in top[1:]] == ["abaa", "abab"]
+
+    # 增量更新後 (基底 + extra_keys 兩段) 排名一樣涵蓋整段
+    df2 = df.copy()
+    df2.attrs['token'] = 1
+    patched = app.apply_changes(df2, [{'word': "apex", 'roots': "azur"}])
+    index2 = index.patched(patched, patched.attrs['patch']['rows'])
+    assert index2.complete("a", limit=2) == [("apex", 'word', 1), ("azur", 'root', 51)]
+    assert index.complete("a", limit=1) == [("azur", 'root', 50)]
@@ -0,0 +1,167 @@
+"""
+寫入日誌 (SheetsJournal) 的重放流程：append → applying → ack → compact，
+以及試算表掛掉、寫回成功但 ack 前中斷、計數表讀取失敗時的行為。
+"""
+import json
+from functools import partial
+
+import pandas as pd
+import pytest
+from gspread.exceptions import WorksheetNotFound
+
+URL = "https://docs.google.com/spreadsheets/d/main/edit"
+
+
+class FakeConn:
+    """以 (spreadsheet, worksheet) 為鍵的記憶體試算表"""
+    def __init__(self):
+        self.sheets = {}
+        self.down = False            # 讀寫都失敗 (整個服務掛掉)
+        self.fail_read = {}          # worksheet -> 要拋出的例外
+        self.crash_after_update = False
+
+    def read(self, spreadsheet=None, worksheet=None, ttl=None):
+        if self.down:
+            raise ConnectionError("sheets down")
+        if worksheet in self.fail_read:
+            raise self.fail_read[worksheet]
+        if (spreadsheet, worksheet) not in self.sheets:
+            if worksheet is not None:
+                raise WorksheetNotFound(worksheet)
+            return pd.DataFrame()
+        return self.sheets[(spreadsheet, worksheet)].copy()
+
+    def update(self, spreadsheet=None, worksheet=None, data=None):
+        if self.down:
+            raise ConnectionError("sheets down")
+        self.sheets[(spreadsheet, worksheet)] = data.copy()
+        if self.crash_after_update:
+            # 寫回已經成功，但在 ack 落地前中斷
+            raise SystemError("crashed before ack")
+
+
+@pytest.fixture
+def env(app_module, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app, "call_sheets", partial(app.call_sheets, base_delay=0))
+    published = []
+    monkeypatch.setattr(app, "commit_entry", lambda row, source_type="Google Sheets": published.append(row['word']))
+    conn = FakeConn()
+    conn.sheets[(URL, None)] = pd.DataFrame([{'word': "alpha", 'definition': "a"}])
+    return app, app.get_sheets_journal(), conn, published
+
+
+def journal_lines(journal):
+    with open(journal.path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def feedback(app, conn):
+    return conn.sheets[(app.FEEDBACK_URL, None)]
+
+
+def test_outage_keeps_entry_pending_and_unpublished(env):
+    app, journal, conn, published = env
+    conn.down = True
+    journal.append('entry', {'word': "beta", 'definition': "b"})
+    assert journal.replay(conn, URL) == 0
+    assert journal.pending == 1
+    # 寫回前不能發布到變更紀錄
+    assert published == []
+
+    # 這段期間重新讀表的快照仍要看得到這一筆
+    base = app.compact_db(pd.DataFrame([{'word': "alpha", 'definition': "a"}]).reindex(columns=app.COL_NAMES))
+    assert list(app.with_pending_entries(base)['word']) == ["alpha", "beta"]
+
+    conn.down = False
+    assert journal.replay(conn, URL) == 1
+    assert journal.pending == 0
+    assert published == ["beta"]
+    assert list(conn.sheets[(URL, None)]['word']) == ["alpha", "beta"]
+    assert list(app.with_pending_entries(base)['word']) == ["alpha"]
+
+
+def test_compaction_keeps_only_pending_entries(env):
+    app, journal, conn, published = env
+    journal.append('entry', {'word': "beta", 'definition': "b"})
+    journal.replay(conn, URL)
+    assert journal_lines(journal) == []
+
+    conn.down = True
+    entry_id = journal.append('report', {'word': "alpha", 'issue': "typo"})
+    journal.replay(conn, URL)
+    lines = journal_lines(journal)
+    assert [rec['id'] for rec in lines] == [entry_id]
+    assert not any('ack' in rec or 'applying' in rec for rec in lines)
+    assert lines[0]['_applying'] is True
+
+    # 重新啟動 (新的日誌物件) 仍看得到未完成的條目
+    assert app.SheetsJournal(journal.path).pending == 1
+
+
+def test_reports_are_appended(env):
+    app, journal, conn, published = env
+    report = {'word': "alpha", 'issue': "typo"}
+    journal.append('report', report)
+    journal.append('report', report)
+    journal.replay(conn, URL)
+    journal.append('report', report)
+    journal.replay(conn, URL)
+    # 同一個字可以被回報多次，不會以 word 合併
+    assert len(feedback(app, conn)) == 3
+
+
+def test_crash_between_update_and_ack_does_not_double_append(env):
+    app, journal, conn, published = env
+    journal.append('report', {'word': "alpha", 'issue': "typo", 'term': 1})
+    conn.crash_after_update = True
+    assert journal.replay(conn, URL) == 0
+    assert journal.pending == 1
+    assert len(feedback(app, conn)) == 1
+
+    conn.crash_after_update = False
+    journal.append('report', {'word': "beta", 'issue': "missing", 'term': 1})
+    assert journal.replay(conn, URL) == 2
+    assert list(feedback(app, conn)['word']) == ["alpha", "beta"]
+    assert journal.pending == 0
+
+
+def test_failed_write_before_update_is_appended_on_retry(env):
+    app, journal, conn, published = env
+    conn.sheets[(app.FEEDBACK_URL, None)] = pd.DataFrame([{'word': "alpha", 'issue': "old"}])
+    conn.fail_read[None] = ConnectionError("read timeout")
+    journal.append('report', {'word': "beta", 'issue': "x"})
+    journal.replay(conn, URL)
+    assert journal.pending == 1
+
+    del conn.fail_read[None]
+    journal.replay(conn, URL)
+    # 上次在讀取就失敗：表尾不是這一筆，要照常附加
+    assert list(feedback(app, conn)['word']) == ["alpha", "beta"]
+
+
+def test_metrics_read_error_keeps_entries_pending(env):
+    app, journal, conn, published = env
+    conn.sheets[(URL, "metrics")] = pd.DataFrame([{'label': "home", 'count': 41}])
+    conn.fail_read["metrics"] = ConnectionError("429 quota exceeded")
+    journal.append('metric', {'label': "home", 'key': "label"})
+    journal.append('entry', {'word': "beta", 'definition': "b"})
+    journal.replay(conn, URL)
+    # 計數表沒有被只含待寫計數的新表蓋掉，其他組照常寫回
+    assert conn.sheets[(URL, "metrics")].to_dict("records") == [{'label': "home", 'count': 41}]
+    assert journal.pending == 1
+    assert published == ["beta"]
+
+    del conn.fail_read["metrics"]
+    journal.replay(conn, URL)
+    assert conn.sheets[(URL, "metrics")].to_dict("records") == [{'label': "home", 'count': 42}]
+    assert journal.pending == 0
+
+
+def test_missing_metrics_worksheet_starts_empty(env):
+    app, journal, conn, published = env
+    journal.append('metric', {'label': "quiz", 'key': "label"})
+    journal.append('metric', {'label': "quiz", 'key': "label"})
+    journal.replay(conn, URL)
+    assert conn.sheets[(URL, "metrics")].to_dict("records") == [{'label': "quiz", 'count': 2}]
+    assert journal.pending == 0
@@ -0,0 +1,77 @@
+"""斷路器的 half-open 試探，以及快照背景更新的連線傳遞與失敗退避"""
+import threading
+import time
+
+import pandas as pd
+
+
+def test_half_open_allows_a_single_probe(app_module):
+    breaker = app_module.CircuitBreaker(failure_threshold=2, cooldown=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    breaker.opened_at -= 61
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(breaker.allow())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results.count(True) == 1
+
+    # 試探失敗：重新斷路
+    breaker.record_failure()
+    assert breaker.is_open and not breaker.allow()
+
+    breaker.opened_at -= 61
+    assert breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open and breaker.allow() and breaker.allow()
+
+
+def wait_refresh(store, source_type):
+    deadline = time.time() + 5
+    while source_type in store.refreshing and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_refresh_uses_script_thread_connection_and_backs_off(app_module, monkeypatch):
+    app = app_module
+    conn = object()
+    monkeypatch.setattr(app, "sheets_source", lambda source_type: (conn, "https://example/sheet"))
+    calls = []
+
+    def failing_fetch(source_type, generation, conn=None, url=None):
+        calls.append((conn, url, threading.current_thread().name))
+        raise ConnectionError("429")
+
+    monkeypatch.setattr(app, "fetch_db", failing_fetch)
+    store = app.SnapshotStore()
+    store.refresh_async("Google Sheets", 0)
+    wait_refresh(store, "Google Sheets")
+    assert calls == [(conn, "https://example/sheet", "db-refresh-Google Sheets")]
+    assert store.last_error["Google Sheets"] == "429"
+
+    # 退避期間內的重跑不再啟動更新
+    store.refresh_async("Google Sheets", 0)
+    wait_refresh(store, "Google Sheets")
+    assert len(calls) == 1
+
+    # 退避結束再試；連續失敗後退避加倍
+    count, failed_at = store.failures["Google Sheets"]
+    store.failures["Google Sheets"] = (count, failed_at - app.DB_RETRY_SECONDS - 1)
+    store.refresh_async("Google Sheets", 0)
+    wait_refresh(store, "Google Sheets")
+    assert len(calls) == 2
+    count, failed_at = store.failures["Google Sheets"]
+    assert count == 2
+    store.failures["Google Sheets"] = (count, failed_at - app.DB_RETRY_SECONDS - 1)
+    assert store.backing_off("Google Sheets")
+
+    # 成功後清除失敗紀錄
+    monkeypatch.setattr(app, "fetch_db", lambda *args, **kwargs: pd.DataFrame(columns=app.COL_NAMES))
+    store.failures.clear()
+    store.refresh_async("Google Sheets", 0)
+    wait_refresh(store, "Google Sheets")
+    assert "Google Sheets" not in store.failures and "Google Sheets" not in store.last_error
@@ -0,0 +1,94 @@
+"""
+核心欄位投影 + 本地 Parquet 快照：
+- session_state 裡的卡片 (entry_dict) 帶著舊快照的列位置，背景刷新換成新快照後，
+  補長文欄位必須以 word 重新定位，不能讀到別的字。
+- 列表搜尋仍比對全部欄位；快照檔清理不能刪到共用目錄裡其他副本的檔案。
+"""
+import pandas as pd
+
+
+def make_source(app, words):
+    rows = [{'word': w, 'category': "英語辭源", 'definition': f"{w} 的定義",
+             'roots': w[:3], 'meaning': "m", 'breakdown': f"{w} 的拆解", 'example': f"{w} 的例句"}
+            for w in words]
+    return app.compact_db(pd.DataFrame(rows).reindex(columns=app.COL_NAMES))
+
+
+def test_hydrate_after_source_reorder(app_module):
+    app = app_module
+    store = app.SnapshotStore()
+    first = store.put("Google Sheets", make_source(app, ["alpha", "beta", "gamma"]), 0)
+    card = app.entry_dict(first, app._word_position(first, "alpha"))
+    assert app.hydrate_row(card, first)['breakdown'] == "alpha 的拆解"
+
+    # 第二次讀取時來源換了順序，alpha 不在原本的位置上
+    second = store.put("Google Sheets", make_source(app, ["gamma", "beta", "alpha"]), 0)
+    assert second.attrs['snapshot_path'] != first.attrs['snapshot_path']
+    row = app.hydrate_row(card, second)
+    assert row['word'] == "alpha"
+    assert row['breakdown'] == "alpha 的拆解"
+    assert row['example'] == "alpha 的例句"
+
+
+def test_hydrate_word_removed_from_source(app_module):
+    app = app_module
+    store = app.SnapshotStore()
+    first = store.put("Google Sheets", make_source(app, ["alpha", "beta"]), 0)
+    card = app.entry_dict(first, app._word_position(first, "alpha"))
+
+    second = store.put("Google Sheets", make_source(app, ["beta", "gamma"]), 0)
+    row = app.hydrate_row(card, second)
+    # 新快照沒有 alpha：只留核心欄位，不能把 beta 的長文欄位補進來
+    assert row['word'] == "alpha"
+    assert 'breakdown' not in row
+
+
+def test_hydrate_same_snapshot_after_patch(app_module):
+    app = app_module
+    store = app.SnapshotStore()
+    store.put("Google Sheets", make_source(app, ["alpha", "beta"]), 0)
+    store.apply("Google Sheets", [{'word': "delta", 'definition': "d", 'breakdown': "delta 的拆解"}])
+    df = store.get("Google Sheets")['df']
+    card = app.entry_dict(df, app._word_position(df, "delta"))
+    assert app.hydrate_row(card, df)['breakdown'] == "delta 的拆解"
+    assert app.hydrate_row(app.entry_dict(df, app._word_position(df, "beta")), df)['breakdown'] == "beta 的拆解"
+
+
+def full_search(df, search):
+    """投影前的行為：在全部欄位上比對"""
+    mask = df.apply(lambda x: x.astype("string").str.contains(search, case=False, regex=False, na=False)).any(axis=1)
+    return list(df.index[mask])
+
+
+def test_list_search_covers_heavy_columns(app_module):
+    app = app_module
+    source = make_source(app, ["alpha", "beta", "gamma"])
+    store = app.SnapshotStore()
+    df = store.put("Google Sheets", source, 0)
+    assert 'example' not in df.columns
+    for search in ["beta 的例句", "拆解", "ALPHA", "nothing"]:
+        assert list(app.search_rows(df, search)) == full_search(source, search)
+
+    # 之後才寫入的列 (overlay) 也要搜得到長文欄位
+    store.apply("Google Sheets", [{'word': "delta", 'definition': "d", 'example': "unique phrase"}])
+    df = store.get("Google Sheets")['df']
+    assert list(df.loc[app.search_rows(df, "UNIQUE PHRASE"), 'word']) == ["delta"]
+    # 改寫既有列：以 overlay 為準，不再命中快照檔裡的舊內容
+    store.apply("Google Sheets", [{'word': "beta", 'definition': "b", 'example': "rewritten"}])
+    df = store.get("Google Sheets")['df']
+    assert list(app.search_rows(df, "beta 的例句")) == []
+    assert list(df.loc[app.search_rows(df, "rewritten"), 'word']) == ["beta"]
+
+
+def test_snapshot_pruning_keeps_other_processes_files(app_module):
+    app = app_module
+    source = make_source(app, ["alpha"])
+    other = app.write_local_snapshot(source, "Google Sheets")
+    # 模擬共用目錄裡另一個副本的檔案 (不同主機 / PID)
+    foreign = other.replace(f"-{app.os.getpid()}-", "-999999-")
+    app.os.rename(other, foreign)
+    for _ in range(app.SNAPSHOT_KEEP + 2):
+        app.write_local_snapshot(source, "Google Sheets")
+    names = app.os.listdir(app.SNAPSHOT_DIR)
+    assert app.os.path.basename(foreign) in names
+    assert len(names) == app.SNAPSHOT_KEEP + 1